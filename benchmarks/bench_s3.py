@@ -0,0 +1,231 @@
+## throughput and latency benchmarks for the s3 code paths, run against a local s3 stand-in. 
+import os
+import time
+import argparse
+import threading
+import io
+import tarfile
+import multiprocessing
+
+import common
+from common import analyze,Interface_S3,clients,telemetry
+
+def parse_list(s):
+    return [int(v) for v in s.split(",") if v]
+
+def bench_transfer(client,args,workdir):
+    """Measure upload throughput of Interface_S3.upload_many, and download throughput and requests per file of analyze.get_results, across file sizes and counts. 
+
+    """
+    results = []
+    for size in parse_list(args.sizes):
+        for count in parse_list(args.counts):
+            params = {"size_kb":size,"count":count,"workers":args.workers}
+            localdir = os.path.join(workdir,"files_{}_{}".format(size,count))
+            os.makedirs(localdir)
+            for i in range(count):
+                with open(os.path.join(localdir,"file{:05d}.bin".format(i)),"wb") as f:
+                    f.write(os.urandom(size*1024))
+            jobprefix = "bench/results/transfer_{}_{}".format(size,count)
+            common.clear_prefix(client,args.bucket,jobprefix)
+            transfers = [(os.path.join(localdir,f),"s3://{}/{}/process_results/{}".format(args.bucket,jobprefix,f)) for f in sorted(os.listdir(localdir))]
+            megabytes = size*count/1024
+
+            config = Interface_S3.TransferConfig(max_concurrency = args.workers)
+            start = time.perf_counter()
+            Interface_S3.upload_many(clients.get_client("s3",max_pool_connections = args.workers),transfers,config = config)
+            seconds = time.perf_counter()-start
+            results.append(common.result("upload_throughput",params,"MB/s",megabytes/seconds,True))
+            results.append(common.result("upload_files_per_second",params,"files/s",count/seconds,True))
+
+            outdir = os.path.join(workdir,"out_{}_{}".format(size,count))
+            os.makedirs(outdir)
+            telemetry.recorder.enable()
+            start = time.perf_counter()
+            analyze.get_results(args.bucket,jobprefix,outdir,workers = args.workers)
+            seconds = time.perf_counter()-start
+            requests = sum(op["requests"] for op in telemetry.recorder.summary()["operations"].values())
+            results.append(common.result("download_throughput",params,"MB/s",megabytes/seconds,True))
+            results.append(common.result("download_files_per_second",params,"files/s",count/seconds,True))
+            results.append(common.result("download_requests_per_file",params,"requests/file",requests/count,False))
+    return results
+
+def bench_listing(client,args,workdir):
+    """Measure latency of ls_name (time to first key and to the full listing) and of list_results, for prefixes holding different numbers of keys. 
+
+    """
+    results = []
+    for nb_keys in parse_list(args.key_counts):
+        params = {"keys":nb_keys}
+        prefix = "bench/listing_{}/".format(nb_keys)
+        group = "bench_group_{}".format(nb_keys)
+        if len(analyze.ls_name(args.bucket,prefix)) != nb_keys:
+            common.put_keys(client,args.bucket,[prefix+"file{:06d}".format(i) for i in range(nb_keys)])
+            common.put_keys(client,args.bucket,["{}/results/job__{:06d}/logs/certificate.txt".format(group,i) for i in range(nb_keys)])
+
+        start = time.perf_counter()
+        next(analyze.iter_names(args.bucket,prefix))
+        results.append(common.result("ls_name_first_key_latency",params,"s",time.perf_counter()-start,False))
+        start = time.perf_counter()
+        analyze.ls_name(args.bucket,prefix)
+        results.append(common.result("ls_name_latency",params,"s",time.perf_counter()-start,False))
+        start = time.perf_counter()
+        list(analyze.list_results(args.bucket,group,refresh = True))
+        results.append(common.result("list_results_latency",params,"s",time.perf_counter()-start,False))
+    return results
+
+def bench_polling(client,args,workdir):
+    """Measure the time setup_polling takes to notice that a job has finished, for jobs that finish after different delays, and the time it then takes to download the results. 
+
+    """
+    results = []
+    for delay in parse_list(args.poll_delays):
+        params = {"delay_s":delay,"interval_s":args.poll_interval}
+        jobprefix = "bench/results/polling_{}".format(delay)
+        common.clear_prefix(client,args.bucket,jobprefix)
+        client.put_object(Bucket = args.bucket,Key = jobprefix+"/logs/certificate.txt",Body = b"")
+        finished = {}
+        def finish_job():
+            time.sleep(delay)
+            client.put_object(Bucket = args.bucket,Key = jobprefix+"/process_results/end.txt",Body = b"")
+            finished["time"] = time.perf_counter()
+        thread = threading.Thread(target = finish_job)
+        thread.start()
+        outdir = os.path.join(workdir,"polling_{}".format(delay))
+        os.makedirs(outdir)
+        ## time detection up to the first get_end that sees the end file, and the download of results after it separately. 
+        detected = {}
+        get_end,get_results = analyze.get_end,analyze.get_results
+        def timed_get_end(*call_args,**call_kwargs):
+            ended = get_end(*call_args,**call_kwargs)
+            if ended and "time" not in detected:
+                detected["time"] = time.perf_counter()
+            return ended
+        def timed_get_results(*call_args,**call_kwargs):
+            start = time.perf_counter()
+            summary = get_results(*call_args,**call_kwargs)
+            if "time" in detected:
+                detected["download"] = time.perf_counter()-start
+            return summary
+        analyze.get_end,analyze.get_results = timed_get_end,timed_get_results
+        try:
+            analyze.setup_polling(args.bucket,jobprefix,outdir,step = args.poll_interval,timeout = delay+10*args.poll_interval)
+        finally:
+            analyze.get_end,analyze.get_results = get_end,get_results
+        thread.join()
+        results.append(common.result("polling_detection_latency",params,"s",detected["time"]-finished["time"],False))
+        results.append(common.result("polling_download_time",params,"s",detected["download"],False))
+    return results
+
+def bench_archive(client,args,workdir):
+    """Measure the time analyze.get_results takes to retrieve a job's results file by file, and by extracting an archive of the same files, across file sizes and counts. Prints the smallest count at which the archive is faster for each size. 
+
+    """
+    results = []
+    for size in parse_list(args.archive_sizes):
+        crossover = None
+        for count in parse_list(args.archive_counts):
+            params = {"size_kb":size,"count":count,"workers":args.workers}
+            body = os.urandom(size*1024)
+            names = ["file{:05d}.bin".format(i) for i in range(count)]
+            files_prefix = "bench/results/archive_files_{}_{}".format(size,count)
+            archive_prefix = "bench/results/archive_tar_{}_{}".format(size,count)
+            for prefix in [files_prefix,archive_prefix]:
+                common.clear_prefix(client,args.bucket,prefix)
+            common.put_keys(client,args.bucket,["{}/process_results/{}".format(files_prefix,name) for name in names],body = body)
+            buf = io.BytesIO()
+            with tarfile.open(fileobj = buf,mode = "w:gz") as archive:
+                for name in names:
+                    info = tarfile.TarInfo(name)
+                    info.size = len(body)
+                    archive.addfile(info,io.BytesIO(body))
+            client.put_object(Bucket = args.bucket,Key = archive_prefix+"/process_results/results.tar.gz",Body = buf.getvalue())
+
+            seconds = {}
+            for mode,prefix in [("files",files_prefix),("archive",archive_prefix)]:
+                outdir = os.path.join(workdir,"archive_{}_{}_{}".format(mode,size,count))
+                os.makedirs(outdir)
+                start = time.perf_counter()
+                analyze.get_results(args.bucket,prefix,outdir,workers = args.workers,archive = mode == "archive")
+                seconds[mode] = time.perf_counter()-start
+                results.append(common.result("get_results_{}_latency".format(mode),params,"s",seconds[mode],False))
+            results.append(common.result("archive_speedup",params,"x",seconds["files"]/seconds["archive"],True))
+            if crossover is None and seconds["archive"] < seconds["files"]:
+                crossover = count
+        print("archive retrieval is faster from {} files of {} KB".format(crossover,size) if crossover is not None else "archive retrieval was not faster for files of {} KB".format(size))
+    return results
+
+def upload_large(endpoint_url,bucket,localpath,key,mode,chunksize,workers,queue):
+    """Upload a single large file in a fresh process, so that its memory use is not mixed with earlier runs, and put the throughput and memory peaks on queue. 
+    mode is "transfer_manager" (S3Transfer.upload_file), "read" (upload_resumable reading parts into memory) or "mmap" (upload_resumable sending parts from a memory map). 
+
+    """
+    clients.set_session(common.EndpointSession(endpoint_url))
+    Interface_S3.statepath = os.path.join(os.path.dirname(localpath),"state")
+    config = Interface_S3.TransferConfig(multipart_threshold = chunksize,multipart_chunksize = chunksize,max_concurrency = workers)
+    client = clients.get_client("s3",max_pool_connections = workers)
+    client.list_buckets() ## open a connection and load the service model before measuring. 
+    with common.MemorySampler() as memory:
+        start = time.perf_counter()
+        if mode == "transfer_manager":
+            Interface_S3.S3Transfer(client,config).upload_file(localpath,bucket,key)
+        else:    
+            Interface_S3.upload_resumable(client,localpath,bucket,key,config = config,use_mmap = mode == "mmap")
+        seconds = time.perf_counter()-start
+    queue.put((seconds,memory.peak_rss,memory.peak_anon))
+
+def bench_large_upload(client,args,workdir):
+    """Measure throughput and peak memory of uploading single large files through the transfer manager, and through upload_resumable with and without memory mapped parts. Each upload runs in its own process. 
+
+    """
+    results = []
+    context = multiprocessing.get_context("spawn")
+    chunksize = args.large_chunksize*1024**2
+    for size in parse_list(args.large_sizes):
+        localpath = os.path.join(workdir,"large_{}.bin".format(size))
+        with open(localpath,"wb") as f:
+            block = os.urandom(1024**2)
+            for i in range(size):
+                f.write(block)
+        for mode in ["transfer_manager","read","mmap"]:
+            params = {"size_mb":size,"mode":mode,"chunksize_mb":args.large_chunksize,"workers":args.workers}
+            key = "bench/large/{}_{}.bin".format(size,mode)
+            queue = context.Queue()
+            process = context.Process(target = upload_large,args = (args.endpoint_url,args.bucket,localpath,key,mode,chunksize,args.workers,queue))
+            process.start()
+            seconds,peak_rss,peak_anon = queue.get()
+            process.join()
+            client.delete_object(Bucket = args.bucket,Key = key)
+            results.append(common.result("large_upload_throughput",params,"MB/s",size/seconds,True))
+            results.append(common.result("large_upload_peak_rss",params,"MB",peak_rss/1024**2,False))
+            if peak_anon is not None:
+                results.append(common.result("large_upload_peak_anon",params,"MB",peak_anon/1024**2,False))
+        os.remove(localpath)
+    return results
+
+suites = {"transfer":bench_transfer,"listing":bench_listing,"polling":bench_polling,"archive":bench_archive,"large_upload":bench_large_upload}
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark s3 transfers, listings and polling against a local s3 stand-in (localstack or moto server).")
+    common.add_common_arguments(parser)
+    parser.add_argument("--suites",default = ",".join(suites),help = "comma separated suites to run (default {})".format(",".join(suites)))
+    parser.add_argument("--sizes",default = "16,1024,16384",help = "comma separated file sizes in KB for the transfer suite (default 16,1024,16384)")
+    parser.add_argument("--counts",default = "1,16,128",help = "comma separated file counts for the transfer suite (default 1,16,128)")
+    parser.add_argument("--workers",type = int,default = 8,help = "number of parallel transfers (default 8)")
+    parser.add_argument("--key-counts",default = "100,1000,10000",help = "comma separated numbers of keys for the listing suite. Add 100000 for the full range. (default 100,1000,10000)")
+    parser.add_argument("--poll-delays",default = "1,5,20",help = "comma separated job durations in seconds for the polling suite (default 1,5,20)")
+    parser.add_argument("--archive-sizes",default = "4,256",help = "comma separated file sizes in KB for the archive suite (default 4,256)")
+    parser.add_argument("--archive-counts",default = "1,16,128,1024",help = "comma separated file counts for the archive suite (default 1,16,128,1024)")
+    parser.add_argument("--large-sizes",default = "64,512",help = "comma separated file sizes in MB for the large_upload suite (default 64,512)")
+    parser.add_argument("--large-chunksize",type = int,default = 8,help = "part size in MB for the large_upload suite (default 8)")
+    parser.add_argument("--poll-interval",type = int,default = 60,help = "maximum polling interval in seconds for the polling suite (default 60)")
+    args = parser.parse_args()
+
+    client,workdir = common.setup(args)
+    results = []
+    for suite in args.suites.split(","):
+        results += suites[suite](client,args,workdir)
+    common.finish(args,"s3",results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+## benchmark for the startup latency of the cli. 
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+here = os.path.abspath(os.path.dirname(__file__))
+srcpath = os.path.join(os.path.dirname(here),"src")
+
+def time_command(args,repeats):
+    """Run the cli with the given arguments in fresh processes, and return the wall clock time of each run in seconds. 
+
+    """
+    env = dict(os.environ,PYTHONPATH = os.pathsep.join([srcpath,os.environ.get("PYTHONPATH","")]))
+    command = [sys.executable,"-c","from neurocaas_cli.main import main; main()"]+args
+    times = []
+    for r in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command,env = env,stdout = subprocess.DEVNULL,stderr = subprocess.DEVNULL)
+        times.append(time.perf_counter()-start)
+    return times
+
+def imports_boto3():
+    """Check if importing the cli entrypoint imports boto3. 
+
+    """
+    env = dict(os.environ,PYTHONPATH = os.pathsep.join([srcpath,os.environ.get("PYTHONPATH","")]))
+    check = "import sys; import neurocaas_cli.main; print('boto3' in sys.modules)"
+    return subprocess.run([sys.executable,"-c",check],env = env,stdout = subprocess.PIPE,universal_newlines = True).stdout.strip() == "True"
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure startup latency of neurocaas-cli.")
+    parser.add_argument("-n","--repeats",type = int,default = 10,help = "number of runs per command (default 10)")
+    parser.add_argument("-o","--output",default = None,help = "path of a json file to write results to (optional)")
+    args = parser.parse_args()
+
+    results = {"benchmark":"startup","python":sys.version.split()[0],"imports_boto3":imports_boto3(),"commands":{}}
+    for command in [["--help"],["analyze","--help"]]:
+        times = time_command(command,args.repeats)
+        results["commands"][" ".join(command)] = {"median_s":statistics.median(times),"min_s":min(times),"max_s":max(times),"repeats":args.repeats}
+        print("neurocaas-cli {}: median {:.3f} s (min {:.3f} s, max {:.3f} s)".format(" ".join(command),statistics.median(times),min(times),max(times)))
+    print("importing the entrypoint imports boto3: {}".format(results["imports_boto3"]))
+    if args.output is not None:
+        with open(args.output,"w") as f:
+            json.dump(results,f,indent = 4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+## shared helpers for benchmarks run against a local s3 stand-in (localstack or moto server). 
+import os
+import sys
+import json
+import tempfile
+import threading
+import concurrent.futures
+
+here = os.path.abspath(os.path.dirname(__file__))
+srcpath = os.path.join(os.path.dirname(here),"src")
+if srcpath not in sys.path:
+    sys.path.insert(0,srcpath)
+
+from neurocaas_cli import clients,analyze,Interface_S3,cache,telemetry
+
+class EndpointSession(object):
+    """Wraps a boto3 session so that all clients and resources it creates talk to a given endpoint, i.e. localstack (http://localhost:4566) or a moto server. 
+
+    """
+    def __init__(self,endpoint_url):
+        import boto3
+        self.endpoint_url = endpoint_url
+        self.region_name = "us-east-1"
+        self.session = boto3.session.Session(aws_access_key_id = "test",aws_secret_access_key = "test",region_name = self.region_name)
+
+    def client(self,service,**kwargs):
+        return self.session.client(service,endpoint_url = self.endpoint_url,**kwargs)
+
+    def resource(self,service,**kwargs):
+        return self.session.resource(service,endpoint_url = self.endpoint_url,**kwargs)
+
+def add_common_arguments(parser):
+    """Add the arguments every benchmark takes to an argparse parser. 
+
+    """
+    parser.add_argument("--endpoint-url",default = "http://localhost:4566",help = "endpoint of the local s3 stand-in (default http://localhost:4566)")
+    parser.add_argument("--bucket",default = "neurocaas-cli-bench",help = "bucket to run benchmarks in. Created if it does not exist. (default neurocaas-cli-bench)")
+    parser.add_argument("-o","--output",default = None,help = "path of a json file to write results to (optional)")
+    parser.add_argument("--baseline",default = None,help = "path of a json results file from an earlier run. Exits with an error if any result is worse by more than the tolerance. (optional)")
+    parser.add_argument("--tolerance",type = float,default = 0.2,help = "relative change from the baseline that counts as a regression (default 0.2)")
+
+def setup(args):
+    """Point the cli at the local s3 stand-in, keep all local state in a temporary directory, and create the benchmark bucket. 
+
+    :return: an s3 client, and the temporary directory. 
+    """
+    clients.set_session(EndpointSession(args.endpoint_url))
+    workdir = tempfile.mkdtemp(prefix = "neurocaas_cli_bench")
+    Interface_S3.statepath = os.path.join(workdir,"state")
+    analyze.listing_cache = cache.ListingCache(os.path.join(workdir,"state","listings"))
+    client = clients.get_client("s3",max_pool_connections = 32)
+    buckets = [b["Name"] for b in client.list_buckets()["Buckets"]]
+    if args.bucket not in buckets:
+        client.create_bucket(Bucket = args.bucket)
+    return client,workdir
+
+class MemorySampler(object):
+    """Context manager that samples the memory of this process in a background thread, and records the peaks reached above the memory in use when it was entered: peak_rss for all resident memory, and peak_anon for memory that is not backed by a file (resident memory minus pages shared with the file cache, i.e. memory mapped files). Reads /proc/self/statm, so only works on Linux. Elsewhere, peak_anon is None and peak_rss comes from getrusage. 
+
+    :param interval: (optional) seconds between samples. Default 0.005
+    """
+    def __init__(self,interval = 0.005):
+        self.interval = interval
+        self.peak_rss = None
+        self.peak_anon = None
+        self._stop = threading.Event()
+
+    def sample(self):
+        with open("/proc/self/statm") as f:
+            resident,shared = [int(v)*os.sysconf("SC_PAGE_SIZE") for v in f.read().split()[1:3]]
+        return resident,resident-shared
+
+    def run(self):
+        while not self._stop.is_set():
+            rss,anon = self.sample()
+            self.peak_rss = max(self.peak_rss,rss-self._base[0])
+            self.peak_anon = max(self.peak_anon,anon-self._base[1])
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if os.path.exists("/proc/self/statm"):
+            self._base = self.sample()
+            self.peak_rss,self.peak_anon = 0,0
+            self._thread = threading.Thread(target = self.run,daemon = True)
+            self._thread.start()
+        else:    
+            import resource
+            self._thread = None
+            self._maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return self
+
+    def __exit__(self,*args):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        else:    
+            import resource
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak_rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss-self._maxrss)*scale
+
+def put_keys(client,bucket,keys,body = b"",workers = 32):
+    """Create many objects at once. 
+
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        list(executor.map(lambda key: client.put_object(Bucket = bucket,Key = key,Body = body),keys))
+
+def clear_prefix(client,bucket,prefix):
+    """Delete all objects under a prefix. 
+
+    """
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket = bucket,Prefix = prefix):
+        objects = [{"Key":o["Key"]} for o in page.get("Contents",[])]
+        if len(objects) > 0:
+            client.delete_objects(Bucket = bucket,Delete = {"Objects":objects})
+
+def result(name,params,metric,value,higher_is_better):
+    """Format a single benchmark result. 
+
+    """
+    print("{} {}: {:.4f} {}".format(name,json.dumps(params,sort_keys = True),value,metric))
+    return {"name":name,"params":params,"metric":metric,"value":value,"higher_is_better":higher_is_better}
+
+def compare(results,baseline,tolerance):
+    """Compare results with those of an earlier run. 
+
+    :return: list of descriptions of results that regressed by more than the tolerance. 
+    """
+    def identify(r):
+        return r["name"]+json.dumps(r["params"],sort_keys = True)
+    previous = {identify(r):r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = previous.get(identify(r))
+        if b is None or b["value"] == 0:
+            continue
+        change = (r["value"]-b["value"])/b["value"]
+        if (r["higher_is_better"] and change < -tolerance) or (not r["higher_is_better"] and change > tolerance):
+            regressions.append("{} {}: {:.4f} {} (baseline {:.4f}, {:+.0%})".format(r["name"],json.dumps(r["params"],sort_keys = True),r["value"],r["metric"],b["value"],change))
+    return regressions
+
+def finish(args,benchmark,results):
+    """Write results to the output file if given, and compare them with the baseline if given. Exits with status 1 if there are regressions. 
+
+    """
+    if args.output is not None:
+        with open(args.output,"w") as f:
+            json.dump({"benchmark":benchmark,"results":results},f,indent = 4)
+    if args.baseline is not None:
+        with open(args.baseline,"r") as f:
+            regressions = compare(results,json.load(f),args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: "+regression)
+        if len(regressions) > 0:
+            sys.exit(1)
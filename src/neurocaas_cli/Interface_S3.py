@@ -1,113 +1,797 @@
 '''
 Script to download a video from the relevant amazon S3 bucket into a temporary diretory. 
 '''
-import sys
 import os
-import boto3 
-from boto3.s3.transfer import S3Transfer 
+from boto3.s3.transfer import S3Transfer,TransferConfig,create_transfer_manager
+from s3transfer.subscribers import BaseSubscriber
 import botocore 
 import threading
+import time
+import random
+import concurrent.futures
+import re
+import hashlib
+import base64
+import json
+import tarfile
+import zlib
+import mmap
+from .clients import get_client
+from .progress import Progress
+from . import throttle
 
-s3 = boto3.resource('s3')
-s3_client = boto3.client("s3")
+## local state (i.e. interrupted uploads) is kept here:
+statepath = os.path.join(os.path.expanduser("~"),".neurocaas_cli")
+## limits on multipart uploads imposed by s3:
+min_part_size = 5*1024**2
+max_parts = 10000
+## part sizes other tools commonly upload with, tried when matching multipart ETags. 
+common_part_sizes = [5*1024**2,16*1024**2,64*1024**2]
 
-## from https://stackoverflow.com/questions/41827963/track-download-progress-of-s3-file-using-boto3-and-callbacks
-class ProgressPercentage_d(object):
+## user metadata set on objects uploaded with compression (see upload_compressed): 
+encoding_key = "neurocaas-encoding"
+source_size_key = "neurocaas-source-size"
+source_md5_key = "neurocaas-source-md5"
+encodings = ["gzip","zstd"]
+## suffixes added to the keys of files compressed on upload: 
+encoding_suffixes = {"gzip":".gz","zstd":".zst"}
+
+class UploadVerificationError(Exception):
+    """Raised when an uploaded object does not match the local file it was uploaded from. 
+
+    """
+
+class ProgressPercentage_d(Progress):
     """Helper class to get and display percentage of data downloaded. 
-    If display is set to false, assume that we're writing to a remote log file, and include newlines. 
-
-    """
-    def __init__(self,client,BUCKET,KEY,display = False):
-        self._filename = KEY
-        self._size = client.head_object(Bucket=BUCKET,Key=KEY)['ContentLength']
-        self._seen_so_far = 0
-        self._lock = threading.Lock()
-        self.display = display
-
-    def __call__(self,bytes_amount):
-        with self._lock:
-            self._seen_so_far += bytes_amount
-            percentage = round((self._seen_so_far/self._size)*100,2)
-            if self.display:
-                sys.stdout.write(
-                            "\r%s  %s / %s  (%.2f%%)" % (
-                            self._filename, self._seen_so_far, self._size,
-                            percentage))
-                sys.stdout.flush()
-            else:    
-                sys.stdout.write(
-                            "\r%s  %s / %s  (%.2f%%)\n" % (
-                            self._filename, self._seen_so_far, self._size,
-                            percentage))
-                sys.stdout.flush()
+    If display is set to false, assume that we're writing to a remote log file, and only print a line at every 10 percent (see progress.Progress). 
+    The size of the object is taken from SIZE if given (i.e. from a listing), and only requested with head_object otherwise. 
+
+    """
+    def __init__(self,client,BUCKET,KEY,display = False,SIZE = None):
+        if SIZE is None:
+            SIZE = client.head_object(Bucket=BUCKET,Key=KEY)['ContentLength']
+        super().__init__(total = SIZE,label = KEY,mode = "bar" if display else "log")
 
-class ProgressPercentage_u(object):
+class ProgressPercentage_u(Progress):
     """Helper class to get and display percentage of data uploaded. 
-    If display is set to false, assume that we're writing to a remote log file, and include newlines. 
+    If display is set to false, assume that we're writing to a remote log file, and only print a line at every 10 percent (see progress.Progress). 
 
     """
     def __init__(self,FILEPATH,display = False):
-        self._filename = FILEPATH
-        self._size = float(os.path.getsize(FILEPATH)) 
-        self._seen_so_far = 0
-        self._lock = threading.Lock()
-        self.display = display
-
-    def __call__(self,bytes_amount):
-        with self._lock:
-            self._seen_so_far += bytes_amount
-            percentage = round((self._seen_so_far/self._size)*100,2)
-            if self.display:
-                sys.stdout.write(
-                            "\r%s  %s / %s  (%.2f%%)" % (
-                            self._filename, self._seen_so_far, self._size,
-                            percentage))
-                sys.stdout.flush()
-            else:    
-                sys.stdout.write(
-                            "\r%s  %s / %s  (%.2f%%)\n" % (
-                            self._filename, self._seen_so_far, self._size,
-                            percentage))
-                sys.stdout.flush()
-
-def download(s3path,localpath,display = False):
-    """Download function. Takes an s3 path to an object, and local object path as input.   
+        super().__init__(total = os.path.getsize(FILEPATH),label = FILEPATH,mode = "bar" if display else "log")
+
+def download(s3path,localpath,display = False,size = None,etag = None,encoding = None,decompress = True):
+    """Download function. Takes an s3 path to an object, and local object path as input. Objects that were compressed on upload (see upload_compressed) are decompressed as they stream in, so localpath holds the original file.  
     :param s3path: full path to an object in s3. Assumes the s3://bucketname/key syntax. 
     :param localpath: full path to the object name locally (i.e. with basename attached). 
     :param display: (optional) Defaults to false. If true, displays a progress bar. 
+    :param size: (optional) size of the object in bytes, if known from a listing. Otherwise it is requested with head_object, along with the ETag and the encoding. 
+    :param etag: (optional) ETag of the object, if known from a listing. Needed with size to skip the head_object request on recent versions of s3transfer. 
+    :param encoding: (optional) compression of the object ("gzip" or "zstd"), if known. Only used when size is given: the object is otherwise taken to be stored as is. 
+    :param decompress: (optional) Defaults to true. If false, compressed objects are written to localpath as stored. 
 
     """
     assert s3path.startswith("s3://")
     bucketname,keyname = s3path.split("s3://")[-1].split("/",1)
 
     try:
-        transfer = S3Transfer(s3_client)
-        progress = ProgressPercentage_d(transfer._manager._client,bucketname,keyname,display = display)
-        transfer.download_file(bucketname,keyname,localpath,callback = progress)
+        client = get_client("s3")
+        if size is None:
+            response = client.head_object(Bucket = bucketname,Key = keyname)
+            size,etag = response["ContentLength"],response.get("ETag")
+            encoding = response.get("Metadata",{}).get(encoding_key)
+        progress = ProgressPercentage_d(client,bucketname,keyname,display = display,SIZE = size)
+        if decompress and encoding is not None:
+            decompress_stream(client.get_object(Bucket = bucketname,Key = keyname)["Body"],localpath,encoding,callback = throttle.throttled(progress,"download",keyname))
+        else:    
+            with create_transfer_manager(client,TransferConfig()) as manager:
+                manager.download(bucketname,keyname,localpath,subscribers = [ListingMetadata(size,etag),CallbackSubscriber(throttle.throttled(progress,"download",keyname))]).result()
+        progress.finish()
     except botocore.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == "404":
+        if e.response['Error']['Code'] in ["404","NoSuchKey"]:
             print("The object does not exist.")
             raise
         else:
             raise
 
-def upload(localpath,s3path,display = False):
-    """Upload function. Takes a local object paht and s3 path to the desired key as input. 
+## transfer managers shared by calls to upload, keyed by client and transfer settings: 
+transfer_managers_lock = threading.Lock()
+transfer_managers = {}
+
+def get_transfer_manager(client,config):
+    """Get a transfer manager for a client and transfer config, created on first use and cached afterwards, so that repeated uploads reuse its threads instead of starting new ones. 
+
+    :param client: boto3 s3 client the manager sends requests with. 
+    :param config: boto3 TransferConfig of the manager. 
+    """
+    key = (id(client),config.multipart_threshold,config.multipart_chunksize,config.max_concurrency)
+    with transfer_managers_lock:
+        cached = transfer_managers.get(key)
+        if cached is None or cached[0] is not client:
+            cached = (client,create_transfer_manager(client,config))
+            transfer_managers[key] = cached
+        return cached[1]
+
+def upload(localpath,s3path,display = False,config = None,skip_identical = False,compress = None,level = None,threads = 0):
+    """Upload function. Takes a local object paht and s3 path to the desired key as input. Files at or above the multipart threshold of the transfer config are uploaded with upload_resumable, so an interrupted upload of the same file to the same key picks up where it left off. If compress is given, the file is compressed as it is uploaded instead (see upload_compressed). 
     :param localpath: full path to the object name locally (i.e. with basename attached). 
     :param s3path: full path to an object in s3. Assumes the s3://bucketname/key syntax. 
     :param display: (optional) Defaults to false. If true, displays a progress bar. 
+    :param config: (optional) boto3 TransferConfig giving multipart threshold, chunk size and concurrency. Defaults to boto3 defaults. 
+    :param skip_identical: (optional) Defaults to false. If true, does not upload if the object at s3path already has the same content as the local file (see is_uploaded). 
+    :param compress: (optional) "gzip" or "zstd" to compress the file on upload. zstd requires the zstandard package. Defaults to None, uploads the file as is. 
+    :param level: (optional) compression level. Defaults to 6 for gzip and 3 for zstd. 
+    :param threads: (optional) number of threads zstd compresses with. Defaults to 0, compresses on the calling thread. 
+    :returns: True if the file was uploaded, False if it was skipped. 
 
     """
     assert s3path.startswith("s3://")
     bucketname,keyname = s3path.split("s3://")[-1].split("/",1)
+    if config is None:
+        config = TransferConfig()
 
     try:
-        transfer = S3Transfer(s3_client)
+        client = get_client("s3",max_pool_connections = config.max_concurrency)
+        if skip_identical and is_uploaded(client,localpath,bucketname,keyname,config = config):
+            return False
         progress = ProgressPercentage_u(localpath,display = display)
-        transfer.upload_file(localpath,bucketname,keyname,callback = progress)
+        if compress is not None:
+            upload_compressed(client,localpath,bucketname,keyname,compress,level = level,threads = threads,config = config,callback = progress)
+        elif os.path.getsize(localpath) >= config.multipart_threshold:
+            upload_resumable(client,localpath,bucketname,keyname,config = config,callback = progress)
+        else:    
+            manager = get_transfer_manager(client,config)
+            manager.upload(localpath,bucketname,keyname,subscribers = [CallbackSubscriber(throttle.throttled(progress,"upload",localpath))]).result()
+        progress.finish()
+        return True
 
     except OSError as e:
         print("The file does not exist.")
         raise
 
+## local etags are cached here, keyed by absolute path: 
+etag_cache_lock = threading.Lock()
+etag_cache = None
+
+def local_etag(localpath,chunksize = None):
+    """Get the ETag s3 would assign to a local file, without uploading it. Results are cached in statepath, and reused as long as the file's modification time and size do not change. 
+    :param localpath: full path to the local file. 
+    :param chunksize: (optional) part size of a multipart upload. If not given, the ETag of a single part upload (md5 of the file) is returned. 
+    :returns: the ETag, including its surrounding quotes. 
+
+    """
+    global etag_cache
+    cachefile = os.path.join(statepath,"etags.json")
+    stat = os.stat(localpath)
+    abspath = os.path.abspath(localpath)
+    with etag_cache_lock:
+        if etag_cache is None:
+            try:
+                with open(cachefile,"r") as f:
+                    etag_cache = json.load(f)
+            except (FileNotFoundError,json.JSONDecodeError):
+                etag_cache = {}
+        entry = etag_cache.get(abspath)
+        if entry is None or [entry["mtime"],entry["size"]] != [stat.st_mtime_ns,stat.st_size]:
+            entry = {"mtime":stat.st_mtime_ns,"size":stat.st_size,"etags":{}}
+        if str(chunksize) in entry["etags"]:
+            return entry["etags"][str(chunksize)]
+
+    part_md5s = []
+    with open(localpath,"rb") as f:
+        part = hashlib.md5()
+        part_remaining = chunksize
+        while True:
+            data = f.read(1024**2 if chunksize is None else min(1024**2,part_remaining))
+            if len(data) == 0:
+                break
+            part.update(data)
+            if chunksize is not None:
+                part_remaining -= len(data)
+                if part_remaining == 0:
+                    part_md5s.append(part.hexdigest())
+                    part = hashlib.md5()
+                    part_remaining = chunksize
+    if chunksize is None:
+        etag = '"{}"'.format(part.hexdigest())
+    else:    
+        if part_remaining < chunksize or len(part_md5s) == 0:
+            part_md5s.append(part.hexdigest())
+        etag = multipart_etag(part_md5s)
+
+    with etag_cache_lock:
+        entry["etags"][str(chunksize)] = etag
+        etag_cache[abspath] = entry
+        os.makedirs(statepath,exist_ok = True)
+        with open(cachefile+".tmp","w") as f:
+            json.dump(etag_cache,f)
+        os.replace(cachefile+".tmp",cachefile)
+    return etag
+
+def is_uploaded(client,localpath,bucketname,keyname,config = None):
+    """Check if an object in s3 already holds the same content as a local file, by comparing the ETag returned by head_object with the ETag computed from the local file. Objects compressed on upload are compared through the checksum of the original file recorded in their metadata. For multipart ETags, the local ETag is computed with each part size that splits the file into as many parts as the remote ETag has (see candidate_chunksizes), until one matches.  
+    :param client: boto3 s3 client to use. 
+    :param localpath: full path to the local file. 
+    :param bucketname: name of the bucket holding the object. 
+    :param keyname: key of the object. 
+    :param config: (optional) boto3 TransferConfig that would be used to upload the file. 
+    :returns: True if the object exists and matches the local file. 
+
+    """
+    if config is None:
+        config = TransferConfig()
+    try:
+        head = client.head_object(Bucket = bucketname,Key = keyname)
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ["404","NoSuchKey","NotFound"]:
+            return False
+        raise
+    size = os.path.getsize(localpath)
+    metadata = head.get("Metadata",{})
+    if source_md5_key in metadata:
+        ## compressed on upload: compare with the checksum of the original file. 
+        return metadata.get(source_size_key) == str(size) and '"{}"'.format(metadata[source_md5_key]) == local_etag(localpath)
+    if head["ContentLength"] != size:
+        return False
+    remote_etag = head["ETag"]
+    if "-" not in remote_etag:
+        return local_etag(localpath) == remote_etag
+    nb_parts = int(remote_etag.strip('"').split("-")[1])
+    return any(local_etag(localpath,chunksize) == remote_etag for chunksize in candidate_chunksizes(size,nb_parts,config))
+
+def upload_statefile(localpath,bucketname,keyname):
+    """Get the path to the file recording the state of a resumable upload from localpath to s3://bucketname/keyname. 
+
+    """
+    identifier = "{}|{}|{}".format(os.path.abspath(localpath),bucketname,keyname)
+    return os.path.join(statepath,"uploads",hashlib.sha1(identifier.encode("utf-8")).hexdigest()+".json")
+
+def multipart_chunksize(size,config):
+    """Get the part size used to upload a file of a given size: the chunk size of the config, increased if necessary to respect the limits s3 sets on part size and count. 
+
+    """
+    chunksize = max(config.multipart_chunksize,min_part_size)
+    while size > chunksize*max_parts:
+        chunksize *= 2
+    return chunksize
+
+def candidate_chunksizes(size,nb_parts,config):
+    """Get the part sizes an object of a given size might have been uploaded with, given the number of parts in its ETag. Common part sizes are tried first: the 8 MB default of boto3 and the aws cli, the part size upload would use with config, and common_part_sizes. Only if none of these has a matching ETag is the part size computed from nb_parts, assuming a whole number of MB per part. 
+
+    :param size: size of the object in bytes. 
+    :param nb_parts: number of parts in the ETag of the object. 
+    :param config: boto3 TransferConfig that would be used to upload the file. 
+    :return: list of part sizes in bytes that split the object into nb_parts parts, in the order they should be tried. 
+    """
+    candidates = []
+    for chunksize in [8*1024**2,multipart_chunksize(size,config)]+common_part_sizes+[-(-size//(nb_parts*1024**2))*1024**2]:
+        if -(-size//chunksize) == nb_parts and chunksize not in candidates:
+            candidates.append(chunksize)
+    return candidates
+
+def md5_etag(response):
+    """Check if the ETag in a response from s3 (i.e. head_object) is the md5 based checksum computed by local_etag and multipart_etag. It is not for objects encrypted with SSE-KMS or SSE-C, which can only be verified through the Content-MD5 of each request. 
+
+    """
+    if response.get("SSECustomerAlgorithm") is not None or response.get("ServerSideEncryption","").startswith("aws:kms"):
+        return False
+    return re.match(r'^"[0-9a-f]{32}(-[0-9]+)?"$',response.get("ETag","")) is not None
+
+def multipart_etag(part_md5s):
+    """Get the ETag s3 assigns to a multipart upload from the md5 hex digests of its parts, in order. 
+
+    """
+    digest = hashlib.md5(b"".join(bytes.fromhex(m) for m in part_md5s)).hexdigest()
+    return '"{}-{}"'.format(digest,len(part_md5s))
+
+def compressor(encoding,level = None,threads = 0):
+    """Get a streaming compressor for an encoding, with compress and flush methods like zlib's. 
+
+    """
+    if encoding == "gzip":
+        return zlib.compressobj(6 if level is None else level,zlib.DEFLATED,31)
+    elif encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level = 3 if level is None else level,threads = threads).compressobj()
+    raise ValueError("Encoding must be one of {}, not {}".format(encodings,encoding))
+
+def decompressor(encoding):
+    """Get a streaming decompressor for an encoding, with decompress and flush methods like zlib's. 
+
+    """
+    if encoding == "gzip":
+        return zlib.decompressobj(31)
+    elif encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError("Encoding must be one of {}, not {}".format(encodings,encoding))
+
+def decompress_stream(body,localpath,encoding,callback = None):
+    """Decompress a stream (i.e. the body of a get_object response) into a local file, chunk by chunk. 
+    :param body: file-like object with a read method, giving compressed data. 
+    :param localpath: full path to write the decompressed data to. 
+    :param encoding: "gzip" or "zstd". 
+    :param callback: (optional) called with the number of compressed bytes read after each chunk. 
+
+    """
+    decompress = decompressor(encoding)
+    with open(localpath,"wb") as f:
+        while True:
+            data = body.read(1024**2)
+            if len(data) == 0:
+                break
+            f.write(decompress.decompress(data))
+            if callback is not None:
+                callback(len(data))
+        f.write(decompress.flush())
+
+def upload_compressed(client,localpath,bucketname,keyname,encoding,level = None,threads = 0,config = None,callback = None):
+    """Compress a file as it is uploaded, without writing the compressed file to disk. Compressed data is cut into parts of the config's chunk size, which are sent as a multipart upload while the rest of the file is compressed. At most config.max_concurrency parts are held in memory at once. If the whole file compresses into less than one part, it is sent with a single put_object instead. The object's metadata records the encoding and the size and md5 checksum of the original file, so that download can decompress it and is_uploaded can compare it with local files. Unlike upload_resumable, an interrupted compressed upload starts over. 
+    :param client: boto3 s3 client to upload with. 
+    :param localpath: full path to the object name locally (i.e. with basename attached). 
+    :param bucketname: name of the bucket to upload to. 
+    :param keyname: key to upload to. 
+    :param encoding: "gzip" or "zstd". zstd requires the zstandard package. 
+    :param level: (optional) compression level. Defaults to 6 for gzip and 3 for zstd. 
+    :param threads: (optional) number of threads zstd compresses with. Ignored for gzip. Defaults to 0, compresses on the calling thread. 
+    :param config: (optional) boto3 TransferConfig. multipart_chunksize sets the part size and max_concurrency the number of parts uploaded at once. 
+    :param callback: (optional) called with the number of bytes of the original file compressed after each chunk. 
+    :returns: the size of the uploaded object in bytes. 
+    """
+    if config is None:
+        config = TransferConfig()
+    compress = compressor(encoding,level,threads)
+    chunksize = max(config.multipart_chunksize,min_part_size)
+    metadata = {encoding_key:encoding,
+                source_size_key:str(os.path.getsize(localpath)),
+                source_md5_key:local_etag(localpath).strip('"')}
+    in_flight = threading.BoundedSemaphore(config.max_concurrency)
+    uploadid = None
+    futures = []
+    buffer = bytearray()
+    compressed = 0
+
+    def send(partnumber,data):
+        throttle.consume("upload",len(data),localpath)
+        digest = hashlib.md5(data)
+        response = client.upload_part(Bucket = bucketname,Key = keyname,UploadId = uploadid,PartNumber = partnumber,Body = data,ContentMD5 = base64.b64encode(digest.digest()).decode("utf-8"))
+        return {"PartNumber":partnumber,"ETag":response["ETag"]}
+
+    def submit(executor,data):
+        in_flight.acquire()
+        future = executor.submit(send,len(futures)+1,data)
+        future.add_done_callback(lambda f: in_flight.release())
+        futures.append(future)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = config.max_concurrency) as executor:
+        try:
+            with open(localpath,"rb") as f:
+                while True:
+                    data = f.read(1024**2)
+                    buffer += compress.compress(data) if len(data) > 0 else compress.flush()
+                    while len(buffer) >= chunksize:
+                        if uploadid is None:
+                            uploadid = client.create_multipart_upload(Bucket = bucketname,Key = keyname,Metadata = metadata)["UploadId"]
+                        submit(executor,bytes(buffer[:chunksize]))
+                        compressed += chunksize
+                        del buffer[:chunksize]
+                    if len(data) == 0:
+                        break
+                    if callback is not None:
+                        callback(len(data))
+            compressed += len(buffer)
+            if uploadid is None:
+                throttle.consume("upload",len(buffer),localpath)
+                digest = hashlib.md5(buffer)
+                client.put_object(Bucket = bucketname,Key = keyname,Body = bytes(buffer),Metadata = metadata,ContentMD5 = base64.b64encode(digest.digest()).decode("utf-8"))
+                return compressed
+            if len(buffer) > 0:
+                submit(executor,bytes(buffer))
+            parts = [future.result() for future in futures]
+            client.complete_multipart_upload(Bucket = bucketname,Key = keyname,UploadId = uploadid,MultipartUpload = {"Parts":parts})
+            return compressed
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            if uploadid is not None:
+                try:
+                    client.abort_multipart_upload(Bucket = bucketname,Key = keyname,UploadId = uploadid)
+                except botocore.exceptions.ClientError:
+                    pass
+            raise
+
+class MappedPart(object):
+    """Read-only file-like view of one part of a local file, mapped into memory with mmap, to be sent as the body of an upload_part request. The part is hashed from the mapping and read in the small blocks the http connection asks for, so it is never copied into a buffer of its own: its pages belong to the operating system's file cache, and are unmapped when the part is closed. 
+    :param localpath: path to the file. 
+    :param offset: offset of the part in the file, in bytes. 
+    :param length: length of the part in bytes. Must be more than 0. 
+
+    """
+    def __init__(self,localpath,offset,length):
+        start = offset-offset%mmap.ALLOCATIONGRANULARITY
+        with open(localpath,"rb") as f:
+            self._map = mmap.mmap(f.fileno(),length+offset-start,offset = start,access = mmap.ACCESS_READ)
+        self.view = memoryview(self._map)[offset-start:offset-start+length]
+        self._position = 0
+
+    def __len__(self):
+        return len(self.view)
+
+    def read(self,size = -1):
+        end = len(self.view) if size is None or size < 0 else min(len(self.view),self._position+size)
+        data = self.view[self._position:end].tobytes()
+        self._position = end
+        return data
+
+    def seek(self,offset,whence = 0):
+        self._position = max(0,min(len(self.view),[0,self._position,len(self.view)][whence]+offset))
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self.view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+def upload_resumable(client,localpath,bucketname,keyname,config = None,callback = None,use_mmap = True):
+    """Upload a file with a multipart upload that can be resumed if interrupted. The upload id and md5 checksum of each finished part are saved in a state file under statepath. If the upload is run again on an unchanged file, the parts s3 already holds (from list_parts) are checked against the saved checksums and skipped. Each part is sent with a Content-MD5 header so s3 validates it on receipt, and the final object's ETag is checked against the checksums of the local parts when it is md5 based (see md5_etag). 
+    Parts are sent straight from a memory map of the file (see MappedPart), and at most config.max_concurrency parts are mapped at once, so memory use does not grow with the size of the file or with copies of the parts. 
+    :param client: boto3 s3 client to upload with. 
+    :param localpath: full path to the object name locally (i.e. with basename attached). 
+    :param bucketname: name of the bucket to upload to. 
+    :param keyname: key to upload to. 
+    :param config: (optional) boto3 TransferConfig. multipart_chunksize sets the part size and max_concurrency the number of parts uploaded at once. 
+    :param callback: (optional) called with the number of bytes in each part as it is finished or skipped. 
+    :param use_mmap: (optional) Defaults to true. If false, each part is read into memory before it is sent instead. 
+    :raises: UploadVerificationError if the uploaded object does not have the size of the local file, or an md5 based ETag that does not match it. 
+    """
+    if config is None:
+        config = TransferConfig()
+    stat = os.stat(localpath)
+    size = stat.st_size
+    chunksize = multipart_chunksize(size,config)
+    nb_parts = max(1,-(-size//chunksize))
+    statefile = upload_statefile(localpath,bucketname,keyname)
+    state_lock = threading.Lock()
+
+    state = None
+    try:
+        with open(statefile,"r") as f:
+            state = json.load(f)
+    except (FileNotFoundError,json.JSONDecodeError):
+        pass
+
+    uploaded = {}
+    if state is not None:
+        if [state["size"],state["mtime"],state["chunksize"]] == [size,stat.st_mtime_ns,chunksize]:
+            try:
+                paginator = client.get_paginator("list_parts")
+                for page in paginator.paginate(Bucket = bucketname,Key = keyname,UploadId = state["uploadid"]):
+                    for part in page.get("Parts",[]):
+                        uploaded[part["PartNumber"]] = part["ETag"]
+            except botocore.exceptions.ClientError as e:
+                if e.response["Error"]["Code"] != "NoSuchUpload":
+                    raise
+                state = None
+        else:   
+            ## the file changed since the last attempt: clean up the old upload. 
+            try:
+                client.abort_multipart_upload(Bucket = bucketname,Key = keyname,UploadId = state["uploadid"])
+            except botocore.exceptions.ClientError:
+                pass
+            state = None
+
+    if state is None:
+        response = client.create_multipart_upload(Bucket = bucketname,Key = keyname)
+        state = {"uploadid":response["UploadId"],"size":size,"mtime":stat.st_mtime_ns,"chunksize":chunksize,"parts":{}}
+        uploaded = {}
+    os.makedirs(os.path.dirname(statefile),exist_ok = True)
+
+    def save_state():
+        with open(statefile+".tmp","w") as f:
+            json.dump(state,f)
+        os.replace(statefile+".tmp",statefile)
+
+    save_state()
+
+    def upload_part(partnumber):
+        recorded = state["parts"].get(str(partnumber))
+        offset = (partnumber-1)*chunksize
+        length = min(chunksize,size-offset)
+        if isinstance(recorded,dict) and uploaded.get(partnumber) == recorded["etag"]:
+            if callback is not None:
+                callback(length)
+            return
+        throttle.consume("upload",length,localpath)
+        if use_mmap and length > 0:
+            with MappedPart(localpath,offset,length) as part:
+                digest = hashlib.md5(part.view)
+                response = client.upload_part(Bucket = bucketname,Key = keyname,UploadId = state["uploadid"],PartNumber = partnumber,Body = part,ContentMD5 = base64.b64encode(digest.digest()).decode("utf-8"))
+        else:    
+            with open(localpath,"rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+            digest = hashlib.md5(data)
+            response = client.upload_part(Bucket = bucketname,Key = keyname,UploadId = state["uploadid"],PartNumber = partnumber,Body = data,ContentMD5 = base64.b64encode(digest.digest()).decode("utf-8"))
+        with state_lock:
+            state["parts"][str(partnumber)] = {"md5":digest.hexdigest(),"etag":response["ETag"]}
+            save_state()
+        if callback is not None:
+            callback(length)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = config.max_concurrency) as executor:
+        futures = [executor.submit(upload_part,n) for n in range(1,nb_parts+1)]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            ## don't keep uploading parts after a failure: they can be resumed later. 
+            for future in futures:
+                future.cancel()
+            raise
+
+    parts = [state["parts"][str(n)] for n in range(1,nb_parts+1)]
+    client.complete_multipart_upload(Bucket = bucketname,Key = keyname,UploadId = state["uploadid"],
+            MultipartUpload = {"Parts":[{"ETag":part["etag"],"PartNumber":n+1} for n,part in enumerate(parts)]})
+    head = client.head_object(Bucket = bucketname,Key = keyname)
+    if head["ContentLength"] != size or (md5_etag(head) and head["ETag"] != multipart_etag([part["md5"] for part in parts])):
+        raise UploadVerificationError("Uploaded object s3://{}/{} does not match {}.".format(bucketname,keyname,localpath))
+    os.remove(statefile)
+
+def download_tail(client,bucketname,keyname,localpath,overlap = 64):
+    """Append the bytes of an object beyond the end of its local copy to the local copy, with a single ranged get_object request. Meant for files that only grow, like logs. To check that the object was appended to rather than rewritten, the request starts overlap bytes before the end of the local copy, and these bytes are compared with the local ones. 
+    :param client: boto3 s3 client to download with. 
+    :param bucketname: name of the bucket to download from. 
+    :param keyname: key of the object to download. 
+    :param localpath: full path to the existing local copy of the object. 
+    :param overlap: (optional) number of bytes already held locally to fetch again for comparison. Default 64. 
+    :returns: the new bytes, or None if the local copy is not a prefix of the object. Nothing is written in that case, and the object should be downloaded in full. 
+
+    """
+    offset = os.path.getsize(localpath)
+    start = max(0,offset-overlap)
+    with open(localpath,"rb") as f:
+        f.seek(start)
+        local_overlap = f.read()
+    response = client.get_object(Bucket = bucketname,Key = keyname,Range = "bytes={}-".format(start))
+    data = response["Body"].read()
+    throttle.consume("download",len(data),keyname)
+    if data[:offset-start] != local_overlap:
+        return None
+    new = data[offset-start:]
+    with open(localpath,"ab") as f:
+        f.write(new)
+    return new
+
+class ListingMetadata(BaseSubscriber):
+    """Subscriber for s3transfer downloads that provides the size and ETag of the object, i.e. from a listing, so that the transfer manager does not send a head_object request to learn them. Recent versions of s3transfer need both to skip the request, older ones only the size. 
+
+    """
+    def __init__(self,size,etag = None):
+        self.size = size
+        self.etag = etag
+
+    def on_queued(self,future,**kwargs):
+        future.meta.provide_transfer_size(self.size)
+        if self.etag is not None and hasattr(future.meta,"provide_object_etag"):
+            future.meta.provide_object_etag(self.etag)
+
+class CallbackSubscriber(BaseSubscriber):
+    """Subscriber for s3transfer futures that passes the number of bytes transferred to a callback, like the Callback argument of client.download_file. 
+
+    """
+    def __init__(self,callback):
+        self.callback = callback
+
+    def on_progress(self,future,bytes_transferred,**kwargs):
+        self.callback(bytes_transferred)
+
+def download_with_retry(client,bucketname,keyname,localpath,retries = 3,progress = None,size = None,etag = None,manager = None):
+    """Download a single object, retrying transient failures with jittered exponential backoff. Missing objects are not retried. 
+    :param client: boto3 s3 client to download with. 
+    :param bucketname: name of the bucket to download from. 
+    :param keyname: key of the object to download. 
+    :param localpath: full path to the object name locally (i.e. with basename attached). 
+    :param retries: (optional) number of times to retry after the first failure. Default 3. 
+    :param progress: (optional) callback given the number of bytes downloaded as they arrive, i.e. a progress.Progress. Bytes from a failed attempt are taken back with a negative count. 
+    :param size: (optional) size of the object in bytes, if known from a listing. If given with a manager, no head_object request is sent before the download (see ListingMetadata). 
+    :param etag: (optional) ETag of the object, if known from a listing. 
+    :param manager: (optional) s3transfer TransferManager to download through. Default None, downloads with client.download_file. 
+
+    """
+    for attempt in range(retries+1):
+        seen = [0]
+        def reporter(bytes_amount):
+            seen[0] += bytes_amount
+            progress(bytes_amount)
+        callback = throttle.throttled(reporter if progress is not None else None,"download",keyname)
+        try:
+            if manager is None:
+                client.download_file(bucketname,keyname,localpath,Callback = callback)
+            else:    
+                subscribers = [CallbackSubscriber(callback)] if callback is not None else []
+                if size is not None:
+                    subscribers.append(ListingMetadata(size,etag))
+                manager.download(bucketname,keyname,localpath,subscribers = subscribers).result()
+            return
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ["404","NoSuchKey","403"] or attempt == retries:
+                raise
+        except botocore.exceptions.BotoCoreError:
+            if attempt == retries:
+                raise
+        if progress is not None:
+            progress(-seen[0])
+        time.sleep(random.uniform(0,min(2**attempt,10)))
+
+def download_many(client,bucketname,transfers,workers = 8,retries = 3,progress = None):
+    """Download many objects from a single bucket concurrently, with a thread pool sharing one s3 client and transfer manager. Objects whose size is given are fetched with GET requests only, so a batch of small files listed beforehand costs one LIST plus one GET per file. Objects are started smallest first, so that a few large objects do not hold up many small ones. 
+    :param client: boto3 s3 client to download with. Its connection pool should support at least `workers` connections (see clients.get_client).
+    :param bucketname: name of the bucket to download from. 
+    :param transfers: iterable of (key, localpath) pairs to download, optionally followed by the size in bytes and the ETag of the object from a listing: (key, localpath, size, etag). 
+    :param workers: (optional) number of files to download at once. Default 8. 
+    :param retries: (optional) number of times to retry each file after its first failure. Default 3. 
+    :param progress: (optional) progress.Progress to report bytes and finished files to, aggregated over all downloads. 
+    :returns: a summary dictionary: "downloaded" gives a list of keys that were downloaded, and "failed" a dictionary from keys that could not be downloaded to the error they raised. 
+
+    """
+    summary = {"downloaded":[],"failed":{}}
+    with create_transfer_manager(client,TransferConfig(max_concurrency = workers)) as manager, concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        futures = {}
+        transfers = [(tuple(transfer)+(None,None))[:4] for transfer in transfers]
+        for keyname,localpath,size,etag in sorted(transfers,key = lambda t: t[2] or 0):
+            futures[executor.submit(download_with_retry,client,bucketname,keyname,localpath,retries,progress,size,etag,manager)] = keyname
+        for future in concurrent.futures.as_completed(futures):
+            keyname = futures[future]
+            try:
+                future.result()
+                summary["downloaded"].append(keyname)
+            except Exception as e:    
+                summary["failed"][keyname] = str(e)
+            if progress is not None:
+                progress.file_done()
+    if progress is not None:
+        progress.finish()
+    return summary
+
+## archive suffixes that can be extracted, with the tarfile stream mode used for each: 
+archive_modes = {".tar.zst":"r|",".tar.gz":"r|gz",".tgz":"r|gz",".tar":"r|"}
+
+def extract_archive(client,bucketname,keyname,outputpath):
+    """Download a tar archive (optionally compressed with gzip, or zstd if the zstandard package is installed) and extract it into outputpath as it streams in, without writing the archive to disk. Only regular files and directories are extracted, and members that would land outside outputpath are skipped. 
+    :param client: boto3 s3 client to download with. 
+    :param bucketname: name of the bucket to download from. 
+    :param keyname: key of the archive. Its suffix gives the compression (see archive_modes). 
+    :param outputpath: directory to extract into. Created if it does not exist. 
+    :returns: list of the paths of extracted files, relative to outputpath. 
+
+    """
+    suffix = [s for s in archive_modes if keyname.endswith(s)][0]
+    body = throttle.Reader(client.get_object(Bucket = bucketname,Key = keyname)["Body"],keyname)
+    if suffix == ".tar.zst":
+        import zstandard
+        body = zstandard.ZstdDecompressor().stream_reader(body)
+    os.makedirs(outputpath,exist_ok = True)
+    root = os.path.abspath(outputpath)
+    extracted = []
+    with tarfile.open(fileobj = body,mode = archive_modes[suffix]) as archive:
+        for member in archive:
+            target = os.path.abspath(os.path.join(root,member.name))
+            if not (member.isfile() or member.isdir()) or not target.startswith(root+os.sep):
+                continue
+            if member.isdir():
+                os.makedirs(target,exist_ok = True)
+                continue
+            os.makedirs(os.path.dirname(target),exist_ok = True)
+            with archive.extractfile(member) as source, open(target,"wb") as f:
+                while True:
+                    chunk = source.read(1024**2)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            extracted.append(os.path.relpath(target,root))
+    return extracted
+
+class TransferTimer(BaseSubscriber):
+    """Subscriber for s3transfer futures that records when each transfer finishes, and reports bytes and finished files to an optional progress.Progress. 
+
+    """
+    def __init__(self,progress = None):
+        self.end = None
+        self.progress = progress
+
+    def on_progress(self,future,bytes_transferred,**kwargs):
+        if self.progress is not None:
+            self.progress(bytes_transferred)
+
+    def on_done(self,future,**kwargs):
+        self.end = time.time()
+        if self.progress is not None:
+            self.progress.file_done()
+
+def upload_many(client,transfers,config = None,skip_identical = False,progress = None):
+    """Upload many files through a single shared transfer manager, so that all of them share one pool of threads and connections. Files are submitted smallest first, so that the parts of a few large files do not hold up many small ones. Files at or above the multipart threshold of config are uploaded one after another with upload_resumable once the others are done, so they can be resumed if interrupted and are verified against their checksums. 
+    :param client: boto3 s3 client to upload with. Its connection pool should support at least `config.max_concurrency` connections (see clients.get_client).
+    :param transfers: list of (localpath, s3path) pairs to upload. s3path assumes the s3://bucketname/key syntax. 
+    :param config: (optional) boto3 TransferConfig. max_concurrency sets the number of parts and files sent at once across all uploads. 
+    :param skip_identical: (optional) Defaults to false. If true, files whose content is already at their s3path are not uploaded (see is_uploaded). 
+    :param progress: (optional) progress.Progress to report bytes and finished files to, aggregated over all uploads. The size of each file is added to its total once it is checked. 
+    :returns: a list with one dictionary per transfer, giving "localpath", "s3path", "status" (one of "uploaded", "skipped" or "failed"), "bytes", "seconds" and "errors". 
+
+    """
+    if config is None:
+        config = TransferConfig()
+    results = [{"localpath":localpath,"s3path":s3path,"status":None,"bytes":0,"seconds":None,"errors":None} for localpath,s3path in transfers]
+
+    def check(result):
+        bucketname,keyname = result["s3path"].split("s3://")[-1].split("/",1)
+        result["bytes"] = os.path.getsize(result["localpath"])
+        if skip_identical and is_uploaded(client,result["localpath"],bucketname,keyname,config = config):
+            result["status"] = "skipped"
+        elif progress is not None:
+            progress.add_total(result["bytes"])
+        return bucketname,keyname
+
+    def size(result):
+        try:
+            return os.path.getsize(result["localpath"])
+        except OSError:
+            return 0
 
+    submitted = []
+    large = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers = config.max_concurrency) as executor:
+        results_by_size = sorted(results,key = size)
+        checks = [executor.submit(check,result) for result in results_by_size]
+        with create_transfer_manager(client,config) as manager:
+            for result,checked in zip(results_by_size,checks):
+                try:
+                    bucketname,keyname = checked.result()
+                except Exception as e:    
+                    result["status"] = "failed"
+                    result["errors"] = str(e)
+                    if progress is not None:
+                        progress.file_done()
+                    continue
+                if result["status"] == "skipped":
+                    if progress is not None:
+                        progress.file_done()
+                    continue
+                if result["bytes"] >= config.multipart_threshold:
+                    large.append((result,bucketname,keyname))
+                    continue
+                timer = TransferTimer(progress)
+                subscribers = [timer]
+                limiter = throttle.throttled(None,"upload",result["localpath"])
+                if limiter is not None:
+                    subscribers.insert(0,CallbackSubscriber(limiter))
+                submitted.append((result,time.time(),timer,manager.upload(result["localpath"],bucketname,keyname,subscribers = subscribers)))
+            for result,start,timer,future in submitted:
+                try:
+                    future.result()
+                    result["status"] = "uploaded"
+                except Exception as e:    
+                    result["status"] = "failed"
+                    result["errors"] = str(e)
+                result["seconds"] = (timer.end or time.time())-start
+    for result,bucketname,keyname in large:
+        start = time.time()
+        try:
+            upload_resumable(client,result["localpath"],bucketname,keyname,config = config,callback = progress)
+            result["status"] = "uploaded"
+        except Exception as e:    
+            result["status"] = "failed"
+            result["errors"] = str(e)
+        result["seconds"] = time.time()-start
+        if progress is not None:
+            progress.file_done()
+    if progress is not None:
+        progress.finish()
+    return results
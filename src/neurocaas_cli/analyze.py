@@ -1,14 +1,31 @@
 ## core functions to run analysis behavior. 
-import boto3
 import os
+import sys
+import glob
+import csv
 import json
+import secrets
 import time
 import polling2
 import logging
-from .Interface_S3 import upload,download
-
-s3_resource = boto3.resource("s3")
-s3_client = boto3.client("s3")
+import botocore
+import urllib.parse
+import asyncio
+import functools
+import itertools
+import datetime
+import concurrent.futures
+from boto3.s3.transfer import TransferConfig
+from .Interface_S3 import upload,download,download_many,download_tail,upload_many,extract_archive,UploadVerificationError,statepath,encoding_suffixes
+from .manifest import SyncManifest,manifestname
+from .cache import ListingCache
+from .jobindex import JobIndex
+from .progress import Progress
+from .clients import get_client
+from . import throttle
+
+listing_cache = ListingCache(os.path.join(statepath,"listings"))
+job_index = JobIndex(os.path.join(statepath,"jobs.sqlite"))
 
 ## util functions 
 def bucket_prefix_to_fullpath(b,p):
@@ -24,8 +41,94 @@ def fullpath_to_bucket_prefix(s):
     bucketname, keyname = s.split("s3://")[-1].split("/",1)
     return bucketname,keyname
 
+def iter_objects(bucket_name, path, delimiter = None, limit = None, exclude_folder = False):
+    """Lazily list the objects in bucket under a given prefix path, using list_objects_v2 paginators. Pages are requested as the generator is consumed, so memory use does not grow with the number of objects and the first records are available after the first request.  
+
+    :param bucket_name: name of s3 bucket to list. 
+    :type bucket_name: str
+    :param path: prefix path specifying the location you want to list. 
+    :type path: str
+    :param delimiter: (optional) if given, group keys that contain the delimiter after the prefix, and yield each group once as a common prefix instead of yielding the objects in it.  
+    :type delimiter: str
+    :param limit: (optional) maximum number of records to yield. 
+    :type limit: int
+    :param exclude_folder: (optional) if true, do not yield the object whose key is the prefix itself.
+    :type exclude_folder: bool
+    :return: generator of dictionaries with fields Key, ETag, Size and LastModified (as an ISO 8601 string) for each object, or a field Prefix for each common prefix. 
+    :rtype: generator of dicts
+    """
+    if limit is not None and limit <= 0:
+        return
+    kwargs = {"Bucket":bucket_name,"Prefix":path}
+    if delimiter is not None:
+        kwargs["Delimiter"] = delimiter
+    count = 0
+    paginator = get_client("s3").get_paginator("list_objects_v2")
+    for page in paginator.paginate(**kwargs):
+        records = [{"Prefix":p["Prefix"]} for p in page.get("CommonPrefixes",[])]
+        records += [
+            {"Key":o["Key"],"ETag":o["ETag"],"Size":o["Size"],"LastModified":o["LastModified"].isoformat()}
+            for o in page.get("Contents",[]) if not (exclude_folder and path == o["Key"])
+        ]
+        for record in sorted(records,key = lambda r: r.get("Key",r.get("Prefix"))):
+            yield record
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+def iter_names(bucket_name, path, exclude_folder = False, delimiter = None, limit = None):
+    """Like iter_objects, but only yield the key of each object (or the common prefix, if a delimiter is given) as a string. 
+
+    """
+    for record in iter_objects(bucket_name,path,delimiter = delimiter,limit = limit,exclude_folder = exclude_folder):
+        yield record.get("Key",record.get("Prefix"))
+
+def iter_objects_cached(bucket_name, path, delimiter = None, refresh = False):
+    """Like iter_objects, but serve the listing from listing_cache if it holds an unexpired copy. Otherwise, the listing is streamed from s3 and written to the cache once it has been consumed completely. Listings that are not consumed completely (i.e. stopped by a limit) are not cached, and neither are listings with more than listing_cache.max_records records: these are not buffered beyond that size.  
+
+    :param bucket_name: name of s3 bucket to list. 
+    :type bucket_name: str
+    :param path: prefix path specifying the location you want to list. 
+    :type path: str
+    :param delimiter: (optional) see iter_objects.
+    :type delimiter: str
+    :param refresh: (optional) if true, ignore the cached listing and list again. 
+    :type refresh: bool
+    :return: generator of records, as for iter_objects. 
+    :rtype: generator of dicts
+    """
+    records = None if refresh else listing_cache.get(bucket_name,path,delimiter)
+    if records is not None:
+        for record in records:
+            yield record
+        return
+    listed = time.time()
+    records = []
+    for record in iter_objects(bucket_name,path,delimiter = delimiter):
+        if records is not None:
+            records.append(record)
+            if len(records) > listing_cache.max_records:
+                records = None
+        yield record
+    if records is not None:
+        listing_cache.put(bucket_name,path,delimiter,records,listed = listed)
+
+def record_upload(bucket_name,key,size):
+    """Write an object we just created through to listing_cache. 
+
+    """
+    record_uploads(bucket_name,[(key,size)])
+
+def record_uploads(bucket_name,uploads):
+    """Write many objects we just created through to listing_cache at once, so each cached listing is rewritten at most once. 
+
+    :param uploads: list of (key, size) pairs. 
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    listing_cache.record_many(bucket_name,[{"Key":key,"ETag":None,"Size":size,"LastModified":now} for key,size in uploads])
+
 def ls_name(bucket_name, path, exclude_folder = False):
-    """TODO: Only used for polling: use for all others too. Get the names of all objects in bucket under a given prefix path as strings. Takes the name of the bucket as input, not hte bucket itself for usage outside of the utils module.  
+    """Get the names of all objects in bucket under a given prefix path as strings. Takes the name of the bucket as input, not hte bucket itself for usage outside of the utils module. Use iter_names to avoid building the whole list for large prefixes. 
     
     :param bucket_name: name of s3 bucket to list. 
     :type bucket_name: str
@@ -34,67 +137,139 @@ def ls_name(bucket_name, path, exclude_folder = False):
     :return: A list of strings describing the objects under the specified path in the bucket. 
     :rtype: list of strings
     """
-    bucket = s3_resource.Bucket(bucket_name)
-    if exclude_folder == False:
-        all_files = [
-            objname.key for objname in bucket.objects.filter(Prefix=path) 
-        ]
-    else:
-        all_files = [
-            objname.key for objname in bucket.objects.filter(Prefix=path) if path != objname.key
-        ]
-    return all_files
+    return list(iter_names(bucket_name,path,exclude_folder = exclude_folder))
 
+def ls_metadata(bucket_name, path, exclude_folder = False):
+    """Like ls_name, but return the listing metadata for each object instead of just its name. 
     
-## main functions
-def upload_data(b,g,datapath):
-    """Given the bucket name, group name, and path to a local file, upload it to NeuroCAAS as data. 
+    :param bucket_name: name of s3 bucket to list. 
+    :type bucket_name: str
+    :param path: prefix path specifying the location you want to list. 
+    :type path: str
+    :return: A list of dictionaries with fields Key, ETag, Size and LastModified (as an ISO 8601 string) for each object under the specified path in the bucket. 
+    :rtype: list of dicts
+    """
+    return list(iter_objects(bucket_name,path,exclude_folder = exclude_folder))
 
+    
+## main functions
+def upload_data(b,g,datapath,config = None,force = False,compress = None,level = None,threads = 0):
+    """Given the bucket name, group name, and path to a local file, upload it to NeuroCAAS as data. Large files are uploaded in resumable parts: if interrupted, uploading the same file again continues where it stopped. If the file is already in NeuroCAAS with identical content, it is not uploaded again. 
+
+    :param config: (optional) boto3 TransferConfig controlling multipart chunk size and concurrency. 
+    :param force: (optional) if true, upload even if identical content is already in NeuroCAAS. 
+    :param compress: (optional) "gzip" or "zstd" to compress the file as it is uploaded (see Interface_S3.upload_compressed). The object then holds compressed bytes, and its key gets the suffix of the encoding (".gz" or ".zst") so that analyses can tell. Compressed uploads are not resumable. 
+    :param level: (optional) compression level. 
+    :param threads: (optional) number of threads zstd compresses with. 
     """
-    response = {"uploaded_file_path":None,"errors":None}
+    response = {"uploaded_file_path":None,"skipped":False,"errors":None}
     try:
-        upload(datapath,bucket_prefix_to_fullpath(b,os.path.join(g,"inputs",os.path.basename(datapath))))
+        key = os.path.join(g,"inputs",os.path.basename(datapath))
+        if compress is not None:
+            key += encoding_suffixes[compress]
+        uploaded = upload(datapath,bucket_prefix_to_fullpath(b,key),config = config,skip_identical = not force,compress = compress,level = level,threads = threads)
+        if uploaded:
+            ## compressed objects are smaller than the local file. 
+            size = get_client("s3").head_object(Bucket = b,Key = key)["ContentLength"] if compress is not None else os.path.getsize(datapath)
+            record_upload(b,key,size)
         response["uploaded_file_path"] = datapath
+        response["skipped"] = not uploaded
     except AssertionError:    
         response["errors"] = "path misformatted."
     except OSError:    
         response["errors"] = "file does not exist."
+    except UploadVerificationError:    
+        response["errors"] = "uploaded file does not match local file."
     return response    
         
 
-def upload_config(b,g,configpath):    
-    """Given the bucket name, group name, and path to a local file, upload it to NeuroCAAS as config. 
+def upload_config(b,g,configpath,force = False):    
+    """Given the bucket name, group name, and path to a local file, upload it to NeuroCAAS as config. If the file is already in NeuroCAAS with identical content, it is not uploaded again. 
 
+    :param force: (optional) if true, upload even if identical content is already in NeuroCAAS. 
     """
-    response = {"uploaded_file_path":None,"errors":None}
+    response = {"uploaded_file_path":None,"skipped":False,"errors":None}
     try:
-        upload(configpath,bucket_prefix_to_fullpath(b,os.path.join(g,"configs",os.path.basename(configpath))))
+        key = os.path.join(g,"configs",os.path.basename(configpath))
+        uploaded = upload(configpath,bucket_prefix_to_fullpath(b,key),skip_identical = not force)
+        if uploaded:
+            record_upload(b,key,os.path.getsize(configpath))
         response["uploaded_file_path"] = configpath
+        response["skipped"] = not uploaded
     except AssertionError:    
         response["errors"] = "path misformatted."
     except OSError:    
         response["errors"] = "file does not exist."
     return response    
 
-def list_inputs(b,g):
-    """Given the bucket name and group name, return the data fiels and config files currently associated. 
+def expand_paths(paths):
+    """Expand a list of local files, directories and glob patterns into the files they refer to. 
 
+    :param paths: list of paths. Directories are searched recursively, and patterns are expanded with glob (** is supported). 
+    :return: list of (localpath, relpath) pairs, where relpath is the name the file should have in NeuroCAAS: the basename for files and glob matches, and the path relative to the parent of the directory for files found in directories. Paths that do not exist are returned as given. 
+    """
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            parent = os.path.dirname(os.path.normpath(path))
+            for root,dirs,files in os.walk(path):
+                dirs.sort()
+                for f in sorted(files):
+                    localpath = os.path.join(root,f)
+                    expanded.append((localpath,os.path.relpath(localpath,parent)))
+        elif glob.has_magic(path):
+            expanded.extend((p,os.path.basename(p)) for p in sorted(glob.glob(path,recursive = True)) if os.path.isfile(p))
+        else:    
+            expanded.append((path,os.path.basename(path)))
+    return expanded        
+
+def upload_batch(b,g,paths,config = None,force = False,progress = None):
+    """Given the bucket name, group name, and a list of local files, directories or glob patterns, upload all files they refer to to NeuroCAAS as data through one shared transfer manager. Files found in directories keep their path relative to the directory's parent. 
+
+    :param config: (optional) boto3 TransferConfig controlling chunk size and the total number of concurrent transfers. 
+    :param force: (optional) if true, upload even if identical content is already in NeuroCAAS. 
+    :param progress: (optional) mode of a single progress line for all uploads: "bar", "log" or "quiet" (see progress.Progress). Default None, no progress is reported.
+    :return: dictionary with "results", a list of per file results from Interface_S3.upload_many, and aggregate "uploaded_bytes", "seconds" and "throughput" (in MB/s) for the files that were uploaded. 
     """
-    bucket = s3_resource.Bucket(b)
-    data = ls_name(b,os.path.join(g,"inputs/"),exclude_folder = True) #[objname.key for objname in bucket.objects.filter(Prefix=os.path.join(g,"inputs/")) if objname.key is not os.path.join(g,"inputs/")]
-    configs = [objname.key for objname in bucket.objects.filter(Prefix=os.path.join(g,"configs/")) if objname.key is not os.path.join(g,"configs/")]
-    configs = ls_name(b,os.path.join(g,"configs/"),exclude_folder = True)
+    start = time.time()
+    transfers = [(localpath,bucket_prefix_to_fullpath(b,os.path.join(g,"inputs",relpath))) for localpath,relpath in expand_paths(paths)]
+    if progress is not None:
+        progress = Progress(label = "upload",files = len(transfers),mode = progress)
+    results = upload_many(get_client("s3",max_pool_connections = (config or TransferConfig()).max_concurrency),transfers,config = config,skip_identical = not force,progress = progress)
+    record_uploads(b,[(fullpath_to_bucket_prefix(r["s3path"])[1],r["bytes"]) for r in results if r["status"] == "uploaded"])
+    seconds = time.time()-start
+    uploaded_bytes = sum(r["bytes"] for r in results if r["status"] == "uploaded")
+    return {"results":results,
+            "uploaded_bytes":uploaded_bytes,
+            "seconds":seconds,
+            "throughput":uploaded_bytes/1e6/seconds if seconds > 0 else 0.}
+
+def list_inputs(b,g,limit = None,refresh = False):
+    """Given the bucket name and group name, return the data fiels and config files currently associated. Both are returned as generators, which list lazily as they are consumed. Recent listings are served from the local listing cache. 
+
+    :param limit: (optional) maximum number of data files and of config files to return. 
+    :param refresh: (optional) if true, ignore cached listings. 
+    """
+    def names(prefix):
+        return (r["Key"] for r in iter_objects_cached(b,prefix,refresh = refresh) if r["Key"] != prefix)
+    data = itertools.islice(names(os.path.join(g,"inputs/")),limit)
+    configs = itertools.islice(names(os.path.join(g,"configs/")),limit)
     return data, configs
     
-def list_results(b,g):
-    """Given the bucket name and group name, return the results folders currently available.  
+def list_results(b,g,limit = None,refresh = False):
+    """Given the bucket name and group name, return the results folders currently available as a generator, which lists lazily as it is consumed. Recent listings are served from the local listing cache.  
 
+    :param limit: (optional) maximum number of results folders to return. 
+    :param refresh: (optional) if true, ignore cached listings. 
     """
-    bucket = s3_resource.Bucket(b)
-    result = s3_client.list_objects(Bucket = b,Prefix = os.path.join(g,"results/"),Delimiter="/")
-    folders = [o.get("Prefix") for o in result.get("CommonPrefixes")]
+    folders = (record["Prefix"] for record in iter_objects_cached(b,os.path.join(g,"results/"),delimiter = "/",refresh = refresh) if "Prefix" in record)
+    return itertools.islice(folders,limit)
+
+def job_prefix(b,g,resulttag):
+    """Get the prefix of the results folder NeuroCAAS creates for a job. 
 
-    return folders
+    """
+    return os.path.join(g,"results","job__{}_{}".format(b,resulttag),"")
 
 def submit_job(b,g, inputname,configname,resultname = None):
     """Submit a job to NeuroCAAS with a given inputname, configname, and optional result timestamp. 
@@ -119,94 +294,458 @@ def submit_job(b,g, inputname,configname,resultname = None):
             } 
 
     key = os.path.join(g,"submissions",submit_filename)
-    writeobj = s3_resource.Object(b,key)
-    writeobj.put(Body=json.dumps(submit_content,indent = 4).encode("utf-8"))
+    body = json.dumps(submit_content,indent = 4).encode("utf-8")
+    get_client("s3").put_object(Bucket = b,Key = key,Body = body)
+    record_upload(b,key,len(body))
+    ## the job will create a new results folder. 
+    listing_cache.invalidate(b,os.path.join(g,"results/"))
+    job_index.record_submission(b,job_prefix(b,g,resultname),resultname,inputname,configname,time.time())
 
     response["submit_filename"] = submit_filename
     response["submit_content"] = submit_content
     return response
     
-def get_logfiles(bucketname,pathprefix,outputpath):
-    """Given a path to a directory, get the logfiles contained in "s3://bucketname/pathprefix/logs/{certificate.txt,DATASET_NAME:{}_STATUS.txt}", and write them to "outputpath/logs/{}".
+def read_job_manifest(path):
+    """Read the jobs to submit with submit_batch from a CSV, JSON or YAML manifest. Each job needs a dataname and a configname, and can have a resulttag. In JSON and YAML the manifest is a list of such objects, and dataname can be a list. In CSV these are column names, and several datanames can be separated with ";". Reading YAML requires pyyaml. 
+
+    :param path: path to the manifest. The format is taken from the extension (.csv, .json, .yaml or .yml).
+    :return: list of jobs, as dicts with a list "dataname", a "configname" and a "resulttag" (None if not given).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path,"r",newline = "") as f:
+        if ext == ".csv":
+            rows = list(csv.DictReader(f))
+        elif ext == ".json":
+            try:
+                rows = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError("Manifest {} is not valid JSON: {}".format(path,e))
+        elif ext in [".yaml",".yml"]:
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Reading YAML manifests requires pyyaml. Install it with `pip install pyyaml`, or use a CSV or JSON manifest.")
+            rows = yaml.safe_load(f)
+        else:    
+            raise ValueError("Manifest {} must be a .csv, .json, .yaml or .yml file".format(path))
+    if rows is None:
+        rows = []
+    if not isinstance(rows,list) or not all(isinstance(row,dict) for row in rows):
+        raise ValueError("Manifest {} must be a list of jobs, each with a dataname and a configname".format(path))
+    jobs = []
+    for i,row in enumerate(rows):
+        dataname = row.get("dataname")
+        configname = row.get("configname")
+        if not dataname or not configname:
+            raise ValueError("Job {} in manifest {} needs a dataname and a configname".format(i,path))
+        if isinstance(dataname,str):
+            dataname = [d.strip() for d in dataname.split(";") if d.strip()]
+        jobs.append({"dataname":list(dataname),
+                     "configname":configname,
+                     "resulttag":str(row["resulttag"]) if row.get("resulttag") else None})
+    return jobs
+
+def batch_tags(n):
+    """Make n distinct result tags for a batch of jobs without waiting between them. Tags start with the timestamp format submit_job uses, followed by a random token shared by the batch (so that batches started in the same second do not collide) and the index of the job. 
+
+    :param n: number of tags to make.
+    :return: list of n strings.
+    """
+    base = time.strftime("%S%M%H%d%b%y")+secrets.token_hex(2)
+    return ["{}{:04d}".format(base,i) for i in range(n)]
+
+def submit_batch(b,g,jobs,workers = 16):
+    """Submit many jobs to NeuroCAAS at once. Every job gets a distinct result tag (its own, or one from batch_tags), so submission files never overwrite each other and there is no need to wait between jobs as submit_job does. Submission files are written concurrently. 
+
+    :param b: name of the bucket to submit to.
+    :param g: group prefix to submit under.
+    :param jobs: list of jobs, as returned by read_job_manifest.
+    :param workers: (optional) number of submission files to write at once. Default 16
+    :return: list with one dict per job in the order given, with its "dataname", "configname", "resulttag", "submit_filename", the "jobpath" to pass to setup_polling, and an "error" (None if it was submitted).
+    """
+    tags = [job["resulttag"] for job in jobs]
+    given = [tag for tag in tags if tag is not None]
+    if len(set(given)) < len(given):
+        raise ValueError("Result tags in a batch must be distinct.")
+    generated = iter(batch_tags(len(jobs)))
+    tags = [tag if tag is not None else next(generated) for tag in tags]
+
+    client = get_client("s3",max_pool_connections = workers)
+    def write(job,tag):
+        submit_content = {
+                "dataname":job["dataname"],
+                "configname":job["configname"],
+                "timestamp":tag,
+                } 
+        key = os.path.join(g,"submissions","{}_submit.json".format(tag))
+        body = json.dumps(submit_content,indent = 4).encode("utf-8")
+        client.put_object(Bucket = b,Key = key,Body = body)
+        return key,len(body)
+
+    results = []
+    uploads = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(write,job,tag) for job,tag in zip(jobs,tags)]
+        for job,tag,future in zip(jobs,tags,futures):
+            result = {"dataname":job["dataname"],
+                      "configname":job["configname"],
+                      "resulttag":tag,
+                      "submit_filename":"{}_submit.json".format(tag),
+                      "jobpath":job_prefix(b,g,tag).rstrip("/"),
+                      "error":None}
+            try:
+                uploads.append(future.result())
+                job_index.record_submission(b,job_prefix(b,g,tag),tag,job["dataname"],job["configname"],time.time())
+            except (botocore.exceptions.ClientError,botocore.exceptions.BotoCoreError) as e:
+                result["error"] = str(e)
+            results.append(result)
+    record_uploads(b,uploads)
+    ## the jobs will create new results folders. 
+    listing_cache.invalidate(b,os.path.join(g,"results/"))
+    return results
+
+def refresh_job_index(b,g,workers = 16):
+    """Bring the job index up to date for a group, incrementally: one delimiter listing of the results folder finds new jobs, and the endfile of each job that was not finished at the last refresh is checked with a head request, in parallel. Finished jobs are never checked again.  
+
+    :param b: name of the bucket.
+    :param g: group prefix.
+    :param workers: (optional) number of head requests to send at once. Default 16
+    :return: dictionary with the number of job folders "listed", of jobs "checked" and of those that were "finished".
+    """
+    resultsprefix = os.path.join(g,"results/")
+    head = "{}job__{}_".format(resultsprefix,b)
+    prefixes = [r["Prefix"] for r in iter_objects(b,resultsprefix,delimiter = "/") if "Prefix" in r]
+    job_index.record_listed(b,prefixes,[p[len(head):-1] if p.startswith(head) else None for p in prefixes])
+    running = [prefix for prefix,state in job_index.pending(b,resultsprefix) if state == "running"]
+
+    client = get_client("s3",max_pool_connections = workers)
+    def check(prefix):
+        try:
+            response = client.head_object(Bucket = b,Key = os.path.join(prefix,"process_results","end.txt"))
+            return prefix,"finished",response["LastModified"].timestamp()
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ["404","NoSuchKey","NotFound"]:
+                return prefix,"running",None
+            raise
+    with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+        updates = list(executor.map(check,running))
+    job_index.update_states(b,updates,time.time())
+    return {"listed":len(prefixes),"checked":len(running),"finished":len([u for u in updates if u[1] == "finished"])}
+
+def job_status(b,g,state = None,sort = "submitted",descending = False,limit = None,refresh = True):
+    """Get the status of the jobs of a group from the job index (see jobindex.JobIndex), after bringing it up to date with refresh_job_index. 
+
+    :param state: (optional) only return jobs in this state: "submitted", "running" or "finished".
+    :param sort: (optional) sort by "submitted", "ended", "tag" or "state". Default "submitted".
+    :param descending: (optional) if true, sort in descending order. 
+    :param limit: (optional) maximum number of jobs to return.
+    :param refresh: (optional) if false, answer from the index as it is, without any request to s3. Default True
+    :return: list of jobs, as dicts with the "prefix", "tag", "dataname", "configname", "submitted", "state", "ended" and "checked" of each job. Times are in seconds since the epoch.
+    """
+    if refresh:
+        refresh_job_index(b,g)
+    return job_index.jobs(b,under = os.path.join(g,"results/"),state = state,sort = sort,descending = descending,limit = limit)
+
+def get_logfiles(bucketname,pathprefix,outputpath,tail = False,echo = False):
+    """Given a path to a directory, get the logfiles contained in "s3://bucketname/pathprefix/logs/{certificate.txt,DATASET_NAME:{}_STATUS.txt}", and write them to "outputpath/logs/{}". Logfiles that have not changed since they were last downloaded to outputpath are skipped, as recorded by a manifest file in outputpath.
 
     :param bucketname: name of the bucket to get logs from.
     :param pathprefix: the path identifying job logs: exclude logs.
     :param outputpath: the path to an existing directory on the local machine. Will create a logs subdirectory if does not exist, and write logs there.
+    :param tail: if true, logfiles that have grown since they were last downloaded are fetched with a ranged request for the new bytes only (see Interface_S3.download_tail). Logfiles that were rewritten are downloaded in full. Default False
+    :param echo: if true, print the new content of each logfile to stdout, like `tail -f`. Default False
+    :return: list of the keys that were downloaded. 
     """
     if not os.path.exists(outputpath):
         print("Output path {} does not exist".format(outputpath))
-    filenames = ls_name(bucketname,os.path.join(pathprefix,"logs/"))
+    records = ls_metadata(bucketname,os.path.join(pathprefix,"logs/"))
     local_logs = os.path.join(outputpath,"logs/")
     if not os.path.exists(local_logs):
         os.mkdir(local_logs)
-    for filepath in filenames:
-        try:
-            filename = os.path.basename(filepath)
-            s3_client.download_file(bucketname,filepath,os.path.join(local_logs,filename))
-        except IsADirectoryError:
-            pass
+    manifest = SyncManifest(os.path.join(outputpath,manifestname))
+    client = get_client("s3")
+    downloaded = []
+    for record in records:
+        filepath = record["Key"]
+        if filepath.endswith("/"):
+            continue
+        localpath = os.path.join(local_logs,os.path.basename(filepath))
+        if manifest.is_current(record,localpath):
+            continue
+        new = None
+        if tail and filepath in manifest.records and os.path.exists(localpath) and record["Size"] > os.path.getsize(localpath):
+            new = download_tail(client,bucketname,filepath,localpath)
+        if new is None:
+            ## logs are small: a single get_object, without the head_object download_file sends first. 
+            new = throttle.Reader(client.get_object(Bucket = bucketname,Key = filepath)["Body"],filepath).read()
+            with open(localpath,"wb") as f:
+                f.write(new)
+        if echo and len(new) > 0:
+            sys.stdout.write("==> {} <==\n{}".format(os.path.basename(filepath),new.decode("utf-8",errors = "replace")))
+            if not new.endswith(b"\n"):
+                sys.stdout.write("\n")
+            sys.stdout.flush()
+        manifest.update(record)
+        downloaded.append(filepath)
+    if len(downloaded) > 0:
+        manifest.save()
+    return downloaded    
 
 def get_end(bucketname,pathprefix):
-    """Given a path to a directory, look for an "endfile" contained in "s3://bucketname/pathprefix/process_results/end.txt"
+    """Given a path to a directory, look for an "endfile" contained in "s3://bucketname/pathprefix/process_results/end.txt". Uses a single head request on the endfile. 
 
     :param bucketname: name of the bucket to get endfile.
     :param pathprefix: the path identifying job: exclude process_results.
     """
     path = os.path.join(pathprefix,"process_results","end.txt")
-    endfiles = ls_name(bucketname,path)
-    if path in endfiles:
+    try:
+        get_client("s3").head_object(Bucket = bucketname,Key = path)
         return True
-    else:
-        return False
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ["404","NoSuchKey","NotFound"]:
+            return False
+        raise
 
-def get_results(bucketname,pathprefix,outputpath):
-    """Given a path to a directory, get the result files contained in "s3://bucketname/pathprefix/process_results/", and write them to "outputpath/process_results".
+def wait_for_end_event(queue_url,bucketname,pathprefix,wait):
+    """Wait for an s3 event notification announcing the endfile of a job on an SQS queue (or a local stand-in, i.e. localstack). Both raw s3 notifications and notifications wrapped by SNS are understood. Messages about the endfile are deleted from the queue; other messages are left for other consumers. 
+
+    :param queue_url: url of the queue receiving s3 event notifications for the bucket.
+    :param bucketname: name of the bucket holding the job.
+    :param pathprefix: the path identifying job: exclude process_results.
+    :param wait: maximum number of seconds to wait for the event.
+    :return: True if a notification for the endfile was received.
+    """
+    sqs_client = get_client("sqs")
+    path = os.path.join(pathprefix,"process_results","end.txt")
+    deadline = time.time()+wait
+    while True:
+        remaining = int(round(deadline-time.time()))
+        response = sqs_client.receive_message(QueueUrl = queue_url,MaxNumberOfMessages = 10,WaitTimeSeconds = max(0,min(20,remaining)))
+        for message in response.get("Messages",[]):
+            body = json.loads(message["Body"])
+            if "Message" in body: ## delivered through SNS
+                body = json.loads(body["Message"])
+            for record in body.get("Records",[]):
+                s3_record = record.get("s3",{})
+                if s3_record.get("bucket",{}).get("name") == bucketname and urllib.parse.unquote_plus(s3_record.get("object",{}).get("key","")) == path:
+                    sqs_client.delete_message(QueueUrl = queue_url,ReceiptHandle = message["ReceiptHandle"])
+                    return True
+        if time.time() >= deadline:
+            return False
+
+## names of archives of all result files a pipeline can write next to its results, in order of preference: 
+archivenames = ["results.tar.zst","results.tar.gz","results.tgz","results.tar"]
+
+def find_archive(bucketname,prefix):
+    """Look for an archive of all result files (see archivenames) directly under prefix, with a single listing request. Archives compressed with zstd are only considered if the zstandard package is installed. 
+
+    :param bucketname: name of the bucket to look in.
+    :param prefix: the prefix holding result files, ending in "/".
+    :return: the listing record of the preferred archive, or None if there is none.
+    """
+    try:
+        import zstandard
+        candidates = archivenames
+    except ImportError:
+        candidates = [name for name in archivenames if not name.endswith(".zst")]
+    records = {r["Key"][len(prefix):]:r for r in iter_objects(bucketname,prefix+"results.t")}
+    for name in candidates:
+        if name in records:
+            return records[name]
+    return None
+
+def get_results(bucketname,pathprefix,outputpath,workers = 8,retries = 3,select = None,archive = False):
+    """Given a path to a directory, get the result files contained in "s3://bucketname/pathprefix/process_results/", and write them to "outputpath/process_results". Files are downloaded in parallel. Files that were already downloaded (i.e. while the job was running) and have not changed since are skipped, as recorded by the manifest file in outputpath. 
 
     :param bucketname: name of the bucket to get results from.
     :param pathprefix: the path identifying job process_results: exclude process_results.
     :param outputpath: the path to an existing directory on the local machine. Will create a process_results subdirectory if does not exist, and write results there.
+    :param workers: (optional) number of files to download at once. Default 8.
+    :param retries: (optional) number of times to retry each file if its download fails. Default 3.
+    :param select: (optional) function called with the listing record of each result file, returning whether it should be downloaded now (see stable_selector). Default None, downloads all.
+    :param archive: (optional) if true, and the pipeline wrote an archive of its results (see find_archive), extract that archive into "outputpath/process_results" as it downloads instead of downloading each file. Falls back to downloading each file if there is no archive or it cannot be extracted. If result files were already downloaded one by one (i.e. streamed by setup_polling), the archive is not used: only the missing files are downloaded, and nothing if all of them are present. Default False.
+    :returns: summary of the download from sync_results, listing downloaded and failed keys. If an archive was extracted, "archive" gives its key and "downloaded" only lists the archive. 
     """
-    filenames = ls_name(bucketname,os.path.join(pathprefix,"process_results/"))
-    local_results = os.path.join(outputpath,"process_results/")
-    if not os.path.exists(local_results):
-        os.mkdir(local_results)
-    for filepath in filenames:
-        try:
-            filename = os.path.basename(filepath)
-            s3_client.download_file(bucketname,filepath,os.path.join(local_results,filename))
-        except IsADirectoryError:
-            pass
+    prefix = os.path.join(pathprefix,"process_results/")
+    resultpath = os.path.join(outputpath,"process_results")
+    manifestpath = os.path.join(outputpath,manifestname)
+    if archive:
+        record = find_archive(bucketname,prefix)
+        if record is not None:
+            manifest = SyncManifest(manifestpath)
+            if any(key.startswith(prefix) and key != record["Key"] for key in manifest.records):
+                ## result files were already downloaded one by one (i.e. streamed while the job ran): do not mix in the archive, only download the files that are still missing. 
+                archivekeys = [prefix+name for name in archivenames]
+                return sync_results(bucketname,prefix,resultpath,workers = workers,retries = retries,select = lambda r: r["Key"] not in archivekeys,manifestpath = manifestpath)
+            summary = {"downloaded":[],"failed":{},"unchanged":0,"deleted":[],"archive":record["Key"]}
+            if manifest.is_current(record,resultpath):
+                summary["unchanged"] = 1
+                return summary
+            try:
+                extract_archive(get_client("s3"),bucketname,record["Key"],resultpath)
+                manifest.update(record)
+                manifest.save()
+                summary["downloaded"].append(record["Key"])
+                return summary
+            except Exception as e:
+                print("Could not extract {}, downloading result files one by one instead: {}".format(record["Key"],e))
+    return sync_results(bucketname,prefix,resultpath,workers = workers,retries = retries,select = select,manifestpath = manifestpath)
+
+def stable_selector():
+    """Get a function that can be passed as the select argument of get_results or sync_results to only download objects that have stopped changing. The function remembers the Size and ETag of each object it is called with, and selects an object once they are unchanged over two consecutive listings. 
 
-
-def poll(bucketname,pathprefix,output):
+    """
+    seen = {}
+    def stable(record):
+        state = [record["Size"],record["ETag"]]
+        is_stable = seen.get(record["Key"]) == state
+        seen[record["Key"]] = state
+        return is_stable
+    return stable
+
+def sync_results(bucketname,prefix,outputpath,workers = 8,retries = 3,delete = False,select = None,manifestpath = None,progress = None):
+    """Mirror all objects under a prefix into a local directory, keeping the full key hierarchy. Only objects that are missing locally or have changed since they were last synced (according to the manifest file in outputpath) are downloaded, in parallel. The prefix can identify one job ("group/results/job__x/") or the whole "group/results/" prefix. 
+
+    :param bucketname: name of the bucket to sync from.
+    :param prefix: the prefix to mirror. Keys are written to outputpath relative to this prefix.
+    :param outputpath: the local directory to mirror into. Created if it does not exist.
+    :param workers: (optional) number of files to download at once. Default 8.
+    :param retries: (optional) number of times to retry each file if its download fails. Default 3.
+    :param delete: (optional) if true, delete local files under outputpath that no longer exist under the prefix. Default False.
+    :param select: (optional) function called with the listing record of each object, returning whether it should be synced now. Default None, syncs all.
+    :param manifestpath: (optional) path of the manifest file. Default is a manifest file in outputpath.
+    :param progress: (optional) mode of a single progress line for all downloads: "bar", "log" or "quiet" (see progress.Progress). Default None, no progress is reported.
+    :returns: summary dictionary with "downloaded" and "failed" as in Interface_S3.download_many, as well as "unchanged", the number of objects that were already up to date, and "deleted", a list of deleted local files. 
+    """
+    if not prefix.endswith("/"):
+        prefix = prefix+"/"
+    os.makedirs(outputpath,exist_ok = True)
+    root = os.path.abspath(outputpath)
+    if manifestpath is None:
+        manifestpath = os.path.join(outputpath,manifestname)
+    manifest = SyncManifest(manifestpath)
+    records = {}
+    transfers = []
+    failed = {}
+    unchanged = 0
+    for record in iter_objects(bucketname,prefix):
+        if record["Key"].endswith("/"):
+            continue
+        localpath = os.path.abspath(os.path.join(root,record["Key"][len(prefix):]))
+        if not localpath.startswith(root+os.sep): ## keys like "../x" should not escape outputpath.
+            continue
+        records[localpath] = record
+        if select is not None and not select(record):
+            continue
+        if manifest.is_current(record,localpath):
+            unchanged += 1
+            continue
+        try:
+            os.makedirs(os.path.dirname(localpath),exist_ok = True)
+        except OSError as e:
+            ## i.e. keys "a" and "a/b": "a" cannot be both a file and a directory. 
+            failed[record["Key"]] = str(e)
+            continue
+        transfers.append((record["Key"],localpath,record["Size"],record.get("ETag")))
+
+    if progress is not None:
+        progress = Progress(total = sum(transfer[2] for transfer in transfers),label = prefix,files = len(transfers),mode = progress)
+    summary = download_many(get_client("s3",max_pool_connections = workers),bucketname,transfers,workers = workers,retries = retries,progress = progress)
+    summary["failed"].update(failed)
+    downloaded = set(summary["downloaded"])
+    for localpath,record in records.items():
+        if record["Key"] in downloaded:
+            manifest.update(record)
+
+    summary["unchanged"] = unchanged
+    summary["deleted"] = []
+    if delete:
+        manifestfiles = [os.path.abspath(path) for path in manifest.files()]
+        for dirpath,dirs,files in os.walk(root,topdown = False):
+            for f in files:
+                localpath = os.path.join(dirpath,f)
+                if localpath in records or localpath in manifestfiles:
+                    continue
+                os.remove(localpath)
+                manifest.remove(prefix+os.path.relpath(localpath,root).replace(os.sep,"/"))
+                summary["deleted"].append(localpath)
+            if dirpath != root and len(os.listdir(dirpath)) == 0:
+                os.rmdir(dirpath)
+    manifest.save()
+    return summary
+
+def poll(bucketname,pathprefix,output,queue_url = None,wait = 0,stream = None,workers = 8,tail = False,echo = False):
     """One round of polling a job for logging output. Returns true or false based on the output of get_end.
     :param bucketname: name of the bucket to get logs from.
     :param pathprefix: the path identifying job logs: exclude logs.
     :param outputpath: the path to an existing directory on the local machine. Will create a logs subdirectory if does not exist, and write logs there.
+    :param queue_url: (optional) url of a queue receiving s3 event notifications. If given, waits on the queue for the endfile event (see wait_for_end_event) before checking the endfile directly. 
+    :param wait: (optional) number of seconds to wait on the queue. Default 0
+    :param stream: (optional) a selector from stable_selector. If given, also downloads the result files it selects, so results arrive while the job is running. Default None
+    :param workers: (optional) number of result files to download at once when streaming. Default 8
+    :param tail: (optional) if true, fetch only the new bytes of logfiles that grow (see get_logfiles). Default False
+    :param echo: (optional) if true, print new log content to stdout (see get_logfiles). Default False
     """
-    get_logfiles(bucketname,pathprefix,output)
+    get_logfiles(bucketname,pathprefix,output,tail = tail,echo = echo)
+    if stream is not None:
+        get_results(bucketname,pathprefix,output,workers = workers,select = stream)
+    if queue_url is not None and wait_for_end_event(queue_url,bucketname,pathprefix,wait):
+        return True
     return get_end(bucketname,pathprefix)
 
-def setup_polling(bucketname,pathprefix,output,step = 60,timeout = 60*15):
-    """Set up polling function
+def setup_polling(bucketname,pathprefix,output,step = 60,timeout = 60*15,workers = 8,min_step = 2,queue_url = None,stream = False,tail = False,follow = False,archive = False):
+    """Set up polling function. Polls quickly at first, then doubles the time between polls up to step, so that jobs that finish soon are noticed soon without polling long jobs too often.
 
     :param bucketname: name of the bucket to get logs from.
     :param pathprefix: the path identifying job logs: exclude logs.
     :param outputpath: the path to an existing directory on the local machine. Will create a logs subdirectory if does not exist, and write logs there.
-    :param step: number of seconds to wait before querying again. Default 60
+    :param step: maximum number of seconds to wait before querying again. Default 60
     :param timeout: timeout for the poll in seconds. Default 15 mins
-    :returns: returns an exit code: 0: success, 1: timeout, 2: uncaught exception.
+    :param workers: number of result files to download at once when the job finishes. Default 8
+    :param min_step: number of seconds to wait before the first query again. Default 2
+    :param queue_url: url of a queue receiving s3 event notifications for the bucket. If given, waits on the queue between polls instead of sleeping, so the end of the job is noticed as soon as its event arrives. Default None
+    :param stream: if true, download result files while the job is running, once they have stopped changing between two polls (see stable_selector). Only the remaining files are downloaded when the job finishes. Default False
+    :param tail: if true, fetch only the new bytes of logfiles that grow, so each poll costs in proportion to new output (see get_logfiles). Default False
+    :param follow: if true, print new log content as it arrives, like `tail -f`. Implies tail. Default False
+    :param archive: if true, extract an archive of the results written by the pipeline instead of downloading each result file, when there is one (see get_results). Default False
+    :returns: returns an exit code: 0: success, 1: timeout, 2: uncaught exception or failed result downloads.
     """
     def ended(response):
         return response == True
+    def backoff(current):
+        return min(2*current,step)
+    selector = stable_selector() if stream else None
+    if selector is not None and archive:
+        ## the archive is extracted when the job finishes, if no result files were streamed before (see get_results). 
+        stable = selector
+        selector = lambda record: os.path.basename(record["Key"]) not in archivenames and stable(record)
     try:
-        polling2.poll(
-            lambda : poll(bucketname,pathprefix,output),
-            check_success = ended,
-            step = step,
-            timeout = timeout,
-            log = logging.INFO)
-        get_results(bucketname,pathprefix,output)
+        if queue_url is None:
+            polling2.poll(
+                lambda : poll(bucketname,pathprefix,output,stream = selector,workers = workers,tail = tail or follow,echo = follow),
+                check_success = ended,
+                step = min(min_step,step),
+                step_function = backoff,
+                timeout = timeout,
+                log = logging.INFO)
+        else:    
+            wait = {"step":min(min_step,step)}
+            def poll_queue():
+                response = poll(bucketname,pathprefix,output,queue_url = queue_url,wait = wait["step"],stream = selector,workers = workers,tail = tail or follow,echo = follow)
+                wait["step"] = backoff(wait["step"])
+                return response
+            polling2.poll(
+                poll_queue,
+                check_success = ended,
+                step = 0,
+                timeout = timeout,
+                log = logging.INFO)
+        summary = get_results(bucketname,pathprefix,output,workers = workers,archive = archive)
+        if len(summary["failed"]) > 0:
+            print("Failed to download {} of {} result files:".format(len(summary["failed"]),len(summary["failed"])+len(summary["downloaded"])))
+            for keyname,error in summary["failed"].items():
+                print("{}: {}".format(keyname,error))
+            return 2
         return 0
 
     except polling2.TimeoutException as te:
@@ -216,4 +755,86 @@ def setup_polling(bucketname,pathprefix,output,step = 60,timeout = 60*15):
         print(e)
         return 2
 
+def format_status_table(statuses):
+    """Format the status of many jobs as a table. 
+
+    :param statuses: dictionary from job path prefixes to dictionaries with fields "state", "polls" and "elapsed" (in seconds). 
+    :return: the table as a string, one line per job. 
+    """
+    width = max([len("JOB")]+[len(p) for p in statuses])
+    lines = ["{:<{w}}  {:<12}  {:>5}  {:>8}".format("JOB","STATE","POLLS","ELAPSED",w = width)]
+    for pathprefix,status in statuses.items():
+        lines.append("{:<{w}}  {:<12}  {:>5}  {:>7.0f}s".format(pathprefix,status["state"],status["polls"],status["elapsed"],w = width))
+    return "\n".join(lines)    
+
+def poll_many(bucketname,pathprefixes,output,step = 60,timeout = 60*15,workers = 8,min_step = 2,display = True):
+    """Poll many jobs at once from a single asyncio event loop. Each job is polled with the same backoff as setup_polling, and its results are downloaded as soon as it finishes, while other jobs continue to be polled. All blocking s3 calls run on one shared, bounded thread pool. Prints a status table as jobs progress. 
 
+    :param bucketname: name of the bucket to get logs from.
+    :param pathprefixes: list of paths identifying jobs: exclude logs.
+    :param output: the path to an existing directory on the local machine. Logs and results for each job are written to a subdirectory named after the last component of its path.
+    :param step: maximum number of seconds to wait before querying a job again. Default 60
+    :param timeout: timeout for the poll in seconds, for each job. Default 15 mins
+    :param workers: number of s3 calls to run at once. Result files are downloaded with these workers split between the jobs that can download at once, so that no more than about workers downloads are in flight. Default 8
+    :param min_step: number of seconds to wait before the first query again. Default 2
+    :param display: if true, redraws the status table in place. Otherwise, prints a line each time a job changes state. Default True
+    :returns: dictionary from path prefixes to the exit codes of setup_polling: 0: success, 1: timeout, 2: uncaught exception or failed result downloads.
+    """
+    statuses = {pathprefix:{"state":"polling","polls":0,"elapsed":0.} for pathprefix in pathprefixes}
+    drawn = {"lines":0}
+    ## up to workers jobs can download at once on the shared pool: split the downloads between them, so requests in flight stay around workers instead of workers squared. 
+    download_workers = max(1,workers//max(1,min(workers,len(pathprefixes))))
+
+    def update(pathprefix,state = None):
+        status = statuses[pathprefix]
+        changed = state is not None and state != status["state"]
+        if state is not None:
+            status["state"] = state
+        if display:
+            table = format_status_table(statuses)
+            sys.stdout.write("\033[{}F".format(drawn["lines"]) if drawn["lines"] > 0 else "")
+            sys.stdout.write("\033[J"+table+"\n")
+            sys.stdout.flush()
+            drawn["lines"] = len(table.split("\n"))
+        elif changed:    
+            print("{}: {}".format(pathprefix,state))
+
+    async def watch(loop,executor,pathprefix):
+        jobdir = os.path.join(output,os.path.basename(os.path.normpath(pathprefix)))
+        os.makedirs(jobdir,exist_ok = True)
+        start = loop.time()
+        wait = min(min_step,step)
+        try:
+            while True:
+                ended = await loop.run_in_executor(executor,poll,bucketname,pathprefix,jobdir)
+                statuses[pathprefix]["polls"] += 1
+                statuses[pathprefix]["elapsed"] = loop.time()-start
+                if ended:
+                    update(pathprefix,"downloading")
+                    summary = await loop.run_in_executor(executor,functools.partial(get_results,bucketname,pathprefix,jobdir,workers = download_workers))
+                    if len(summary["failed"]) > 0:
+                        update(pathprefix,"failed ({})".format(len(summary["failed"])))
+                        return 2
+                    update(pathprefix,"done")
+                    return 0
+                if loop.time()-start+wait > timeout:
+                    update(pathprefix,"timeout")
+                    return 1
+                update(pathprefix)
+                await asyncio.sleep(wait)
+                wait = min(2*wait,step)
+        except Exception as e:        
+            update(pathprefix,"error")
+            print("{}: {}".format(pathprefix,e))
+            return 2
+
+    async def watch_all(loop):
+        with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+            codes = await asyncio.gather(*[watch(loop,executor,pathprefix) for pathprefix in pathprefixes])
+        return dict(zip(pathprefixes,codes))
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(watch_all(loop))
+    finally:
+        loop.close()
@@ -0,0 +1,143 @@
+## local cache of s3 listings. 
+import os
+import json
+import time
+import hashlib
+
+default_ttl = 300
+default_max_records = 100000
+
+class ListingCache(object):
+    """On-disk cache of the records returned by listing a prefix of an s3 bucket (see analyze.iter_objects), keyed by bucket, prefix and delimiter. Each listing is stored in its own file in a cache directory, and expires ttl seconds after it was listed. 
+
+    :param path: directory to store cached listings in. Does not have to exist yet. 
+    :param ttl: number of seconds a listing stays valid. 
+    :param max_records: largest number of records a listing can have to be cached. Larger listings are not buffered, and are listed again every time. 
+    """
+    def __init__(self,path,ttl = default_ttl,max_records = default_max_records):
+        self.path = path
+        self.ttl = ttl
+        self.max_records = max_records
+
+    def entrypath(self,bucket,prefix,delimiter = None):
+        """Get the path to the file caching a given listing. 
+
+        """
+        identifier = "{}|{}|{}".format(bucket,prefix,delimiter)
+        return os.path.join(self.path,hashlib.sha1(identifier.encode("utf-8")).hexdigest()+".json")
+
+    def entries(self,bucket):
+        """Iterate over the paths and headers of all cached listings for a bucket, expired or not. Headers hold the bucket, prefix, delimiter and time of the listing, and are read without the records. 
+
+        """
+        if not os.path.isdir(self.path):
+            return
+        for filename in os.listdir(self.path):
+            if not filename.endswith(".json"):
+                continue
+            entrypath = os.path.join(self.path,filename)
+            try:
+                with open(entrypath,"r") as f:
+                    header = json.loads(f.readline())
+            except (FileNotFoundError,json.JSONDecodeError):
+                continue
+            if header.get("bucket") == bucket:
+                yield entrypath,header
+
+    def read(self,entrypath):
+        """Read a cached listing: its header, with the records added under "records". 
+
+        :return: the entry, or None if it does not exist or cannot be read. 
+        """
+        try:
+            with open(entrypath,"r") as f:
+                entry = json.loads(f.readline())
+                entry["records"] = json.loads(f.readline())
+        except (FileNotFoundError,json.JSONDecodeError):
+            return None
+        return entry
+
+    def get(self,bucket,prefix,delimiter = None):
+        """Get a cached listing. 
+
+        :return: the list of records in the listing, or None if it is not cached or has expired. 
+        """
+        entry = self.read(self.entrypath(bucket,prefix,delimiter))
+        if entry is None or time.time()-entry["time"] > self.ttl:
+            return None
+        return entry["records"]
+
+    def put(self,bucket,prefix,delimiter,records,listed = None):
+        """Cache a listing. 
+
+        :param records: list of records in the listing, as yielded by analyze.iter_objects. 
+        :param listed: (optional) time at which the listing was made. Defaults to now. 
+        """
+        entry = {"bucket":bucket,"prefix":prefix,"delimiter":delimiter,"time":time.time() if listed is None else listed,"records":records}
+        self.write(self.entrypath(bucket,prefix,delimiter),entry)
+
+    def write(self,entrypath,entry):
+        """Write a listing as two lines of JSON: a header without the records, then the records, so that entries can read headers without parsing records. 
+
+        """
+        os.makedirs(self.path,exist_ok = True)
+        header = {field:value for field,value in entry.items() if field != "records"}
+        with open(entrypath+".tmp","w") as f:
+            f.write(json.dumps(header)+"\n")
+            f.write(json.dumps(entry["records"])+"\n")
+        os.replace(entrypath+".tmp",entrypath)
+
+    def remove(self,entrypath):
+        """Remove a cached listing, if it still exists. 
+
+        """
+        try:
+            os.remove(entrypath)
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self,bucket,key = None):
+        """Remove cached listings that could contain a given key.  
+
+        :param key: (optional) the key or prefix that has changed. If not given, removes all listings for the bucket. 
+        """
+        for entrypath,header in list(self.entries(bucket)):
+            if key is None or key.startswith(header["prefix"]) or header["prefix"].startswith(key):
+                self.remove(entrypath)
+
+    def record(self,bucket,record):
+        """Write a newly created or changed object through to all cached listings that contain it, so they stay valid without listing again. See record_many. 
+
+        :param record: the record of the object, with at least a Key field. 
+        """
+        self.record_many(bucket,[record])
+
+    def record_many(self,bucket,records):
+        """Write newly created or changed objects through to all cached listings that contain them, reading and rewriting each listing at most once. Only listings whose prefix matches one of the keys are read, and expired listings are removed instead of updated. 
+
+        :param records: list of records of the objects, each with at least a Key field. 
+        """
+        if len(records) == 0:
+            return
+        now = time.time()
+        for entrypath,header in list(self.entries(bucket)):
+            if now-header["time"] > self.ttl:
+                self.remove(entrypath)
+                continue
+            prefix,delimiter = header["prefix"],header["delimiter"]
+            matching = [record for record in records if record["Key"].startswith(prefix)]
+            if len(matching) == 0:
+                continue
+            entry = self.read(entrypath)
+            if entry is None:
+                continue
+            listed = {r.get("Key",r.get("Prefix")):r for r in entry["records"]}
+            for record in matching:
+                rest = record["Key"][len(prefix):]
+                if delimiter is not None and delimiter in rest:
+                    folder = prefix+rest.split(delimiter)[0]+delimiter
+                    listed[folder] = {"Prefix":folder}
+                else:    
+                    listed[record["Key"]] = record
+            entry["records"] = [listed[name] for name in sorted(listed)]
+            self.write(entrypath,entry)
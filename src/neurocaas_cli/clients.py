@@ -0,0 +1,90 @@
+## shared, lazily created boto3 session and clients. 
+import threading
+from . import telemetry
+
+default_region = "us-east-1"
+
+## transport settings shared by all clients. Read from the "transport" entry of the cli config file, and overridable per command (see configure). 
+default_transport = {"max_pool_connections":32, ## connections kept open per client. Raised per client if more threads will share it. 
+                     "retry_mode":"adaptive", ## "standard" retries with jittered exponential backoff, "adaptive" also slows down the request rate after throttling errors. 
+                     "max_attempts":8, ## including the first attempt. 
+                     "connect_timeout":10, ## seconds
+                     "read_timeout":60, ## seconds
+                     "tcp_keepalive":True}
+
+_lock = threading.RLock()
+_session = None
+_clients = {}
+_transport = dict(default_transport)
+
+def get_session():
+    """Get the boto3 session shared by all clients, creating it on first use. boto3 is only imported at this point, so commands that never talk to AWS do not pay for it.  
+
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            import boto3
+            _session = boto3.session.Session()
+        return _session
+
+def set_session(session):
+    """Replace the shared session, and forget all clients created from the old one. Used to point the cli at another endpoint, i.e. a localstack session for testing.  
+
+    :param session: a boto3 session, or any object with the same client method. If None, a default session is created on next use. 
+    """
+    global _session
+    with _lock:
+        _session = session
+        _clients.clear()
+
+def configure(**settings):
+    """Change the transport settings used by clients, and forget all clients created with the old ones. 
+
+    :param settings: any of the keys of default_transport. Settings given as None are left unchanged. 
+    """
+    unknown = [k for k in settings if k not in default_transport]
+    if len(unknown) > 0:
+        raise ValueError("Unknown transport settings {}. Valid settings are {}".format(unknown,list(default_transport)))
+    with _lock:
+        _transport.update({k:v for k,v in settings.items() if v is not None})
+        _clients.clear()
+
+def get_transport():
+    """Get a copy of the current transport settings. 
+
+    """
+    with _lock:
+        return dict(_transport)
+
+def transport_config(max_pool_connections = None):
+    """Build the botocore Config for the current transport settings. 
+
+    :param max_pool_connections: (optional) minimum size of the connection pool. 
+    """
+    from botocore.config import Config
+    settings = get_transport()
+    kwargs = {"max_pool_connections":max(settings["max_pool_connections"],max_pool_connections or 0),
+              "retries":{"mode":settings["retry_mode"],"total_max_attempts":settings["max_attempts"]},
+              "connect_timeout":settings["connect_timeout"],
+              "read_timeout":settings["read_timeout"]}
+    if "tcp_keepalive" in Config.OPTION_DEFAULTS: ## only in recent versions of botocore. 
+        kwargs["tcp_keepalive"] = settings["tcp_keepalive"]
+    return Config(**kwargs)
+
+def get_client(service = "s3",max_pool_connections = None):
+    """Get a client for an AWS service, created from the shared session on first use and cached afterwards. Clients are thread safe, so the same client should be shared by all threads. Clients use the shared transport settings (see configure), and are instrumented for telemetry (see telemetry.instrument). 
+
+    :param service: name of the service. Default "s3"
+    :param max_pool_connections: (optional) number of concurrent requests the client's connection pool should support, if more than the configured pool size. Clients with different pool sizes are cached separately. 
+    """
+    with _lock:
+        pool = max(_transport["max_pool_connections"],max_pool_connections or 0)
+        key = ("client",service,pool)
+        if key not in _clients:
+            session = get_session()
+            kwargs = {"config":transport_config(pool)}
+            if getattr(session,"region_name",default_region) is None:
+                kwargs["region_name"] = default_region
+            _clients[key] = telemetry.instrument(session.client(service,**kwargs))
+        return _clients[key]
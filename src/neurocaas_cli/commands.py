@@ -1,18 +1,116 @@
 ## contains CLI commands. 
 import click 
 import os 
+import sys
 import json
-from neurocaas_cli import analyze as analyze_mod 
+import time
+import functools
 
 
 ## configuration file settings:
 configname = ".neurocaas_cli_config.json"
 configpath = os.path.join(os.path.expanduser("~"),configname)
 
+def load_analyze():
+    """Import the analyze module, and with it boto3, only once a command needs it. This keeps `--help` and `init` fast. 
+
+    """
+    from neurocaas_cli import analyze
+    return analyze
+
+def report_metrics(metrics_out,metrics_format):
+    """Print the telemetry summary for a command to stderr, and write its metrics to metrics_out if given. 
+
+    """
+    from neurocaas_cli import telemetry
+    click.echo(telemetry.recorder.format_summary(),err = True)
+    if metrics_out is not None:
+        if metrics_format is None:
+            metrics_format = "openmetrics" if os.path.splitext(metrics_out)[1] in [".prom",".txt"] else "jsonl"
+        if metrics_format == "openmetrics":
+            telemetry.recorder.write_openmetrics(metrics_out)
+        else:    
+            telemetry.recorder.write_jsonl(metrics_out)
+
+def configure_transport(settings,**overrides):
+    """Apply the transport settings from the config file, then any given on the command line. 
+
+    :param settings: dict from the "transport" entry of the config file. 
+    :param overrides: settings given on the command line. None means not given. 
+    """
+    from neurocaas_cli import clients
+    try:
+        clients.configure(**settings)
+        clients.configure(**overrides)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+def configure_bandwidth(settings,**overrides):
+    """Apply the bandwidth limits from the config file, then any given on the command line. 
+
+    :param settings: dict from the "bandwidth" entry of the config file, giving limits in MB/s for "upload" and "download". 
+    :param overrides: limits given on the command line. None means not given. 
+    """
+    from neurocaas_cli import throttle
+    limits = dict(settings)
+    limits.update({k:v for k,v in overrides.items() if v is not None})
+    try:
+        for direction,rate in limits.items():
+            throttle.set_limit(direction,rate)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+def in_daemon(*paths):
+    """Decorator for commands that can run in the background daemon (see daemon.py). If a daemon is running, the command's parameters are sent to it and its output is printed as it arrives. Otherwise, or when run by the daemon itself, or when the command was given options that only apply to this process (--no-daemon, --metrics or transport and bandwidth overrides), the command runs here. Goes between click.pass_obj and the command function. 
+
+    :param paths: names of parameters that are local paths. They are made absolute before they are sent, as the daemon does not share the working directory of the caller. 
+    """
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(obj,**params):
+            from neurocaas_cli import daemon
+            ctx = click.get_current_context()
+            if daemon.serving or ctx.meta.get("neurocaas_local",False):
+                return f(obj,**params)
+            sent = dict(params)
+            for name in paths:
+                if isinstance(sent[name],(list,tuple)):
+                    sent[name] = [os.path.abspath(os.path.expanduser(p)) for p in sent[name]]
+                elif sent[name] is not None:    
+                    sent[name] = os.path.abspath(os.path.expanduser(sent[name]))
+            try:
+                if daemon.run(ctx.command.name,sent,obj,lambda text,err: click.echo(text,nl = False,err = err),tty = sys.stdout.isatty()):
+                    return
+            except daemon.DaemonError as e:
+                raise click.ClickException(str(e))
+            except KeyboardInterrupt:
+                click.echo("\nStopped waiting for output. The command keeps running in the daemon.",err = True)
+                raise click.exceptions.Exit(130)
+            return f(obj,**params)
+        return wrapper
+    return decorate
+
 ## main functions
 @click.group(help = "base command for the CLI")
+@click.option("--metrics",help = "record the latency, bytes, retries and throttling of every request to AWS, and print a summary when the command ends.",is_flag = True)
+@click.option("--metrics-out",help = "file to write recorded metrics to. Implies --metrics. (optional)",default = None)
+@click.option("--metrics-format",help = "format of --metrics-out: one JSON line per request, or OpenMetrics text totals. (default openmetrics for .prom and .txt files, jsonl otherwise)",type = click.Choice(["jsonl","openmetrics"]),default = None)
+@click.option("--pool-size",help = "number of connections to keep open to AWS per client. Overrides transport.max_pool_connections in the config file. (default 32)",type = int,default = None)
+@click.option("--retry-mode",help = "how to retry failed requests: with jittered exponential backoff (standard), also slowing down after throttling (adaptive), or botocore's legacy behavior. Overrides transport.retry_mode. (default adaptive)",type = click.Choice(["standard","adaptive","legacy"]),default = None)
+@click.option("--max-attempts",help = "maximum number of attempts per request, including the first. Overrides transport.max_attempts. (default 8)",type = int,default = None)
+@click.option("--connect-timeout",help = "seconds to wait for a connection. Overrides transport.connect_timeout. (default 10)",type = float,default = None)
+@click.option("--read-timeout",help = "seconds to wait for data on an open connection. Overrides transport.read_timeout. (default 60)",type = float,default = None)
+@click.option("--upload-limit",help = "cap on the total upload bandwidth of the command, in MB/s. Overrides bandwidth.upload in the config file. (default no cap)",type = float,default = None)
+@click.option("--download-limit",help = "cap on the total download bandwidth of the command, in MB/s. Overrides bandwidth.download in the config file. (default no cap)",type = float,default = None)
+@click.option("--no-daemon",help = "run the command in this process even if a background daemon is running.",is_flag = True)
 @click.pass_context
-def cli(ctx): 
+def cli(ctx,metrics,metrics_out,metrics_format,pool_size,retry_mode,max_attempts,connect_timeout,read_timeout,upload_limit,download_limit,no_daemon): 
+    overrides = [pool_size,retry_mode,max_attempts,connect_timeout,read_timeout,upload_limit,download_limit,metrics_out]
+    ctx.meta["neurocaas_local"] = no_daemon or metrics or any(o is not None for o in overrides)
+    if metrics or metrics_out is not None:
+        from neurocaas_cli import telemetry
+        telemetry.recorder.enable()
+        ctx.call_on_close(lambda : report_metrics(metrics_out,metrics_format))
     ## assign registration info to the context if exists. 
     try:
         with open(configpath,"r") as f:
@@ -20,10 +118,12 @@ def cli(ctx):
         ctx.obj = config_dict    
     ## if not exists, assert that must be initialized.  
     except (FileNotFoundError,click.ClickException,KeyError):    
-        if ctx.invoked_subcommand =="init":
+        if ctx.invoked_subcommand in ["init","daemon"]:
             return ## move on and run configure. 
         else:
             raise click.ClickException("Configuration file not found. Run `neurocaas-cli init` to initialize the cli.")
+    configure_transport(config_dict.get("transport",{}),max_pool_connections = pool_size,retry_mode = retry_mode,max_attempts = max_attempts,connect_timeout = connect_timeout,read_timeout = read_timeout)
+    configure_bandwidth(config_dict.get("bandwidth",{}),upload = upload_limit,download = download_limit)
         
 @cli.command(help = "Initialize CLI with user data.")
 @click.option("--bucketname",help = "Name of S3 bucket to interact with.")
@@ -31,13 +131,61 @@ def cli(ctx):
 def init(bucketname,groupprefix):
     """Configure CLI with the bucket and username used to identify a certain S3 bucket to work with. 
     """
-    obj = {}
+    try: ## keep other settings, like transport. 
+        with open(configpath,"r") as f:
+            obj = json.load(f)
+    except (FileNotFoundError,ValueError):
+        obj = {}
     obj["bucketname"] = bucketname
     obj["groupprefix"] = groupprefix
     print("writing/updating config file")
     with open(configpath,"w") as f:
         json.dump(obj,f,indent = 4)
 
+@cli.group(help = "Run a background daemon that keeps clients warm and polls jobs after the terminal closes. While it runs, analyze commands are sent to it.")
+def daemon():
+    """Manage the background daemon. 
+
+    """
+
+@daemon.command(help = "start the daemon in the background.")
+@click.option("--foreground",help = "run the daemon in this process instead, until it is stopped.",is_flag = True)
+def start(foreground):
+    from neurocaas_cli import daemon as daemon_mod
+    if daemon_mod.running():
+        raise click.ClickException("A daemon is already running. See `neurocaas-cli daemon status`.")
+    if foreground:
+        daemon_mod.serve()
+        return
+    try:
+        pid = daemon_mod.start()
+    except daemon_mod.DaemonError as e:
+        raise click.ClickException(str(e))
+    click.echo("Daemon {} listening on {}. Output of commands that outlive their terminal goes to {}".format(pid,daemon_mod.socketpath,daemon_mod.logpath))
+
+@daemon.command(help = "stop the daemon. Commands it is running (i.e. polls) finish first, unless --force is given.")
+@click.option("--force",help = "stop at once, abandoning running commands.",is_flag = True)
+def stop(force):
+    from neurocaas_cli import daemon as daemon_mod
+    reply = daemon_mod.request({"op":"stop","force":force},timeout = 10)
+    if reply is None:
+        raise click.ClickException("No daemon is running.")
+    if reply["active"] > 0 and not force:
+        click.echo("Daemon stopping once its {} running command(s) finish.".format(reply["active"]))
+    else:    
+        click.echo("Daemon stopped.")
+
+@daemon.command(help = "show if the daemon is running, and the commands it is running.")
+def status():
+    from neurocaas_cli import daemon as daemon_mod
+    reply = daemon_mod.request({"op":"status"},timeout = 10)
+    if reply is None:
+        click.echo("No daemon is running.")
+        return
+    click.echo("Daemon {} up for {:.0f} s, running {} command(s).".format(reply["pid"],time.time()-reply["started"],len(reply["active"])))
+    for active in reply["active"]:
+        click.echo("  [{}] {} (for {:.0f} s) {}".format(active["id"],active["command"],time.time()-active["started"],json.dumps(active["params"])))
+
 @cli.group(help = "Analyze data with CLI")
 @click.pass_context
 def analyze(ctx):
@@ -47,72 +195,179 @@ def analyze(ctx):
 
 @analyze.command(help = "upload data to user data location in NeuroCAAS")
 @click.option("-d","--datapath",help = "path(s) to local file(s) you will upload as data", multiple = True)
+@click.option("--chunksize",help = "size in MB of the parts large files are uploaded in. (default 8)", default = 8)
+@click.option("--concurrency",help = "number of parts of a large file to upload at once. (default 10)", default = 10)
+@click.option("--force",help = "upload even if an identical file is already in NeuroCAAS.", is_flag = True)
+@click.option("--compress",help = "compress files as they are uploaded. The uploaded file holds compressed bytes and its name gets a .gz or .zst suffix, so only use this with analyses that accept compressed input. zstd requires the zstandard package. (optional)",type = click.Choice(["gzip","zstd"]),default = None)
+@click.option("--level",help = "compression level. (default 6 for gzip, 3 for zstd)",type = int,default = None)
+@click.option("--threads",help = "number of threads to compress with, for zstd. (default 0, compress on the main thread)",default = 0)
 @click.pass_obj
-def upload_data(ctx,datapath):
+@in_daemon("datapath")
+def upload_data(ctx,datapath,chunksize,concurrency,force,compress,level,threads):
     """Upload a file located at "datapath" to the user's S3 location. 
 
     """
+    if compress == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise click.ClickException("zstd compression requires `pip install zstandard`")
+    analyze_mod = load_analyze()
+    config = analyze_mod.TransferConfig(multipart_threshold = chunksize*1024**2,multipart_chunksize = chunksize*1024**2,max_concurrency = concurrency)
     for datap in datapath: 
-        response = analyze_mod.upload_data(ctx.obj["bucketname"],ctx.obj["groupprefix"],datap)
-    click.echo(response)    
+        response = analyze_mod.upload_data(ctx["bucketname"],ctx["groupprefix"],datap,config = config,force = force,compress = compress,level = level,threads = threads)
+        click.echo(response)    
+
+@analyze.command(help = "upload many data files, directories or glob patterns at once, sharing one pool of connections")
+@click.option("-d","--datapath",help = "path(s) to local files, directories or glob patterns you will upload as data", multiple = True)
+@click.option("--chunksize",help = "size in MB of the parts large files are uploaded in. (default 8)", default = 8)
+@click.option("--concurrency",help = "number of files or parts to upload at once. (default 10)", default = 10)
+@click.option("--force",help = "upload even if an identical file is already in NeuroCAAS.", is_flag = True)
+@click.option("--progress",help = "how to report progress: a single redrawn line (bar), a line every 10 percent (log) or nothing (quiet). (default bar in a terminal, log otherwise)",type = click.Choice(["bar","log","quiet"]),default = None)
+@click.pass_obj
+@in_daemon("datapath")
+def upload_batch(ctx,datapath,chunksize,concurrency,force,progress):
+    """Upload all files matched by "datapath" to the user's S3 location. 
+
+    """
+    analyze_mod = load_analyze()
+    config = analyze_mod.TransferConfig(multipart_threshold = chunksize*1024**2,multipart_chunksize = chunksize*1024**2,max_concurrency = concurrency)
+    response = analyze_mod.upload_batch(ctx["bucketname"],ctx["groupprefix"],datapath,config = config,force = force,progress = progress or ("bar" if sys.stdout.isatty() else "log"))
+    for r in response["results"]:
+        if r["status"] == "failed":
+            click.echo("{}: failed ({})".format(r["localpath"],r["errors"]))
+        elif r["status"] == "uploaded":    
+            click.echo("{}: uploaded to {} ({:.2f} MB in {:.2f} s)".format(r["localpath"],r["s3path"],r["bytes"]/1e6,r["seconds"]))
+        else:    
+            click.echo("{}: skipped, identical to {}".format(r["localpath"],r["s3path"]))
+    counts = {status:len([r for r in response["results"] if r["status"] == status]) for status in ["uploaded","skipped","failed"]}
+    click.echo("Uploaded {} files ({:.2f} MB) in {:.2f} s: {:.2f} MB/s. {} skipped, {} failed.".format(counts["uploaded"],response["uploaded_bytes"]/1e6,response["seconds"],response["throughput"],counts["skipped"],counts["failed"]))
 
 @analyze.command(help = "upload config file to user config location in NeuroCAAS")
 @click.option("-c","--configpath",help = "path(s) to local file(s) you will upload as config", multiple = True)
+@click.option("--force",help = "upload even if an identical file is already in NeuroCAAS.", is_flag = True)
 @click.pass_obj
-def upload_config(ctx,configpath):    
+@in_daemon("configpath")
+def upload_config(ctx,configpath,force):    
     """
 
     """
+    analyze_mod = load_analyze()
     for configp in configpath: 
-        response = analyze_mod.upload_config(configp)
+        response = analyze_mod.upload_config(ctx["bucketname"],ctx["groupprefix"],configp,force = force)
     click.echo(response)    
 
         
 @analyze.command(help = "list data and config files currently uploaded to NeuroCAAS")
+@click.option("-n","--limit",help = "maximum number of data files and config files to list (optional). A listing stopped by the limit is not cached.",default = None,type = int)
+@click.option("--refresh",help = "list from NeuroCAAS even if a recent listing is cached.",is_flag = True)
 @click.pass_obj
-def list_inputs(ctx):    
+@in_daemon()
+def list_inputs(ctx,limit,refresh):    
     """
 
     """
+    analyze_mod = load_analyze()
 
-    datafiles, configfiles = analyze_mod.list_inputs(ctx["bucketname"],ctx["groupprefix"])
+    datafiles, configfiles = analyze_mod.list_inputs(ctx["bucketname"],ctx["groupprefix"],limit,refresh)
     click.echo("############### Data files: #################")
-    click.echo("\n".join(datafiles))
+    for datafile in datafiles:
+        click.echo(datafile)
     click.echo("############### Config files: #################")
-    click.echo("\n".join(configfiles))
+    for configfile in configfiles:
+        click.echo(configfile)
     
 @analyze.command(help = "submit a job to NeuroCAAS using data and config that is on local computer or in NeuroCAAS storage.")    
 @click.option("-d","--datapath",help = "path(s) to uploaded data for analysis assuming group name as prefix",multiple = True)
 @click.option("-c","--configpath",help = "path to uploaded config for analysis assuming group name as prefix")
 @click.option("-r","--resulttag",help = "timestamp to associate with job (optional)",default = None)
 @click.pass_obj
+@in_daemon()
 def submit_job(ctx,datapath,configpath,resulttag):    
     """
 
     """
+    analyze_mod = load_analyze()
     response = analyze_mod.submit_job(ctx["bucketname"],ctx["groupprefix"],datapath,configpath,resulttag)
     click.echo(response)
 
+@analyze.command(help = "submit many jobs to NeuroCAAS from a CSV, JSON or YAML manifest of datanames and confignames. Prints the submitted jobs as JSON.")    
+@click.option("-m","--manifest",help = "path to the manifest of jobs to submit.",required = True)
+@click.option("-w","--workers",help = "number of submissions to write in parallel. (default 16)",default = 16)
+@click.pass_obj
+@in_daemon("manifest")
+def submit_batch(ctx,manifest,workers):    
+    """
+
+    """
+    analyze_mod = load_analyze()
+    try:
+        jobs = analyze_mod.read_job_manifest(manifest)
+    except (ValueError,ImportError,OSError) as e:
+        raise click.ClickException(str(e))
+    results = analyze_mod.submit_batch(ctx["bucketname"],ctx["groupprefix"],jobs,workers)
+    click.echo(json.dumps(results,indent = 4))
+
 @analyze.command(help = "list existing results for different analyses on NeuroCAAS")
+@click.option("-n","--limit",help = "maximum number of results to list (optional). A listing stopped by the limit is not cached.",default = None,type = int)
+@click.option("--refresh",help = "list from NeuroCAAS even if a recent listing is cached.",is_flag = True)
+@click.pass_obj
+@in_daemon()
+def list_results(ctx,limit,refresh):
+    """
+
+    """
+    analyze_mod = load_analyze()
+    for result in analyze_mod.list_results(ctx["bucketname"],ctx["groupprefix"],limit,refresh):
+        click.echo(result)
+
+@analyze.command(help = "show the status of your jobs from a local index, updated with one listing plus a check of each unfinished job.")
+@click.option("--state",help = "only show jobs in this state.",type = click.Choice(["submitted","running","finished"]),default = None)
+@click.option("--sort",help = "sort jobs by submit time, end time, result tag or state. (default submitted)",type = click.Choice(["submitted","ended","tag","state"]),default = "submitted")
+@click.option("--desc",help = "sort in descending order.",is_flag = True)
+@click.option("-n","--limit",help = "maximum number of jobs to show (optional)",default = None,type = int)
+@click.option("--no-refresh",help = "answer from the local index without contacting NeuroCAAS.",is_flag = True)
+@click.option("--json","as_json",help = "print jobs as JSON.",is_flag = True)
 @click.pass_obj
-def list_results(ctx,):
+@in_daemon()
+def job_status(ctx,state,sort,desc,limit,no_refresh,as_json):
     """
 
     """
-    response = analyze_mod.list_results(ctx["bucketname"],ctx["groupprefix"])
-    click.echo("\n".join(response))
+    analyze_mod = load_analyze()
+    jobs = analyze_mod.job_status(ctx["bucketname"],ctx["groupprefix"],state = state,sort = sort,descending = desc,limit = limit,refresh = not no_refresh)
+    if as_json:
+        click.echo(json.dumps(jobs,indent = 4))
+        return
+    def timestamp(t):
+        return time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(t)) if t is not None else "-"
+    click.echo("{:<40}{:<11}{:<21}{:<21}".format("job","state","submitted","ended"))
+    for job in jobs:
+        name = job["prefix"].rstrip("/").split("/")[-1]
+        click.echo("{:<40}{:<11}{:<21}{:<21}".format(name,job["state"],timestamp(job["submitted"]),timestamp(job["ended"])))
+    counts = {s:len([job for job in jobs if job["state"] == s]) for s in ["submitted","running","finished"]}
+    click.echo("{} jobs: {} submitted, {} running, {} finished.".format(len(jobs),counts["submitted"],counts["running"],counts["finished"]))
 
 @analyze.command(help = "poll an ongoing analysis for logs and results.")
 @click.option("-l","--localpath",help = "local directory to which we should write results.")
 @click.option("-rt","--resulttag",help = "timestamp associated with job to poll. One of resulttag or resultpath must be given.",default = None)
 @click.option("-rp","--resultpath",help = "full folder name associated with job to poll. One of resulttag or resultpath must be given.",default = None)
-@click.option("-i","--interval",help = "interval between polling in seconds. (default 60 seconds)",default = 60 )
+@click.option("-i","--interval",help = "maximum interval between polling in seconds. (default 60 seconds)",default = 60 )
 @click.option("-t","--timeout",help = "timeout for the poll in seconds. (default 15 mins)", default = 60*15)
+@click.option("-w","--workers",help = "number of result files to download in parallel. (default 8)", default = 8)
+@click.option("--min-interval",help = "interval before the first repeated poll in seconds. Doubles after every poll up to interval. (default 2 seconds)", default = 2)
+@click.option("-q","--queue-url",help = "url of an SQS queue receiving s3 event notifications for the bucket, to learn about job completion as soon as it happens (optional)", default = None)
+@click.option("-s","--stream",help = "download result files while the job is running, as soon as they stop changing.",is_flag = True)
+@click.option("--tail",help = "fetch only the new part of log files that have grown since the last poll.",is_flag = True)
+@click.option("-f","--follow",help = "print new log output as it arrives, like tail -f. Implies --tail.",is_flag = True)
+@click.option("--archive",help = "if the job wrote an archive of its results (results.tar.gz, results.tar.zst or results.tar), extract it instead of downloading each result file.",is_flag = True)
 @click.pass_obj
-def setup_polling(ctx,localpath,resulttag,resultpath,interval,timeout):
+@in_daemon("localpath")
+def setup_polling(ctx,localpath,resulttag,resultpath,interval,timeout,workers,min_interval,queue_url,stream,tail,follow,archive):
     """
 
     """
+    analyze_mod = load_analyze()
     ## choose between timestamp or path output. 
     assert resulttag is not None or resultpath is not None
     assert not all(r is None for r in [resulttag,resultpath])
@@ -120,31 +375,92 @@ def setup_polling(ctx,localpath,resulttag,resultpath,interval,timeout):
         resultpath = "job__{}_{}".format(ctx["bucketname"],resulttag)
     else:    
         pass
-    outcome = analyze_mod.setup_polling(ctx["bucketname"],os.path.join(ctx["groupprefix"],"results",resultpath),localpath,interval,timeout)
+    outcome = analyze_mod.setup_polling(ctx["bucketname"],os.path.join(ctx["groupprefix"],"results",resultpath),localpath,interval,timeout,workers,min_interval,queue_url,stream,tail,follow,archive)
     outcome_codes = {0:"Success. See {} for results".format(localpath),
                      1:"Timeout. Run polling again to keep monitoring for output.",
-                     2:"Unhandled Exception. See message above. "}
+                     2:"Unhandled Exception or failed downloads. See message above. "}
     click.echo(outcome_codes[outcome])
 
 
+@analyze.command(help = "poll many ongoing analyses at once for logs and results.")
+@click.option("-l","--localpath",help = "local directory to which we should write results. Each job gets its own subdirectory.",required = True)
+@click.option("-rt","--resulttag",help = "timestamp(s) associated with jobs to poll.",multiple = True)
+@click.option("-rp","--resultpath",help = "full folder name(s) associated with jobs to poll.",multiple = True)
+@click.option("-i","--interval",help = "maximum interval between polling each job in seconds. (default 60 seconds)",default = 60 )
+@click.option("-t","--timeout",help = "timeout for the poll in seconds. (default 15 mins)", default = 60*15)
+@click.option("-w","--workers",help = "number of s3 requests to make in parallel. (default 8)", default = 8)
+@click.option("--min-interval",help = "interval before the first repeated poll in seconds. Doubles after every poll up to interval. (default 2 seconds)", default = 2)
+@click.pass_obj
+@in_daemon("localpath")
+def poll_many(ctx,localpath,resulttag,resultpath,interval,timeout,workers,min_interval):
+    """
+
+    """
+    analyze_mod = load_analyze()
+    assert len(resulttag)+len(resultpath) > 0
+    resultpaths = list(resultpath)+["job__{}_{}".format(ctx["bucketname"],r) for r in resulttag]
+    pathprefixes = [os.path.join(ctx["groupprefix"],"results",r) for r in resultpaths]
+    outcomes = analyze_mod.poll_many(ctx["bucketname"],pathprefixes,localpath,interval,timeout,workers,min_interval,display = sys.stdout.isatty())
+    outcome_codes = {0:"Success. See {} for results",
+                     1:"Timeout. Run polling again to keep monitoring for output.",
+                     2:"Unhandled Exception or failed downloads. See message above. "}
+    for r,pathprefix in zip(resultpaths,pathprefixes):
+        click.echo("{}: {}".format(r,outcome_codes[outcomes[pathprefix]].format(os.path.join(localpath,r))))
+
+@analyze.command(help = "mirror the full contents of job result folders into a local directory, downloading only what is missing or changed.")
+@click.option("-l","--localpath",help = "local directory to mirror results into.",required = True)
+@click.option("-rt","--resulttag",help = "timestamp(s) associated with jobs to sync.",multiple = True)
+@click.option("-rp","--resultpath",help = "full folder name(s) associated with jobs to sync.",multiple = True)
+@click.option("-a","--all","sync_all",help = "sync all results folders.",is_flag = True)
+@click.option("-w","--workers",help = "number of files to download in parallel. (default 8)", default = 8)
+@click.option("--delete",help = "delete local files that no longer exist in NeuroCAAS.",is_flag = True)
+@click.option("--progress",help = "how to report progress: a single redrawn line (bar), a line every 10 percent (log) or nothing (quiet). (default bar in a terminal, log otherwise)",type = click.Choice(["bar","log","quiet"]),default = None)
+@click.pass_obj
+@in_daemon("localpath")
+def sync_results(ctx,localpath,resulttag,resultpath,sync_all,workers,delete,progress):
+    """
+
+    """
+    analyze_mod = load_analyze()
+    if sync_all:
+        targets = [(os.path.join(ctx["groupprefix"],"results",""),localpath)]
+    else:    
+        assert len(resulttag)+len(resultpath) > 0
+        resultpaths = list(resultpath)+["job__{}_{}".format(ctx["bucketname"],r) for r in resulttag]
+        targets = [(os.path.join(ctx["groupprefix"],"results",r,""),os.path.join(localpath,r)) for r in resultpaths]
+    for prefix,outputpath in targets:
+        summary = analyze_mod.sync_results(ctx["bucketname"],prefix,outputpath,workers = workers,delete = delete,progress = progress or ("bar" if sys.stdout.isatty() else "log"))
+        click.echo("{}: {} downloaded, {} unchanged, {} deleted, {} failed.".format(outputpath,len(summary["downloaded"]),summary["unchanged"],len(summary["deleted"]),len(summary["failed"])))
+        for keyname,error in summary["failed"].items():
+            click.echo("{}: {}".format(keyname,error))
+
 @analyze.command(help = "simultaneously submit a job and poll for results")
 @click.option("-d","--datapath",help = "path(s) to uploaded data for analysis assuming group name as prefix",multiple = True)
 @click.option("-c","--configpath",help = "path to uploaded config for analysis assuming group name as prefix")
 @click.option("-l","--localpath",help = "local directory to which we should write results.")
 @click.option("-r","--resulttag",help = "timestamp to associate with job (optional)",default = None)
-@click.option("-i","--interval",help = "interval between polling in seconds. (default 60 seconds)",default = 60 )
+@click.option("-i","--interval",help = "maximum interval between polling in seconds. (default 60 seconds)",default = 60 )
 @click.option("-t","--timeout",help = "timeout for the poll in seconds. (default 15 mins)", default = 60*15)
+@click.option("-w","--workers",help = "number of result files to download in parallel. (default 8)", default = 8)
+@click.option("--min-interval",help = "interval before the first repeated poll in seconds. Doubles after every poll up to interval. (default 2 seconds)", default = 2)
+@click.option("-q","--queue-url",help = "url of an SQS queue receiving s3 event notifications for the bucket, to learn about job completion as soon as it happens (optional)", default = None)
+@click.option("-s","--stream",help = "download result files while the job is running, as soon as they stop changing.",is_flag = True)
+@click.option("--tail",help = "fetch only the new part of log files that have grown since the last poll.",is_flag = True)
+@click.option("-f","--follow",help = "print new log output as it arrives, like tail -f. Implies --tail.",is_flag = True)
+@click.option("--archive",help = "if the job wrote an archive of its results (results.tar.gz, results.tar.zst or results.tar), extract it instead of downloading each result file.",is_flag = True)
 @click.pass_obj
-def submit_and_poll(ctx,datapath,configpath,localpath,resulttag,interval,timeout):    
+@in_daemon("localpath")
+def submit_and_poll(ctx,datapath,configpath,localpath,resulttag,interval,timeout,workers,min_interval,queue_url,stream,tail,follow,archive):    
     """
 
     """
+    analyze_mod = load_analyze()
     submit_response = analyze_mod.submit_job(ctx["bucketname"],ctx["groupprefix"],datapath,configpath,resulttag)
     click.echo("Job submitted. Starting polling.")
     resultpath = "job__{}_{}".format(ctx["bucketname"],submit_response["submit_content"]["timestamp"])
-    outcome = analyze_mod.setup_polling(ctx["bucketname"],os.path.join(ctx["groupprefix"],"results",resultpath),localpath,interval,timeout)
+    outcome = analyze_mod.setup_polling(ctx["bucketname"],os.path.join(ctx["groupprefix"],"results",resultpath),localpath,interval,timeout,workers,min_interval,queue_url,stream,tail,follow,archive)
     outcome_codes = {0:"Success. See {} for results".format(localpath),
                      1:"Timeout. Run polling again to keep monitoring for output.",
-                     2:"Unhandled Exception. See message above. "}
+                     2:"Unhandled Exception or failed downloads. See message above. "}
     click.echo(outcome_codes[outcome])
 
@@ -0,0 +1,298 @@
+## optional background process that runs cli commands with warm clients, so that they do not pay for startup, and keeps polling jobs after the terminal that started them closes.
+## Commands talk to it over a unix socket, with one JSON message per line. Only the standard library is imported here, so that commands can reach the daemon without importing boto3.
+import os
+import sys
+import json
+import time
+import socket
+import threading
+
+daemonpath = os.path.join(os.path.expanduser("~"),".neurocaas_cli")
+socketpath = os.path.join(daemonpath,"daemon.sock")
+logpath = os.path.join(daemonpath,"daemon.log")
+
+## set in the daemon process, so that commands it runs are not sent back to it.
+serving = False
+
+class DaemonError(Exception):
+    """Raised when a command run by the daemon fails. The message is the one the command failed with.
+
+    """
+
+def connect(timeout = None):
+    """Connect to the daemon.
+
+    :param timeout: (optional) seconds to wait for each reply. Default None, waits as long as the command runs.
+    :return: a connected socket, or None if no daemon is running.
+    """
+    if not hasattr(socket,"AF_UNIX") or not os.path.exists(socketpath):
+        return None
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.connect(socketpath)
+    except OSError:
+        sock.close()
+        return None
+    sock.settimeout(timeout)
+    return sock
+
+def running():
+    """Check if a daemon is listening on socketpath.
+
+    """
+    sock = connect()
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+def send(sock,message):
+    sock.sendall((json.dumps(message)+"\n").encode("utf-8"))
+
+def messages(sock):
+    """Iterate over the messages received on a socket until it closes.
+
+    """
+    with sock.makefile("r",encoding = "utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+def request(message,output = None,timeout = None):
+    """Send a request to the daemon, and return its final reply. Output the daemon sends along the way is passed to `output`.
+
+    :param message: dict with an "op" key: "run", "status" or "stop".
+    :param output: (optional) called with the text and a flag that is true if the text goes to stderr, for each piece of output.
+    :param timeout: (optional) seconds to wait for each reply.
+    :return: the last message from the daemon, or None if no daemon is running.
+    """
+    sock = connect(timeout)
+    if sock is None:
+        return None
+    try:
+        send(sock,message)
+        for reply in messages(sock):
+            if "out" in reply:
+                if output is not None:
+                    output(reply["out"],reply["err"])
+            else:
+                return reply
+    finally:
+        sock.close()
+    raise DaemonError("The daemon closed the connection before the command finished.")
+
+def run(command,params,config,output,tty = False):
+    """Run an `analyze` command in the daemon.
+
+    :param command: name of the command, i.e. "list-results".
+    :param params: dict of the command's parameters, as parsed by click. Local paths should be absolute, as the daemon does not share the working directory of the caller.
+    :param config: contents of the cli config file.
+    :param output: called with each piece of output and a flag that is true if it goes to stderr.
+    :param tty: (optional) whether the caller's stdout is a terminal, so that the command can format its output for it.
+    :return: True if the command ran in the daemon, False if no daemon is running.
+    :raises: DaemonError if the command failed.
+    """
+    reply = request({"op":"run","command":command,"params":params,"config":config,"tty":tty},output = output)
+    if reply is None:
+        return False
+    if reply.get("error") is not None:
+        raise DaemonError(reply["error"])
+    return True
+
+def start(wait = 10):
+    """Start a daemon in the background, detached from the terminal, with output going to logpath. Returns once it accepts connections.
+
+    :param wait: (optional) seconds to wait for the daemon to come up. Default 10
+    :return: the pid of the daemon.
+    """
+    import subprocess
+    os.makedirs(daemonpath,mode = 0o700,exist_ok = True)
+    with open(logpath,"a") as log:
+        process = subprocess.Popen([sys.executable,"-c","from neurocaas_cli.daemon import serve; serve()"],
+                stdin = subprocess.DEVNULL,stdout = log,stderr = log,start_new_session = True,cwd = "/")
+    deadline = time.time()+wait
+    while time.time() < deadline:
+        if running():
+            return process.pid
+        if process.poll() is not None:
+            raise DaemonError("The daemon exited with status {}. See {}".format(process.returncode,logpath))
+        time.sleep(0.05)
+    raise DaemonError("The daemon did not start within {} seconds. See {}".format(wait,logpath))
+
+class ThreadStream(object):
+    """Stand-in for sys.stdout or sys.stderr in the daemon, that sends writes from each command's thread to the client that ran the command, and everything else to the daemon log.
+
+    """
+    def __init__(self,default):
+        self.default = default
+        self.local = threading.local()
+
+    def current(self):
+        """The stream writes from the calling thread go to.
+
+        """
+        return getattr(self.local,"stream",None) or self.default
+
+    def write(self,text):
+        return self.current().write(text)
+
+    def flush(self):
+        self.current().flush()
+
+    def isatty(self):
+        return self.current().isatty()
+
+    def __getattr__(self,name):
+        return getattr(self.default,name)
+
+class ClientStream(object):
+    """Stream that forwards output to a connected client. Once the client goes away (i.e. its terminal was closed), output goes to the daemon log instead and the command keeps running.
+
+    """
+    def __init__(self,sock,err,default,lock,tty = False):
+        self.sock = sock
+        self.err = err
+        self.default = default
+        self.lock = lock
+        self.tty = tty
+        self.encoding = "utf-8"
+
+    def write(self,text):
+        with self.lock:
+            if self.sock is not None:
+                try:
+                    send(self.sock,{"out":text,"err":self.err})
+                    return len(text)
+                except OSError:
+                    self.sock = None
+        return self.default.write(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.tty and self.sock is not None
+
+class Server(object):
+    """The daemon: accepts connections on socketpath, and runs each request in its own thread. Clients are created once, when the daemon starts, and shared by all commands it runs.
+
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.active = {}
+        self.lock = threading.Lock()
+        self.ids = iter(range(1,sys.maxsize))
+        self.stopping = threading.Event()
+        self.force = False
+
+    def handle(self,sock):
+        try:
+            with sock.makefile("r",encoding = "utf-8") as f:
+                line = f.readline()
+            if not line: ## a connection to check that the daemon is running. 
+                return
+            message = json.loads(line)
+            if message["op"] == "run":
+                self.run(sock,message)
+            elif message["op"] == "status":
+                with self.lock:
+                    active = list(self.active.values())
+                send(sock,{"pid":os.getpid(),"started":self.started,"active":active})
+            elif message["op"] == "stop":
+                self.force = message.get("force",False)
+                self.stopping.set()
+                with self.lock:
+                    send(sock,{"stopping":True,"active":len(self.active)})
+            else:
+                send(sock,{"error":"Unknown request {}".format(message["op"])})
+        except (OSError,ValueError,KeyError) as e:
+            print("Bad request: {}".format(e),file = sys.__stderr__)
+        finally:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def run(self,sock,message):
+        import click
+        from neurocaas_cli import commands
+        lock = threading.Lock()
+        stdout = ClientStream(sock,False,sys.stdout.default,lock,tty = message.get("tty",False))
+        stderr = ClientStream(sock,True,sys.stderr.default,lock)
+        with self.lock:
+            jobid = next(self.ids)
+            self.active[jobid] = {"id":jobid,"command":message["command"],"params":message["params"],"started":time.time()}
+        sys.stdout.local.stream,sys.stderr.local.stream = stdout,stderr
+        error = None
+        try:
+            command = commands.analyze.commands[message["command"]]
+            ctx = click.Context(command,info_name = message["command"],obj = message["config"])
+            with ctx:
+                ctx.invoke(command.callback,**message["params"])
+        except click.ClickException as e:
+            error = e.format_message()
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__,e)
+            import traceback
+            traceback.print_exc()
+        finally:
+            sys.stdout.local.stream,sys.stderr.local.stream = None,None
+            with self.lock:
+                del self.active[jobid]
+        with lock:
+            if stdout.sock is not None:
+                try:
+                    send(sock,{"error":error})
+                except OSError:
+                    pass
+
+    def serve(self):
+        global serving
+        serving = True
+        os.makedirs(daemonpath,mode = 0o700,exist_ok = True)
+        if os.path.exists(socketpath):
+            if running():
+                raise DaemonError("A daemon is already listening on {}".format(socketpath))
+            os.remove(socketpath)
+        sys.stdout,sys.stderr = ThreadStream(sys.stdout),ThreadStream(sys.stderr)
+        from neurocaas_cli import clients,commands
+        try:
+            with open(commands.configpath,"r") as f:
+                config_dict = json.load(f)
+            commands.configure_transport(config_dict.get("transport",{}))
+            commands.configure_bandwidth(config_dict.get("bandwidth",{}))
+        except FileNotFoundError:
+            pass
+        clients.get_client("s3") ## create the session and client before the first command needs them.
+        listener = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            listener.bind(socketpath)
+        finally:
+            os.umask(old_umask)
+        listener.listen(64)
+        listener.settimeout(0.5)
+        print("neurocaas-cli daemon {} listening on {}".format(os.getpid(),socketpath),flush = True)
+        try:
+            while not self.stopping.is_set():
+                try:
+                    sock,address = listener.accept()
+                except socket.timeout:
+                    continue
+                sock.settimeout(None)
+                threading.Thread(target = self.handle,args = (sock,),daemon = True).start()
+        finally:
+            listener.close()
+            os.remove(socketpath)
+        ## let running commands (i.e. polls) finish, unless the stop was forced.
+        while not self.force:
+            with self.lock:
+                if len(self.active) == 0:
+                    break
+            time.sleep(0.5)
+        print("neurocaas-cli daemon {} stopped".format(os.getpid()),flush = True)
+
+def serve():
+    """Run the daemon in the current process until a stop request arrives.
+
+    """
+    Server().serve()
@@ -0,0 +1,126 @@
+## local index of submitted jobs and their last known state.
+import os
+import json
+import sqlite3
+import datetime
+import contextlib
+
+## states a job goes through. Jobs in terminal states are not checked again.
+states = ["submitted","running","finished"]
+terminal_states = ["finished"]
+
+class JobIndex(object):
+    """SQLite index of the jobs in a bucket, keyed by bucket and result prefix ("group/results/job__bucket_tag/"). For each job, stores its result tag, the data and config it was submitted with and its submit time (if it was submitted from this machine), its last known state, when it ended, and when it was last checked. Queries are answered from the index alone, so filtering and sorting thousands of jobs does not touch s3.
+
+    :param path: path to the database file. Does not have to exist yet.
+    """
+    columns = ["bucket","prefix","tag","dataname","configname","submitted","state","ended","checked"]
+
+    def __init__(self,path):
+        self.path = path
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Open a connection to the index, creating it if it does not exist yet. Changes are committed and the connection closed when the context exits.
+
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),exist_ok = True)
+        connection = sqlite3.connect(self.path,timeout = 30)
+        try:
+            with connection:
+                self.create(connection)
+                yield connection
+        finally:
+            connection.close()
+
+    def create(self,connection):
+        connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            bucket TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            tag TEXT,
+            dataname TEXT,
+            configname TEXT,
+            submitted REAL,
+            state TEXT NOT NULL,
+            ended REAL,
+            checked REAL,
+            PRIMARY KEY (bucket,prefix))""")
+        connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (bucket,state)")
+
+    def record_submission(self,bucket,prefix,tag,dataname,configname,submitted):
+        """Add a job that was just submitted, in state "submitted". Resubmitting to the same prefix starts the job over.
+
+        """
+        with self.connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO jobs VALUES (?,?,?,?,?,?,?,?,?)",
+                    (bucket,prefix,tag,json.dumps(dataname),configname,submitted,"submitted",None,None))
+
+    def record_listed(self,bucket,prefixes,tags):
+        """Record the result folders found by listing the bucket. Unknown folders are added as "running", and submitted jobs whose folder now exists move to "running".
+
+        :param prefixes: list of result prefixes.
+        :param tags: list of the result tags of these prefixes, in the same order.
+        """
+        with self.connect() as connection:
+            connection.executemany("INSERT OR IGNORE INTO jobs (bucket,prefix,tag,submitted,state) VALUES (?,?,?,?,?)",
+                    [(bucket,prefix,tag,tag_time(tag),"running") for prefix,tag in zip(prefixes,tags)])
+            connection.executemany("UPDATE jobs SET state = 'running' WHERE bucket = ? AND prefix = ? AND state = 'submitted'",
+                    [(bucket,prefix) for prefix in prefixes])
+
+    def pending(self,bucket,under = ""):
+        """Get the prefixes and states of jobs in a bucket that are not in a terminal state.
+
+        :param under: (optional) only return jobs whose prefix starts with this, i.e. "group/results/".
+        """
+        with self.connect() as connection:
+            rows = connection.execute("SELECT prefix,state FROM jobs WHERE bucket = ? AND substr(prefix,1,?) = ? AND state NOT IN ({})".format(",".join("?"*len(terminal_states))),
+                    [bucket,len(under),under]+terminal_states).fetchall()
+        return rows
+
+    def update_states(self,bucket,updates,checked):
+        """Store the result of checking jobs.
+
+        :param updates: list of (prefix, state, ended) tuples.
+        :param checked: time of the check, in seconds since the epoch.
+        """
+        with self.connect() as connection:
+            connection.executemany("UPDATE jobs SET state = ?, ended = ?, checked = ? WHERE bucket = ? AND prefix = ?",
+                    [(state,ended,checked,bucket,prefix) for prefix,state,ended in updates])
+
+    def jobs(self,bucket,under = "",state = None,sort = "submitted",descending = False,limit = None):
+        """Query the index.
+
+        :param bucket: name of the bucket.
+        :param under: (optional) only return jobs whose prefix starts with this, i.e. "group/results/".
+        :param state: (optional) only return jobs in this state.
+        :param sort: (optional) column to sort by: one of "submitted", "ended", "tag" or "state". Default "submitted". Jobs without a value come last.
+        :param descending: (optional) if true, sort in descending order.
+        :param limit: (optional) maximum number of jobs to return.
+        :return: list of dicts, one per job, with the index columns as keys.
+        """
+        if sort not in ["submitted","ended","tag","state"]:
+            raise ValueError("Cannot sort jobs by {}".format(sort))
+        query = "SELECT {} FROM jobs WHERE bucket = ? AND substr(prefix,1,?) = ?".format(",".join(self.columns))
+        args = [bucket,len(under),under]
+        if state is not None:
+            query += " AND state = ?"
+            args.append(state)
+        query += " ORDER BY {} IS NULL, {} {}, prefix".format(sort,sort,"DESC" if descending else "ASC")
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        with self.connect() as connection:
+            rows = connection.execute(query,args).fetchall()
+        jobs = [dict(zip(self.columns,row)) for row in rows]
+        for job in jobs:
+            job["dataname"] = json.loads(job["dataname"]) if job["dataname"] is not None else None
+        return jobs
+
+def tag_time(tag):
+    """Get the time encoded in a result tag generated by submit_job or batch_tags, in seconds since the epoch, or None if the tag was chosen by hand.
+
+    """
+    try:
+        return datetime.datetime.strptime(tag[:13],"%S%M%H%d%b%y").timestamp()
+    except (ValueError,TypeError):
+        return None
@@ -0,0 +1,61 @@
+## local record of s3 objects that have already been downloaded. 
+import os
+import json
+
+manifestname = ".neurocaas_manifest.json"
+
+class SyncManifest(object):
+    """Record of the s3 objects that have been downloaded to a local directory, keyed by object key. For each object, stores the ETag, Size and LastModified fields returned by the listing that found it. The manifest is written to disk, so separate invocations of the cli can tell which objects are unchanged since they were last downloaded. 
+
+    :param path: path to the manifest file. Does not have to exist yet. 
+    """
+    fields = ["ETag","Size","LastModified"]
+
+    def __init__(self,path):
+        self.path = path
+        self.tmppath = path+".tmp"
+        try:
+            with open(path,"r") as f:
+                self.records = json.load(f)
+        except (FileNotFoundError,json.JSONDecodeError):
+            self.records = {}
+
+    def is_current(self,record,localpath):
+        """Check if an object has already been downloaded to localpath, and has not changed since. 
+
+        :param record: listing record for the object, with fields Key, ETag, Size and LastModified. 
+        :param localpath: the path the object would be downloaded to. 
+        :return: True if the object does not need to be downloaded again. 
+        """
+        stored = self.records.get(record["Key"])
+        if stored is None or not os.path.exists(localpath):
+            return False
+        return all(stored.get(field) == record[field] for field in self.fields)
+
+    def update(self,record):
+        """Mark an object as downloaded. 
+
+        :param record: listing record for the object, with fields Key, ETag, Size and LastModified. 
+        """
+        self.records[record["Key"]] = {field:record[field] for field in self.fields}
+
+    def remove(self,key):
+        """Forget an object, i.e. because it was deleted locally. 
+
+        :param key: key of the object to forget. 
+        """
+        self.records.pop(key,None)
+
+    def files(self):
+        """Paths of the files the manifest is kept in: the manifest itself, and the temporary file it is written to before it replaces the manifest. 
+
+        """
+        return [self.path,self.tmppath]
+
+    def save(self):
+        """Write the manifest to disk. Writes to a temporary file first so that an interrupted write does not corrupt an existing manifest. 
+
+        """
+        with open(self.tmppath,"w") as f:
+            json.dump(self.records,f,indent = 4)
+        os.replace(self.tmppath,self.path)
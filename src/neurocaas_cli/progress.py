@@ -0,0 +1,131 @@
+## rate limited progress reporting for transfers.
+import sys
+import time
+import threading
+
+default_interval = 0.2
+default_milestone = 10
+
+def format_bytes(size):
+    """Format a number of bytes in the largest unit that keeps it above 1.
+
+    """
+    for unit in ["B","KB","MB","GB"]:
+        if abs(size) < 1000:
+            return "{:.1f} {}".format(size,unit)
+        size /= 1000.
+    return "{:.1f} TB".format(size)
+
+class Progress(object):
+    """Progress of one or more transfers, aggregated into a single line. Instances are passed as the callback of boto3 transfers, and are called with the number of bytes moved from any number of transfer threads. Each call only adds to a counter owned by the calling thread, so the threads never wait on each other. Rendering happens on whichever thread finds the last render at least `interval` seconds old, so output is bounded no matter how many chunks are transferred.
+
+    :param total: (optional) total number of bytes expected, if known. Can be raised later with add_total.
+    :param label: (optional) name shown at the start of the line.
+    :param files: (optional) number of files in the transfer, to show how many are done.
+    :param mode: (optional) one of "bar" (redraw a single line in place, for terminals), "log" (print a line at every `milestone` percent, for log files) or "quiet" (print nothing). Default "bar".
+    :param interval: (optional) minimum number of seconds between renders. Default 0.2
+    :param milestone: (optional) percent of the total between lines in "log" mode. If the total is unknown, a line is printed every 10 seconds instead. Default 10
+    :param stream: (optional) file to write to. Default sys.stdout
+    """
+    def __init__(self,total = None,label = "",files = None,mode = "bar",interval = default_interval,milestone = default_milestone,stream = None):
+        assert mode in ["bar","log","quiet"]
+        self.total = total
+        self.label = label
+        self.files = files
+        self.mode = mode
+        self.interval = interval if mode == "bar" else max(interval,10.)
+        self.milestone = milestone
+        self.stream = stream if stream is not None else sys.stdout
+        if hasattr(self.stream,"current"): ## per thread stand-in for sys.stdout (see daemon.ThreadStream): transfer threads render on behalf of the thread that made the progress.
+            self.stream = self.stream.current()
+        self._counts = {}
+        self._files_done = 0
+        self._start = time.monotonic()
+        self._last = float("-inf")
+        self._rendered = None
+        self._width = 0
+        self._next_milestone = milestone
+        self._render_lock = threading.Lock()
+
+    def __call__(self,bytes_amount):
+        ident = threading.get_ident()
+        self._counts[ident] = self._counts.get(ident,0)+bytes_amount
+        if self.mode == "quiet":
+            return
+        now = time.monotonic()
+        if self.mode == "log" and self.total:
+            if 100.*self.seen/self.total < self._next_milestone:
+                return
+        elif now-self._last < self.interval:
+            return
+        if self._render_lock.acquire(blocking = False):
+            try:
+                self.render(now)
+            finally:
+                self._render_lock.release()
+
+    @property
+    def seen(self):
+        """Number of bytes moved so far, summed over threads.
+
+        """
+        return sum(list(self._counts.values()))
+
+    def add_total(self,size):
+        """Raise the total number of bytes expected, i.e. when the size of another file becomes known.
+
+        """
+        with self._render_lock:
+            self.total = (self.total or 0)+size
+
+    def file_done(self):
+        """Record that one of the files in the transfer finished.
+
+        """
+        with self._render_lock:
+            self._files_done += 1
+
+    def line(self,now):
+        seen = self.seen
+        elapsed = max(now-self._start,1e-9)
+        parts = [self.label] if self.label else []
+        if self.total:
+            parts.append("{} / {}  ({:.2f}%)".format(format_bytes(seen),format_bytes(self.total),100.*seen/self.total))
+        else:
+            parts.append(format_bytes(seen))
+        if self.files is not None:
+            parts.append("{}/{} files".format(self._files_done,self.files))
+        parts.append("{}/s".format(format_bytes(seen/elapsed)))
+        return "  ".join(parts)
+
+    def render(self,now):
+        """Write the current state. In "log" mode, also move on to the next milestone.
+
+        """
+        self._last = now
+        self._rendered = (self.seen,self._files_done)
+        if self.mode == "bar":
+            line = self.line(now)
+            self._width = max(self._width,len(line))
+            self.stream.write("\r"+line.ljust(self._width))
+        else:
+            if self.total:
+                percent = 100.*self.seen/self.total
+                while self._next_milestone <= percent:
+                    self._next_milestone += self.milestone
+            self.stream.write(self.line(now)+"\n")
+        self.stream.flush()
+
+    def finish(self):
+        """Write the final state, and end the line in "bar" mode.
+
+        """
+        if self.mode == "quiet":
+            return
+        with self._render_lock:
+            if self.mode == "log" and self._rendered == (self.seen,self._files_done):
+                return
+            self.render(time.monotonic())
+            if self.mode == "bar":
+                self.stream.write("\n")
+                self.stream.flush()
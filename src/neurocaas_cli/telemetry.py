@@ -0,0 +1,193 @@
+## per-request performance telemetry for aws clients.
+import json
+import time
+import threading
+
+throttle_codes = set(["Throttling","ThrottlingException","ThrottledException","SlowDown","RequestLimitExceeded","RequestThrottled","TooManyRequestsException","ProvisionedThroughputExceededException"])
+
+class Recorder(object):
+    """Collects one record per AWS API call made by instrumented clients: the service and operation, latency in seconds (from the call until its response is parsed, across retries, and not including the time to read a streamed body), bytes sent and received, the number of retries, the number of attempts that were throttled, and the http status. Recording is off until enable is called, so instrumented clients cost almost nothing by default.
+
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.started = time.time()
+        self.records = []
+
+    def enable(self):
+        """Start recording, and measure wall time from now.
+
+        """
+        with self.lock:
+            self.enabled = True
+            self.started = time.time()
+            self.records = []
+
+    def add(self,record):
+        with self.lock:
+            self.records.append(record)
+
+    def summary(self):
+        """Aggregate the records so far per service and operation.
+
+        :return: dict with the "wall" time since recording started in seconds, and a dict of "operations" keyed by "service.operation", each with the number of "requests", "errors", "retries" and "throttles", the "latency" summed over requests and its "max", and the "bytes_sent" and "bytes_received".
+        """
+        with self.lock:
+            records = list(self.records)
+        operations = {}
+        for record in records:
+            name = "{}.{}".format(record["service"],record["operation"])
+            if name not in operations:
+                operations[name] = {"requests":0,"errors":0,"retries":0,"throttles":0,"latency":0.,"max":0.,"bytes_sent":0,"bytes_received":0}
+            op = operations[name]
+            op["requests"] += 1
+            op["errors"] += int(record["status"] is None or record["status"] >= 400)
+            op["retries"] += record["retries"]
+            op["throttles"] += record["throttles"]
+            op["latency"] += record["latency"]
+            op["max"] = max(op["max"],record["latency"])
+            op["bytes_sent"] += record["bytes_sent"]
+            op["bytes_received"] += record["bytes_received"]
+        return {"wall":time.time()-self.started,"operations":operations}
+
+    def format_summary(self):
+        """Format the summary as a table, with totals that show whether time went to moving bytes, to making requests or to neither (i.e. waiting between polls).
+
+        """
+        summary = self.summary()
+        lines = ["{:<28}{:>9}{:>8}{:>9}{:>10}{:>12}{:>12}{:>12}".format("operation","requests","errors","retries","throttles","mean (ms)","max (ms)","MB")]
+        totals = {"requests":0,"latency":0.,"bytes":0,"throttles":0}
+        for name,op in sorted(summary["operations"].items()):
+            transferred = op["bytes_sent"]+op["bytes_received"]
+            lines.append("{:<28}{:>9}{:>8}{:>9}{:>10}{:>12.1f}{:>12.1f}{:>12.2f}".format(name,op["requests"],op["errors"],op["retries"],op["throttles"],1000*op["latency"]/op["requests"],1000*op["max"],transferred/1e6))
+            totals["requests"] += op["requests"]
+            totals["latency"] += op["latency"]
+            totals["bytes"] += transferred
+            totals["throttles"] += op["throttles"]
+        wall = max(summary["wall"],1e-9)
+        lines.append("{} requests in {:.1f}s ({:.1f} requests/s, {:.2f} MB/s). {:.1f}s spent waiting on requests, {} throttled.".format(totals["requests"],wall,totals["requests"]/wall,totals["bytes"]/1e6/wall,totals["latency"],totals["throttles"]))
+        return "\n".join(lines)
+
+    def write_jsonl(self,path):
+        """Write one JSON line per recorded request.
+
+        """
+        with self.lock:
+            records = list(self.records)
+        with open(path,"w") as f:
+            for record in records:
+                f.write(json.dumps(record)+"\n")
+
+    def write_openmetrics(self,path):
+        """Write the summary in the OpenMetrics text format, with service and operation as labels.
+
+        """
+        summary = self.summary()
+        families = [("requests","counter","requests",None),
+                    ("errors","counter","errors",None),
+                    ("retries","counter","retries",None),
+                    ("throttles","counter","throttles",None),
+                    ("bytes_sent","counter","bytes_sent","bytes"),
+                    ("bytes_received","counter","bytes_received","bytes")]
+        lines = []
+        for family,kind,field,unit in families:
+            name = "neurocaas_aws_{}".format(family)
+            lines.append("# TYPE {} {}".format(name,kind))
+            if unit is not None:
+                lines.append("# UNIT {} {}".format(name,unit))
+            for opname,op in sorted(summary["operations"].items()):
+                service,operation = opname.split(".",1)
+                lines.append('{}_total{{service="{}",operation="{}"}} {}'.format(name,service,operation,op[field]))
+        name = "neurocaas_aws_request_seconds"
+        lines.append("# TYPE {} summary".format(name))
+        lines.append("# UNIT {} seconds".format(name))
+        for opname,op in sorted(summary["operations"].items()):
+            service,operation = opname.split(".",1)
+            lines.append('{}_count{{service="{}",operation="{}"}} {}'.format(name,service,operation,op["requests"]))
+            lines.append('{}_sum{{service="{}",operation="{}"}} {}'.format(name,service,operation,op["latency"]))
+        lines.append("# EOF")
+        with open(path,"w") as f:
+            f.write("\n".join(lines)+"\n")
+
+recorder = Recorder()
+
+def body_size(body):
+    """Number of bytes in a serialized request body, without consuming it.
+
+    """
+    if body is None:
+        return 0
+    if isinstance(body,(bytes,bytearray)):
+        return len(body)
+    if isinstance(body,str):
+        return len(body.encode("utf-8"))
+    if hasattr(body,"__len__"):
+        return len(body)
+    try:
+        position = body.tell()
+        body.seek(0,2)
+        size = body.tell()-position
+        body.seek(position)
+        return size
+    except (AttributeError,OSError,ValueError):
+        return 0
+
+def before_call(model,params,context,**kwargs):
+    if not recorder.enabled:
+        return
+    context["telemetry"] = {"start":time.time(),"service":model.service_model.service_name,"operation":model.name,"bytes_sent":body_size(params.get("body")),"throttles":0}
+
+def needs_retry(response,request_dict,**kwargs):
+    state = request_dict.get("context",{}).get("telemetry")
+    if state is None or response is None:
+        return
+    http_response,parsed = response
+    code = parsed.get("Error",{}).get("Code") if isinstance(parsed,dict) else None
+    if code in throttle_codes or (http_response is not None and http_response.status_code in (429,503)):
+        state["throttles"] += 1
+
+def after_call(http_response,parsed,model,context,**kwargs):
+    state = context.get("telemetry")
+    if state is None:
+        return
+    if model.has_streaming_output:
+        received = parsed.get("ContentLength",0) if model.name == "GetObject" else 0
+    else:
+        received = len(http_response.content) if http_response is not None else 0
+    recorder.add({"time":state["start"],
+                  "service":model.service_model.service_name,
+                  "operation":model.name,
+                  "latency":time.time()-state["start"],
+                  "bytes_sent":state["bytes_sent"],
+                  "bytes_received":received,
+                  "retries":parsed.get("ResponseMetadata",{}).get("RetryAttempts",0),
+                  "throttles":state["throttles"],
+                  "status":http_response.status_code if http_response is not None else None})
+
+def after_call_error(exception,context,**kwargs): ## botocore does not pass the operation model with this event. 
+    state = context.get("telemetry")
+    if state is None:
+        return
+    recorder.add({"time":state["start"],
+                  "service":state["service"],
+                  "operation":state["operation"],
+                  "latency":time.time()-state["start"],
+                  "bytes_sent":state["bytes_sent"],
+                  "bytes_received":0,
+                  "retries":0,
+                  "throttles":state["throttles"],
+                  "status":None})
+
+def instrument(client):
+    """Register telemetry hooks on a boto3 client, so that its calls are recorded by recorder while it is enabled.
+
+    :param client: boto3 client to instrument.
+    :return: the same client.
+    """
+    events = client.meta.events
+    events.register("before-call.*.*",before_call,unique_id = "neurocaas-telemetry-before-call")
+    events.register("needs-retry.*.*",needs_retry,unique_id = "neurocaas-telemetry-needs-retry")
+    events.register("after-call.*.*",after_call,unique_id = "neurocaas-telemetry-after-call")
+    events.register("after-call-error.*.*",after_call_error,unique_id = "neurocaas-telemetry-after-call-error")
+    return client
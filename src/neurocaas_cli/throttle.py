@@ -0,0 +1,118 @@
+## bandwidth limits shared by all transfers in a process.
+import heapq
+import itertools
+import threading
+import time
+
+directions = ["upload","download"]
+## largest number of bytes granted at once. Larger requests are split, so that other transfers can be served in between.
+quantum = 64*1024
+
+class TokenBucket(object):
+    """Token bucket limiting the rate of bytes moved by any number of threads. Tokens accumulate at `rate` bytes per second up to `burst`, and each byte sent or received takes one.
+    Waiting requests are served fairly between keys (i.e. one key per file), in the order of their start tags (start-time fair queueing): each key is charged for the bytes it has been granted, so a large file with many threads sending parts gets the same share of the bandwidth as a small file with one, and cannot hold back many small files.
+
+    :param rate: bytes per second.
+    :param burst: (optional) largest number of tokens that can accumulate while the bucket is idle. Default a quarter of a second of transfer, and at least one quantum.
+    """
+    def __init__(self,rate,burst = None):
+        assert rate > 0
+        self.rate = float(rate)
+        self.burst = max(float(burst) if burst is not None else self.rate/4,quantum)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._finish = {}
+        self._vtime = 0.
+        self._sequence = itertools.count()
+
+    def consume(self,amount,key = None):
+        """Block until amount bytes can be moved without going over the rate.
+
+        :param amount: number of bytes.
+        :param key: (optional) identifies the transfer the bytes belong to, for fair scheduling.
+        """
+        while amount > 0:
+            piece = min(amount,quantum)
+            self._consume(piece,key)
+            amount -= piece
+
+    def _consume(self,amount,key):
+        with self._condition:
+            start = max(self._vtime,self._finish.get(key,0.))
+            self._finish[key] = start+amount
+            ticket = (start,next(self._sequence))
+            heapq.heappush(self._waiting,ticket)
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst,self._tokens+(now-self._updated)*self.rate)
+                self._updated = now
+                if self._waiting[0] != ticket:
+                    self._condition.wait()
+                elif self._tokens < amount:
+                    self._condition.wait((amount-self._tokens)/self.rate)
+                else:
+                    break
+            heapq.heappop(self._waiting)
+            self._tokens -= amount
+            self._vtime = start
+            if len(self._finish) > 1000:
+                self._finish = {k:f for k,f in self._finish.items() if f > self._vtime}
+            self._condition.notify_all()
+
+## one bucket per direction, or None if it is not limited.
+buckets = {direction:None for direction in directions}
+
+def set_limit(direction,rate):
+    """Limit the bandwidth of all transfers in one direction.
+
+    :param direction: "upload" or "download".
+    :param rate: limit in MB/s (1 MB = 10^6 bytes), or None to remove the limit.
+    """
+    if direction not in directions:
+        raise ValueError("Direction must be one of {}, not {}".format(directions,direction))
+    if rate is not None and rate <= 0:
+        raise ValueError("Bandwidth limit must be positive, not {}".format(rate))
+    buckets[direction] = TokenBucket(rate*1e6) if rate is not None else None
+
+def consume(direction,amount,key = None):
+    """Wait until amount bytes can be moved in direction. Returns at once if the direction is not limited. Negative amounts (bytes taken back by a failed attempt) are ignored.
+
+    """
+    bucket = buckets.get(direction)
+    if bucket is None or amount <= 0:
+        return
+    bucket.consume(amount,key)
+
+def throttled(callback,direction,key = None):
+    """Wrap a transfer callback (called with the number of bytes moved, like the Callback of boto3 transfers) so that it waits for the bandwidth limit before passing the bytes on. boto3 calls these callbacks from the threads that read and write data, so waiting in them slows down the transfer itself.
+
+    :param callback: callback to wrap, or None.
+    :param direction: "upload" or "download".
+    :param key: (optional) identifies the transfer, for fair scheduling.
+    :return: the wrapped callback, or callback itself if the direction is not limited.
+    """
+    if buckets.get(direction) is None:
+        return callback
+    def limited(bytes_amount):
+        consume(direction,bytes_amount,key)
+        if callback is not None:
+            callback(bytes_amount)
+    return limited
+
+class Reader(object):
+    """File-like wrapper that waits for the download bandwidth limit as data is read, i.e. from the body of a get_object response.
+
+    """
+    def __init__(self,fileobj,key = None):
+        self.fileobj = fileobj
+        self.key = key
+
+    def read(self,*args):
+        data = self.fileobj.read(*args)
+        consume("download",len(data),self.key)
+        return data
+
+    def __getattr__(self,name):
+        return getattr(self.fileobj,name)
@@ -2,109 +2,16 @@
 import os
 import pytest
 import localstack_client.session
-import logging
-from botocore.exceptions import ClientError
-from neurocaas_cli import analyze,Interface_S3
+import json
+import time
+import io
+import tarfile
+import click
+import botocore.exceptions
+from neurocaas_cli import analyze,Interface_S3,manifest,clients,telemetry
 
 loc = os.path.abspath(os.path.dirname(__file__))
-test_result_mats = os.path.join(loc,"test_mats","test_aws_resource","test_analyze")
 test_upload_mats = os.path.join(loc,"test_mats","test_local_mats")
-result_bucket_name = "cli-analyze-bucket"
-
-def get_paths(rootpath):
-    """Gets paths to all files relative to a given top level path. 
-
-    """
-    walkgen = os.walk(rootpath)
-    paths = []
-    dirpaths = []
-    for p,dirs,files in walkgen:
-        relpath = os.path.relpath(p,rootpath)
-        if len(files) > 0 or len(dirs) > 0:
-            for f in files:
-                localfile = os.path.join(relpath,f)
-                paths.append(localfile)
-            ## We should upload the directories explicitly, as they will be treated in s3 like their own objects and we perform checks on them.    
-            for d in dirs:
-                localdir = os.path.join(relpath,d,"")
-                if localdir == "./logs/":
-                    dirpaths.append("logs/")
-                else:
-                    dirpaths.append(localdir)
-    return paths,dirpaths            
-
-@pytest.fixture
-def setup_analysis_bucket(monkeypatch):
-    """Sets up the module to use localstack, and creates a bucket in localstack called test-analyze-cli with the following directory structure:
-    /
-    |-user1
-      |-inputs
-      |-configs
-      |-submissions
-      |-results
-        |-completed_job
-          |-logs
-            |-certificate.txt
-            |-DATASTATUS.json
-            |-logfile.txt
-          |-process_results  
-            |-end.txt
-        |-uncompleted_job
-          |-logs
-            |-certificate.txt
-            |-DATASTATUS.json
-            |-logfile.txt
-          |-process_results  
-        ...
-    This is the minimal working example for testing a monitoring function. This assumes that we will not be mutating the state of bucket logs. 
-    """
-    ## Start localstack and patch AWS clients:
-    session = localstack_client.session.Session()
-    s3_client = session.client("s3")
-    s3_resource = session.resource("s3")
-    monkeypatch.setattr(analyze, "s3_client", session.client("s3")) ## TODO I don't think these are scoped correctly w/o a context manager.
-    monkeypatch.setattr(analyze, "s3_resource", session.resource("s3"))
-
-    ## Create bucket if not created:
-    try:
-        buckets = s3_client.list_buckets()["Buckets"]
-        bucketnames = [b["Name"] for b in buckets]
-        assert result_bucket_name in bucketnames
-        yield result_bucket_name,"user1"
-    except AssertionError:    
-        s3_client.create_bucket(Bucket =result_bucket_name)
-
-        ## Get paths:
-        log_paths,dirpaths = get_paths(test_result_mats) 
-        try:
-            for f in log_paths:
-                s3_client.upload_file(os.path.join(test_result_mats,f),result_bucket_name,Key = f)
-            for dirpath in dirpaths:
-                s3dir = s3_resource.Object(result_bucket_name,dirpath)   
-                s3dir.put()
-        except ClientError as e:        
-            logging.error(e)
-            raise
-        yield result_bucket_name,"user1"    
-    ## remove from inputs, configs, and submissions after each test. 
-    clear_subdirectory(result_bucket_name,"user1/inputs/")
-    clear_subdirectory(result_bucket_name,"user1/configs/")
-    clear_subdirectory(result_bucket_name,"user1/submissions/")
-
-def clear_subdirectory(bucketname,prefix):
-    """Clears out a subdirectory of an S3 bucket for easier testing.
-
-    """
-    session = localstack_client.session.Session()
-    s3_client = session.client("s3")
-    s3_resource = session.resource("s3")
-    bucket = s3_resource.Bucket(bucketname)
-    data = [objname.key for objname in bucket.objects.filter(Prefix = prefix)] 
-    for d in data:
-        if d == prefix:
-            continue
-        else:
-            s3_client.delete_object(Bucket = bucketname,Key = d)
 
 def test_upload_data(monkeypatch,setup_analysis_bucket):
     """Test that multiple upload files are correctly uploaded. 
@@ -113,8 +20,6 @@ def test_upload_data(monkeypatch,setup_analysis_bucket):
     session = localstack_client.session.Session()
     s3_client = session.client("s3")
     s3_resource = session.resource("s3")
-    monkeypatch.setattr(Interface_S3, "s3_client", session.client("s3")) 
-    monkeypatch.setattr(Interface_S3, "s3", session.resource("s3"))
 
     b,p = setup_analysis_bucket
     bucket = s3_resource.Bucket(b)
@@ -132,8 +37,6 @@ def test_upload_config(monkeypatch,setup_analysis_bucket):
     session = localstack_client.session.Session()
     s3_client = session.client("s3")
     s3_resource = session.resource("s3")
-    monkeypatch.setattr(Interface_S3, "s3_client", session.client("s3")) 
-    monkeypatch.setattr(Interface_S3, "s3", session.resource("s3"))
 
     b,p = setup_analysis_bucket
     bucket = s3_resource.Bucket(b)
@@ -150,6 +53,7 @@ def test_list_inputs(setup_analysis_bucket):
     """
     b,p = setup_analysis_bucket
     data,configs = analyze.list_inputs(b,p)
+    data,configs = list(data),list(configs)
     print(data,configs)
     assert len(data) == 0
     assert len(configs) == 0
@@ -160,7 +64,7 @@ def test_list_results(setup_analysis_bucket):
 
     """
     b,p = setup_analysis_bucket
-    results = analyze.list_results(b,p)
+    results = list(analyze.list_results(b,p))
     assert len(results) == 2
     for r in results:
         assert os.path.basename(os.path.abspath(r)) in ["completed_job","uncompleted_job"]
@@ -172,8 +76,6 @@ def test_submit_job(monkeypatch,setup_analysis_bucket):
     session = localstack_client.session.Session()
     s3_client = session.client("s3")
     s3_resource = session.resource("s3")
-    monkeypatch.setattr(Interface_S3, "s3_client", session.client("s3")) 
-    monkeypatch.setattr(Interface_S3, "s3", session.resource("s3"))
 
     b,p = setup_analysis_bucket
     bucket = s3_resource.Bucket(b)
@@ -193,6 +95,53 @@ def test_submit_job(monkeypatch,setup_analysis_bucket):
     for r in [cust_response,response]:
         assert r["submit_filename"] in submitfiles
 
+def test_submit_batch(setup_analysis_bucket,tmp_path,monkeypatch):
+    """Tests that jobs are read from CSV and JSON manifests, and submitted with distinct result tags and no waiting. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_resource = session.resource("s3")
+    b,p = setup_analysis_bucket
+    csvpath = tmp_path / "jobs.csv"
+    csvpath.write_text("dataname,configname,resulttag\ninputs/a.json;inputs/b.json,configs/config.yaml,mytag\n"+"".join("inputs/{}.json,configs/config.yaml,\n".format(i) for i in range(20)))
+    jobs = analyze.read_job_manifest(str(csvpath))
+    assert jobs[0] == {"dataname":["inputs/a.json","inputs/b.json"],"configname":"configs/config.yaml","resulttag":"mytag"}
+    jsonpath = tmp_path / "jobs.json"
+    jsonpath.write_text(json.dumps([{"dataname":"inputs/a.json","configname":"configs/config.yaml"}]))
+    assert analyze.read_job_manifest(str(jsonpath)) == [{"dataname":["inputs/a.json"],"configname":"configs/config.yaml","resulttag":None}]
+
+    start = time.time()
+    results = analyze.submit_batch(b,p,jobs)
+    assert time.time()-start < 10 
+    assert all(r["error"] is None for r in results)
+    tags = [r["resulttag"] for r in results]
+    assert tags[0] == "mytag"
+    assert len(set(tags)) == len(jobs)
+    assert results[0]["jobpath"] == os.path.join(p,"results","job__{}_mytag".format(b))
+    submitfiles = [os.path.basename(objname.key) for objname in s3_resource.Bucket(b).objects.filter(Prefix = os.path.join(p,"submissions/"))]
+    for r in results:
+        assert r["submit_filename"] in submitfiles
+
+    with pytest.raises(ValueError):
+        analyze.submit_batch(b,p,[jobs[0],jobs[0]])
+
+    for manifest in [{"dataname":"inputs/a.json","configname":"configs/config.yaml"},["inputs/a.json"]]:
+        jsonpath.write_text(json.dumps(manifest))
+        with pytest.raises(ValueError,match = "jobs.json"):
+            analyze.read_job_manifest(str(jsonpath))
+
+    ## a job that cannot reach s3 is reported as failed, without stopping the batch. 
+    client = analyze.get_client("s3")
+    class Unreachable(object):
+        def put_object(self,**kwargs):
+            if "unreachable" in kwargs["Key"]:
+                raise botocore.exceptions.EndpointConnectionError(endpoint_url = "http://127.0.0.1")
+            return client.put_object(**kwargs)
+    monkeypatch.setattr(analyze,"get_client",lambda *args,**kwargs: Unreachable())
+    results = analyze.submit_batch(b,p,[dict(jobs[1],resulttag = "unreachable"),dict(jobs[2],resulttag = "reachable")])
+    assert "Could not connect" in results[0]["error"]
+    assert results[1]["error"] is None
+
 def test_get_logfiles(setup_analysis_bucket,tmp_path):
     bucket_name,path_prefix = setup_analysis_bucket
     analyze.get_logfiles(bucket_name,"user1/results/completed_job",str(tmp_path))
@@ -227,3 +176,524 @@ def test_setup_polling(setup_analysis_bucket,tmp_path,path,out,local):
         assert "end.txt" in os.listdir(os.path.join(sub_write,"process_results"))
 
 
+@pytest.mark.parametrize("workers",[1,4,16])
+def test_get_results(setup_analysis_bucket,tmp_path,workers):
+    """Tests that results are downloaded with different numbers of parallel workers. 
+
+    """
+    bucket_name,path_prefix = setup_analysis_bucket
+    summary = analyze.get_results(bucket_name,"user1/results/completed_job",str(tmp_path),workers = workers)
+    assert summary["failed"] == {}
+    assert summary["downloaded"] == ["user1/results/completed_job/process_results/end.txt"]
+    assert "end.txt" in os.listdir(os.path.join(tmp_path,"process_results"))
+
+def test_download_many_failures(setup_analysis_bucket,tmp_path):
+    """Tests that failed downloads are collected in the summary instead of interrupting other downloads. 
+
+    """
+    bucket_name,path_prefix = setup_analysis_bucket
+    transfers = [("user1/results/completed_job/logs/certificate.txt",os.path.join(tmp_path,"certificate.txt")),
+                 ("user1/results/completed_job/logs/missing.txt",os.path.join(tmp_path,"missing.txt"))]
+    summary = Interface_S3.download_many(clients.get_client("s3",max_pool_connections = 2),bucket_name,transfers,workers = 2,retries = 1)
+    assert summary["downloaded"] == ["user1/results/completed_job/logs/certificate.txt"]
+    assert list(summary["failed"].keys()) == ["user1/results/completed_job/logs/missing.txt"]
+    assert os.path.exists(os.path.join(tmp_path,"certificate.txt"))
+
+def test_sync_results_requests(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that syncing listed files takes one LIST plus one GET per file, without a HEAD per file, and that a single download only sends a HEAD if its size is unknown. 
+
+    """
+    monkeypatch.setattr(telemetry,"recorder",telemetry.Recorder())
+    b,p = setup_analysis_bucket
+    client = analyze.get_client("s3")
+    for i in range(5):
+        client.put_object(Bucket = b,Key = "requests_job/file{}.bin".format(i),Body = os.urandom(100*(i+1)))
+    telemetry.recorder.enable()
+    summary = analyze.sync_results(b,"requests_job/",str(tmp_path / "out"))
+    assert len(summary["downloaded"]) == 5
+    operations = telemetry.recorder.summary()["operations"]
+    assert operations["s3.ListObjectsV2"]["requests"] == 1
+    assert operations["s3.GetObject"]["requests"] == 5
+    assert "s3.HeadObject" not in operations
+    with open(tmp_path / "out" / "file4.bin","rb") as f:
+        assert len(f.read()) == 500
+
+    record = next(analyze.iter_objects(b,"requests_job/file0.bin"))
+    telemetry.recorder.enable()
+    Interface_S3.download("s3://{}/requests_job/file0.bin".format(b),str(tmp_path / "sized.bin"),size = record["Size"],etag = record["ETag"])
+    assert "s3.HeadObject" not in telemetry.recorder.summary()["operations"]
+    Interface_S3.download("s3://{}/requests_job/file0.bin".format(b),str(tmp_path / "unsized.bin"))
+    assert telemetry.recorder.summary()["operations"]["s3.HeadObject"]["requests"] == 1
+    assert os.path.getsize(tmp_path / "unsized.bin") == 100
+
+def test_get_logfiles_incremental(setup_analysis_bucket,tmp_path):
+    """Tests that logfiles are only downloaded again if they are new, changed, or missing locally. 
+
+    """
+    bucket_name,path_prefix = setup_analysis_bucket
+    downloaded = analyze.get_logfiles(bucket_name,"user1/results/completed_job",str(tmp_path))
+    assert sorted([os.path.basename(d) for d in downloaded]) == ["DATASTATUS.json","certificate.txt","logfile.txt"]
+    assert os.path.exists(os.path.join(tmp_path,manifest.manifestname))
+    assert analyze.get_logfiles(bucket_name,"user1/results/completed_job",str(tmp_path)) == []
+    os.remove(os.path.join(tmp_path,"logs","logfile.txt"))
+    assert analyze.get_logfiles(bucket_name,"user1/results/completed_job",str(tmp_path)) == ["user1/results/completed_job/logs/logfile.txt"]
+
+def test_sync_manifest(tmp_path):
+    """Tests that manifest records persist across instances and detect changed objects. 
+
+    """
+    record = {"Key":"user1/results/job/logs/certificate.txt","ETag":'"abc"',"Size":10,"LastModified":"2021-05-20T13:09:16+00:00"}
+    localpath = os.path.join(tmp_path,"certificate.txt")
+    open(localpath,"w").close()
+    first = manifest.SyncManifest(os.path.join(tmp_path,manifest.manifestname))
+    assert not first.is_current(record,localpath)
+    first.update(record)
+    first.save()
+    second = manifest.SyncManifest(os.path.join(tmp_path,manifest.manifestname))
+    assert second.is_current(record,localpath)
+    assert not second.is_current(dict(record,ETag='"def"'),localpath)
+
+def test_upload_resumable(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that an interrupted multipart upload resumes without resending finished parts, and that the result matches the local file. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_client = session.client("s3")
+    monkeypatch.setattr(Interface_S3, "statepath", str(tmp_path / "state"))
+    b,p = setup_analysis_bucket
+    key = os.path.join(p,"inputs","large.bin")
+    localpath = str(tmp_path / "large.bin")
+    with open(localpath,"wb") as f:
+        f.write(os.urandom(3*Interface_S3.min_part_size+1000))
+    config = Interface_S3.TransferConfig(multipart_threshold = Interface_S3.min_part_size,multipart_chunksize = Interface_S3.min_part_size,max_concurrency = 1)
+
+    class Interrupt(Exception):
+        pass
+    def interrupt(bytes_amount):
+        raise Interrupt
+    with pytest.raises(Interrupt):
+        Interface_S3.upload_resumable(s3_client,localpath,b,key,config = config,callback = interrupt)
+    assert os.path.exists(Interface_S3.upload_statefile(localpath,b,key))
+
+    parts_sent = []
+    s3_client.meta.events.register("provide-client-params.s3.UploadPart",lambda params,**kwargs: parts_sent.append(params["PartNumber"]))
+    Interface_S3.upload_resumable(s3_client,localpath,b,key,config = config)
+    assert 1 not in parts_sent
+    assert 4 in parts_sent
+    assert not os.path.exists(Interface_S3.upload_statefile(localpath,b,key))
+    with open(localpath,"rb") as f:
+        assert s3_client.get_object(Bucket = b,Key = key)["Body"].read() == f.read()
+
+    ## ETags of encrypted objects are not md5 checksums, and are not compared. 
+    head_object = s3_client.head_object
+    def encrypted_head(**kwargs):
+        return dict(head_object(**kwargs),ETag = '"{}-4"'.format("0"*32),ServerSideEncryption = "aws:kms")
+    monkeypatch.setattr(s3_client,"head_object",encrypted_head)
+    Interface_S3.upload_resumable(s3_client,localpath,b,key,config = config)
+    monkeypatch.setattr(s3_client,"head_object",lambda **kwargs: dict(head_object(**kwargs),ETag = '"{}-4"'.format("0"*32)))
+    with pytest.raises(Interface_S3.UploadVerificationError):
+        Interface_S3.upload_resumable(s3_client,localpath,b,key,config = config)
+
+def test_upload_skip_identical(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that uploading an unchanged file is skipped, and that changing the file or forcing the upload sends it again. 
+
+    """
+    session = localstack_client.session.Session()
+    monkeypatch.setattr(Interface_S3, "statepath", str(tmp_path / "state"))
+    monkeypatch.setattr(Interface_S3, "etag_cache", None)
+    b,p = setup_analysis_bucket
+    localpath = str(tmp_path / "config.yaml")
+    with open(localpath,"w") as f:
+        f.write("important: params")
+    assert analyze.upload_config(b,p,localpath)["skipped"] == False
+    assert analyze.upload_config(b,p,localpath)["skipped"] == True
+    assert analyze.upload_config(b,p,localpath,force = True)["skipped"] == False
+    with open(localpath,"w") as f:
+        f.write("important: other_params")
+    assert analyze.upload_config(b,p,localpath)["skipped"] == False
+
+def test_upload_client(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that uploads use a client with a connection for each concurrent part, and reuse one transfer manager for small files. 
+
+    """
+    monkeypatch.setattr(Interface_S3,"transfer_managers",{})
+    b,p = setup_analysis_bucket
+    localpath = str(tmp_path / "small.bin")
+    with open(localpath,"wb") as f:
+        f.write(b"small")
+    config = Interface_S3.TransferConfig(max_concurrency = 64)
+    for i in range(2):
+        Interface_S3.upload(localpath,"s3://{}/{}/inputs/small.bin".format(b,p),config = config)
+    assert len(Interface_S3.transfer_managers) == 1
+    client = list(Interface_S3.transfer_managers.values())[0][0]
+    assert client is clients.get_client("s3",max_pool_connections = 64)
+    assert client.meta.config.max_pool_connections == 64
+
+def test_upload_compressed(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that compressed uploads are sent in parts without staging, are tagged with their encoding, are decompressed on download and are recognized as identical to the local file. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_client = session.client("s3")
+    monkeypatch.setattr(Interface_S3, "statepath", str(tmp_path / "state"))
+    monkeypatch.setattr(Interface_S3, "etag_cache", None)
+    b,p = setup_analysis_bucket
+    localpath = str(tmp_path / "recording.bin")
+    with open(localpath,"wb") as f:
+        f.write(os.urandom(Interface_S3.min_part_size+1000)+bytes(4*Interface_S3.min_part_size))
+    config = Interface_S3.TransferConfig(multipart_chunksize = Interface_S3.min_part_size,max_concurrency = 2)
+    parts_sent = []
+    client = analyze.get_client("s3")
+    client.meta.events.register("provide-client-params.s3.UploadPart",lambda params,**kwargs: parts_sent.append(params["PartNumber"]))
+
+    list(analyze.iter_objects_cached(b,os.path.join(p,"inputs/")))
+    response = analyze.upload_data(b,p,localpath,config = config,compress = "gzip")
+    assert response["errors"] is None
+    key = os.path.join(p,"inputs","recording.bin.gz")
+    head = s3_client.head_object(Bucket = b,Key = key)
+    assert head["Metadata"][Interface_S3.encoding_key] == "gzip"
+    assert head["ContentLength"] < os.path.getsize(localpath)/2
+    assert [r["Size"] for r in analyze.listing_cache.get(b,os.path.join(p,"inputs/")) if r["Key"] == key] == [head["ContentLength"]]
+    assert sorted(parts_sent) == [1,2]
+    assert analyze.upload_data(b,p,localpath,config = config,compress = "gzip")["skipped"] == True
+
+    Interface_S3.download("s3://{}/{}".format(b,key),str(tmp_path / "downloaded.bin"))
+    with open(localpath,"rb") as f, open(tmp_path / "downloaded.bin","rb") as g:
+        assert f.read() == g.read()
+
+    smallpath = str(tmp_path / "small.txt")
+    with open(smallpath,"w") as f:
+        f.write("spikes "*1000)
+    assert Interface_S3.upload(smallpath,"s3://{}/{}".format(b,os.path.join(p,"inputs","small.txt")),compress = "gzip") == True
+    assert sorted(parts_sent) == [1,2]
+    Interface_S3.download("s3://{}/{}".format(b,os.path.join(p,"inputs","small.txt")),str(tmp_path / "small_downloaded.txt"))
+    assert (tmp_path / "small_downloaded.txt").read_text() == "spikes "*1000
+
+def test_is_uploaded_multipart(setup_analysis_bucket,tmp_path,monkeypatch):
+    """Tests that multipart ETags are matched, including ones uploaded with a different part size. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_client = session.client("s3")
+    monkeypatch.setattr(Interface_S3, "statepath", str(tmp_path / "state"))
+    monkeypatch.setattr(Interface_S3, "etag_cache", None)
+    b,p = setup_analysis_bucket
+    key = os.path.join(p,"inputs","multipart.bin")
+    localpath = str(tmp_path / "multipart.bin")
+    with open(localpath,"wb") as f:
+        f.write(os.urandom(2*Interface_S3.min_part_size+10))
+    six_mb = Interface_S3.TransferConfig(multipart_threshold = 6*1024**2,multipart_chunksize = 6*1024**2)
+    five_mb = Interface_S3.TransferConfig(multipart_threshold = 5*1024**2,multipart_chunksize = 5*1024**2)
+    s3_client.upload_file(localpath,b,key,Config = six_mb)
+    assert Interface_S3.is_uploaded(s3_client,localpath,b,key,config = six_mb)
+    assert Interface_S3.is_uploaded(s3_client,localpath,b,key,config = five_mb)
+    assert not Interface_S3.is_uploaded(s3_client,localpath,b,os.path.join(p,"inputs","missing.bin"))
+
+    ## 20 MB in 3 parts: the 8 MB default, not the whole number of MB computed from the part count (7 MB). 
+    key = os.path.join(p,"inputs","multipart_default.bin")
+    localpath = str(tmp_path / "multipart_default.bin")
+    with open(localpath,"wb") as f:
+        f.write(os.urandom(20*1024**2))
+    eight_mb = Interface_S3.TransferConfig(multipart_threshold = 8*1024**2,multipart_chunksize = 8*1024**2)
+    s3_client.upload_file(localpath,b,key,Config = eight_mb)
+    assert s3_client.head_object(Bucket = b,Key = key)["ETag"].endswith('-3"')
+    assert Interface_S3.candidate_chunksizes(20*1024**2,3,five_mb)[0] == 8*1024**2
+    assert Interface_S3.is_uploaded(s3_client,localpath,b,key,config = five_mb)
+
+def test_upload_batch(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that files, directories and globs are all uploaded, and that results are reported per file. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_resource = session.resource("s3")
+    monkeypatch.setattr(Interface_S3, "statepath", str(tmp_path / "state"))
+    monkeypatch.setattr(Interface_S3, "etag_cache", None)
+    b,p = setup_analysis_bucket
+    session_dir = tmp_path / "session"
+    (session_dir / "sub").mkdir(parents = True)
+    (session_dir / "a.bin").write_bytes(b"a"*100)
+    (session_dir / "sub" / "b.bin").write_bytes(b"b"*100)
+    paths = [str(session_dir),os.path.join(test_upload_mats,"inputs","*.json"),str(tmp_path / "missing.bin")]
+    response = analyze.upload_batch(b,p,paths)
+    statuses = {os.path.basename(r["localpath"]):r["status"] for r in response["results"]}
+    assert statuses == {"a.bin":"uploaded","b.bin":"uploaded","datafile.json":"uploaded","datafile_2.json":"uploaded","missing.bin":"failed"}
+    assert response["uploaded_bytes"] == sum(os.path.getsize(r["localpath"]) for r in response["results"] if r["status"] == "uploaded")
+    keys = [o.key for o in s3_resource.Bucket(b).objects.filter(Prefix = os.path.join(p,"inputs/"))]
+    for key in ["session/a.bin","session/sub/b.bin","datafile.json","datafile_2.json"]:
+        assert os.path.join(p,"inputs",key) in keys
+    rerun = analyze.upload_batch(b,p,paths[:2])
+    assert all(r["status"] == "skipped" for r in rerun["results"])
+
+    ## files above the multipart threshold take the resumable, verified path. 
+    resumed = []
+    upload_resumable = Interface_S3.upload_resumable
+    def record_resumable(client,localpath,*args,**kwargs):
+        resumed.append(os.path.basename(localpath))
+        return upload_resumable(client,localpath,*args,**kwargs)
+    monkeypatch.setattr(Interface_S3,"upload_resumable",record_resumable)
+    (session_dir / "large.bin").write_bytes(os.urandom(Interface_S3.min_part_size+10))
+    config = Interface_S3.TransferConfig(multipart_threshold = Interface_S3.min_part_size,multipart_chunksize = Interface_S3.min_part_size)
+    response = analyze.upload_batch(b,p,[str(session_dir)],config = config,force = True)
+    assert resumed == ["large.bin"]
+    assert all(r["status"] == "uploaded" for r in response["results"])
+    assert response["throughput"] == pytest.approx(response["uploaded_bytes"]/1e6/response["seconds"])
+
+@pytest.fixture
+def setup_event_queue(setup_analysis_bucket):
+    """Creates an SQS queue in localstack to stand in for s3 event notifications. 
+
+    """
+    session = localstack_client.session.Session()
+    sqs_client = session.client("sqs")
+    queue_url = sqs_client.create_queue(QueueName = "cli-analyze-events")["QueueUrl"]
+    yield sqs_client,queue_url
+    sqs_client.delete_queue(QueueUrl = queue_url)
+
+def test_wait_for_end_event(setup_analysis_bucket,setup_event_queue):
+    """Tests that endfile notifications are recognized, and that unrelated notifications are ignored. 
+
+    """
+    bucket_name,path_prefix = setup_analysis_bucket
+    sqs_client,queue_url = setup_event_queue
+    def event(key):
+        return json.dumps({"Records":[{"eventName":"ObjectCreated:Put","s3":{"bucket":{"name":bucket_name},"object":{"key":key}}}]})
+    sqs_client.send_message(QueueUrl = queue_url,MessageBody = event("user1/results/other_job/process_results/end.txt"))
+    assert analyze.wait_for_end_event(queue_url,bucket_name,"user1/results/uncompleted_job",1) == False
+    sqs_client.send_message(QueueUrl = queue_url,MessageBody = json.dumps({"Message":event("user1/results/uncompleted_job/process_results/end.txt")}))
+    assert analyze.wait_for_end_event(queue_url,bucket_name,"user1/results/uncompleted_job",5) == True
+
+def test_setup_polling_backoff(setup_analysis_bucket,tmp_path,monkeypatch):
+    """Tests that the time between polls starts at min_step and doubles up to step. 
+
+    """
+    bucket_name,path_prefix = setup_analysis_bucket
+    sleeps = []
+    monkeypatch.setattr(analyze.polling2.time, "sleep", sleeps.append)
+    assert analyze.setup_polling(bucket_name,"user1/results/uncompleted_job",str(tmp_path),step = 8,timeout = 1,min_step = 1) == 1
+    assert sleeps[:5] == [1,2,4,8,8]
+
+def test_poll_many(setup_analysis_bucket,tmp_path,monkeypatch):
+    """Tests that many jobs are polled at once, that results are fetched for the ones that finish, and that the download workers are split between jobs. 
+
+    """
+    bucket_name,path_prefix = setup_analysis_bucket
+    paths = ["user1/results/completed_job","user1/results/uncompleted_job"]
+    download_workers = []
+    get_results = analyze.get_results
+    def record_workers(*args,**kwargs):
+        download_workers.append(kwargs["workers"])
+        return get_results(*args,**kwargs)
+    monkeypatch.setattr(analyze,"get_results",record_workers)
+    outcomes = analyze.poll_many(bucket_name,paths,str(tmp_path),step = 1,timeout = 3,workers = 8,min_step = 1,display = False)
+    assert outcomes == {"user1/results/completed_job":0,"user1/results/uncompleted_job":1}
+    assert download_workers == [4]
+    assert "end.txt" in os.listdir(os.path.join(tmp_path,"completed_job","process_results"))
+    assert "certificate.txt" in os.listdir(os.path.join(tmp_path,"uncompleted_job","logs"))
+
+def test_iter_objects_pagination(monkeypatch,setup_analysis_bucket):
+    """Tests that listings span several pages, respect limits, and group by delimiter. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_client = session.client("s3")
+    b,p = setup_analysis_bucket
+    keys = [os.path.join(p,"inputs","dir{}".format(i%3),"file{:04d}.txt".format(i)) for i in range(1010)]
+    for key in keys:
+        s3_client.put_object(Bucket = b,Key = key,Body = b"")
+    listed = analyze.iter_names(b,os.path.join(p,"inputs/"))
+    assert next(listed) == sorted(keys)[0]
+    assert [next(listed)]+list(listed) == sorted(keys)[1:]
+    assert len(list(analyze.iter_names(b,os.path.join(p,"inputs/"),limit = 5))) == 5
+    assert list(analyze.iter_names(b,os.path.join(p,"inputs/"),delimiter = "/")) == [os.path.join(p,"inputs","dir{}".format(i),"") for i in range(3)]
+    data,configs = analyze.list_inputs(b,p,limit = 10)
+    assert len(list(data)) == 10
+
+def test_sync_results(setup_analysis_bucket,tmp_path):
+    """Tests that nested keys are mirrored, that unchanged files are not downloaded again, and that deleted files are removed only on request. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_client = session.client("s3")
+    bucket_name,path_prefix = setup_analysis_bucket
+    prefix = "user1/inputs/sync_job/"
+    for key in ["process_results/a/out.txt","process_results/b/out.txt","logs/certificate.txt"]:
+        s3_client.put_object(Bucket = bucket_name,Key = prefix+key,Body = key.encode("utf-8"))
+    summary = analyze.sync_results(bucket_name,prefix,str(tmp_path))
+    assert len(summary["downloaded"]) == 3
+    for key in ["process_results/a/out.txt","process_results/b/out.txt","logs/certificate.txt"]:
+        with open(os.path.join(tmp_path,key)) as f:
+            assert f.read() == key
+
+    s3_client.put_object(Bucket = bucket_name,Key = prefix+"process_results/a/out.txt",Body = b"changed")
+    s3_client.delete_object(Bucket = bucket_name,Key = prefix+"process_results/b/out.txt")
+    summary = analyze.sync_results(bucket_name,prefix,str(tmp_path))
+    assert summary["downloaded"] == [prefix+"process_results/a/out.txt"]
+    assert summary["unchanged"] == 1
+    assert os.path.exists(os.path.join(tmp_path,"process_results","b","out.txt"))
+    with open(os.path.join(tmp_path,manifest.manifestname+".tmp"),"w") as f: ## left behind by an interrupted save. 
+        f.write("{}")
+    summary = analyze.sync_results(bucket_name,prefix,str(tmp_path),delete = True)
+    assert summary["deleted"] == [os.path.join(tmp_path,"process_results","b","out.txt")]
+    assert not os.path.exists(os.path.join(tmp_path,"process_results","b"))
+    assert os.path.exists(os.path.join(tmp_path,manifest.manifestname))
+
+    ## a key that is also the folder of other keys cannot be mirrored both ways: fail one key, sync the rest. 
+    prefix = "user1/inputs/sync_conflict/"
+    s3_client.put_object(Bucket = bucket_name,Key = prefix+"a",Body = b"file")
+    conflict = str(tmp_path / "conflict")
+    assert analyze.sync_results(bucket_name,prefix,conflict)["downloaded"] == [prefix+"a"]
+    for key in ["a/b","a/c/d","e"]:
+        s3_client.put_object(Bucket = bucket_name,Key = prefix+key,Body = b"file")
+    summary = analyze.sync_results(bucket_name,prefix,conflict)
+    assert sorted(summary["failed"]) == [prefix+"a/b",prefix+"a/c/d"]
+    assert summary["downloaded"] == [prefix+"e"]
+    summary = analyze.sync_results(bucket_name,prefix,str(tmp_path / "conflict_fresh"))
+    assert len(summary["failed"]) > 0
+    assert prefix+"e" in summary["downloaded"]
+
+def test_poll_stream(setup_analysis_bucket,tmp_path):
+    """Tests that result files are downloaded while polling once they are stable, and that only the remainder is downloaded when the job ends. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_client = session.client("s3")
+    bucket_name,path_prefix = setup_analysis_bucket
+    prefix = "user1/inputs/stream_job"
+    s3_client.put_object(Bucket = bucket_name,Key = prefix+"/logs/certificate.txt",Body = b"")
+    s3_client.put_object(Bucket = bucket_name,Key = prefix+"/process_results/part1.txt",Body = b"part1")
+    stream = analyze.stable_selector()
+    assert analyze.poll(bucket_name,prefix,str(tmp_path),stream = stream) == False
+    assert not os.path.exists(os.path.join(tmp_path,"process_results","part1.txt"))
+    s3_client.put_object(Bucket = bucket_name,Key = prefix+"/process_results/part2.txt",Body = b"part2")
+    assert analyze.poll(bucket_name,prefix,str(tmp_path),stream = stream) == False
+    assert os.listdir(os.path.join(tmp_path,"process_results")) == ["part1.txt"]
+    s3_client.put_object(Bucket = bucket_name,Key = prefix+"/process_results/end.txt",Body = b"")
+    summary = analyze.get_results(bucket_name,prefix,str(tmp_path))
+    assert sorted(summary["downloaded"]) == [prefix+"/process_results/end.txt",prefix+"/process_results/part2.txt"]
+    assert summary["unchanged"] == 1
+
+def test_get_logfiles_tail(setup_analysis_bucket,tmp_path,capsys):
+    """Tests that grown logfiles are fetched with ranged requests, that rewritten logfiles are downloaded in full, and that new content is echoed. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_client = session.client("s3")
+    bucket_name,path_prefix = setup_analysis_bucket
+    prefix = "user1/inputs/tail_job"
+    key = prefix+"/logs/logfile.txt"
+    first = b"x"*100+b"\n"
+    s3_client.put_object(Bucket = bucket_name,Key = key,Body = first)
+    analyze.get_logfiles(bucket_name,prefix,str(tmp_path),tail = True)
+    ranges = []
+    analyze.get_client("s3").meta.events.register("provide-client-params.s3.GetObject",lambda params,**kwargs: ranges.append(params.get("Range")))
+
+    s3_client.put_object(Bucket = bucket_name,Key = key,Body = first+b"line 2\n")
+    assert analyze.get_logfiles(bucket_name,prefix,str(tmp_path),tail = True,echo = True) == [key]
+    assert ranges == ["bytes={}-".format(len(first)-64)]
+    assert "line 2" in capsys.readouterr().out
+    with open(os.path.join(tmp_path,"logs","logfile.txt"),"rb") as f:
+        assert f.read() == first+b"line 2\n"
+
+    s3_client.put_object(Bucket = bucket_name,Key = key,Body = b"rewritten log with more lines\n"*10)
+    analyze.get_logfiles(bucket_name,prefix,str(tmp_path),tail = True)
+    with open(os.path.join(tmp_path,"logs","logfile.txt"),"rb") as f:
+        assert f.read() == b"rewritten log with more lines\n"*10
+
+def test_get_results_archive(setup_analysis_bucket,tmp_path):
+    """Tests that an archive of results is extracted instead of downloading each file, that members outside the output directory are skipped, and that results fall back to per file downloads without a usable archive. 
+
+    """
+    b,p = setup_analysis_bucket
+    client = analyze.get_client("s3")
+    prefix = "archive_test/archive_job"
+    contents = {"a.txt":b"a"*100,"nested/b.txt":b"b"*200,"../escape.txt":b"c"}
+    buf = io.BytesIO()
+    with tarfile.open(fileobj = buf,mode = "w:gz") as archive:
+        for name,data in contents.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info,io.BytesIO(data))
+    client.put_object(Bucket = b,Key = prefix+"/process_results/results.tar.gz",Body = buf.getvalue())
+    client.put_object(Bucket = b,Key = prefix+"/process_results/end.txt",Body = b"end")
+
+    summary = analyze.get_results(b,prefix,str(tmp_path),archive = True)
+    assert summary["archive"] == prefix+"/process_results/results.tar.gz"
+    with open(tmp_path / "process_results" / "nested" / "b.txt","rb") as f:
+        assert f.read() == b"b"*200
+    assert not os.path.exists(tmp_path / "escape.txt")
+    assert not os.path.exists(tmp_path / "process_results" / "end.txt")
+    assert analyze.get_results(b,prefix,str(tmp_path),archive = True)["unchanged"] == 1
+
+    client.put_object(Bucket = b,Key = prefix+"/process_results/results.tar.gz",Body = b"not an archive")
+    summary = analyze.get_results(b,prefix,str(tmp_path / "corrupt"),archive = True)
+    assert "archive" not in summary
+    assert os.path.exists(tmp_path / "corrupt" / "process_results" / "end.txt")
+
+    summary = analyze.get_results(b,"user1/results/completed_job",str(tmp_path / "none"),archive = True)
+    assert summary["downloaded"] == ["user1/results/completed_job/process_results/end.txt"]
+
+    ## after streaming, the archive is not extracted over the streamed files, and not downloaded. 
+    prefix = "archive_test/streamed_job"
+    client.put_object(Bucket = b,Key = prefix+"/process_results/results.tar.gz",Body = buf.getvalue())
+    for name in ["a.txt","nested/b.txt"]:
+        client.put_object(Bucket = b,Key = prefix+"/process_results/"+name,Body = contents[name])
+    streamed = str(tmp_path / "streamed")
+    analyze.get_results(b,prefix,streamed,select = lambda r: r["Key"].endswith("a.txt"))
+    summary = analyze.get_results(b,prefix,streamed,archive = True)
+    assert "archive" not in summary
+    assert summary["downloaded"] == [prefix+"/process_results/nested/b.txt"]
+    assert not os.path.exists(os.path.join(streamed,"process_results","results.tar.gz"))
+    summary = analyze.get_results(b,prefix,streamed,archive = True)
+    assert summary["downloaded"] == [] and summary["unchanged"] == 2
+
+def test_transport(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that clients are built with the shared transport settings, that settings from the config file are overridden by those given per command, and that unknown settings are rejected. 
+
+    """
+    from neurocaas_cli import commands
+    monkeypatch.setattr(clients,"_transport",dict(clients.default_transport))
+    b,p = setup_analysis_bucket
+    client = analyze.get_client("s3")
+    assert client.meta.config.max_pool_connections == 32
+    assert client.meta.config.retries["mode"] == "adaptive"
+    assert analyze.get_client("s3",max_pool_connections = 64).meta.config.max_pool_connections == 64
+
+    commands.configure_transport({"max_pool_connections":16,"retry_mode":"standard","max_attempts":3},max_pool_connections = None,retry_mode = None,max_attempts = 5,connect_timeout = 2,read_timeout = None)
+    client = analyze.get_client("s3")
+    assert client.meta.config.max_pool_connections == 16
+    assert client.meta.config.retries == {"mode":"standard","total_max_attempts":5}
+    assert client.meta.config.connect_timeout == 2
+    assert client.meta.config.read_timeout == 60
+    assert client.list_objects_v2(Bucket = b,Prefix = "user1/")["KeyCount"] > 0
+
+    with pytest.raises(click.ClickException):
+        commands.configure_transport({"pool":16})
+
+def test_mapped_part(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that a mapped part reads and seeks like the same bytes in a file, for offsets that are not aligned to pages, and that parts are sent the same way with and without mmap. 
+
+    """
+    data = os.urandom(3*Interface_S3.min_part_size+1000)
+    localpath = str(tmp_path / "mapped.bin")
+    with open(localpath,"wb") as f:
+        f.write(data)
+    with Interface_S3.MappedPart(localpath,12345,100000) as part:
+        assert len(part) == 100000
+        assert part.read(10) == data[12345:12355]
+        assert part.read() == data[12355:112345]
+        assert part.read(10) == b""
+        part.seek(0)
+        assert part.tell() == 0
+        assert part.read(5) == data[12345:12350]
+        part.seek(-5,2)
+        assert part.read() == data[112340:112345]
+        assert bytes(part.view) == data[12345:112345]
+
+    monkeypatch.setattr(Interface_S3, "statepath", str(tmp_path / "state"))
+    b,p = setup_analysis_bucket
+    client = analyze.get_client("s3")
+    config = Interface_S3.TransferConfig(multipart_threshold = Interface_S3.min_part_size,multipart_chunksize = Interface_S3.min_part_size,max_concurrency = 2)
+    for use_mmap in [True,False]:
+        key = "mapped_test/mapped_{}.bin".format(use_mmap)
+        Interface_S3.upload_resumable(client,localpath,b,key,config = config,use_mmap = use_mmap)
+        assert client.get_object(Bucket = b,Key = key)["Body"].read() == data
@@ -0,0 +1,65 @@
+## test suite for cache.py 
+import os
+import itertools
+import localstack_client.session
+from neurocaas_cli import analyze,Interface_S3,cache
+
+loc = os.path.abspath(os.path.dirname(__file__))
+test_upload_mats = os.path.join(loc,"test_mats","test_local_mats")
+
+def test_list_inputs_cached(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that listings are served from the cache, that our own uploads write through to it, and that refresh bypasses it. 
+
+    """
+    session = localstack_client.session.Session()
+    s3_client = session.client("s3")
+    monkeypatch.setattr(Interface_S3, "statepath", str(tmp_path / "state"))
+    monkeypatch.setattr(Interface_S3, "etag_cache", None)
+    b,p = setup_analysis_bucket
+    assert [list(l) for l in analyze.list_inputs(b,p)] == [[],[]]
+    analyze.upload_data(b,p,os.path.join(test_upload_mats,"inputs","datafile.json"))
+    s3_client.put_object(Bucket = b,Key = os.path.join(p,"inputs","other_upload.json"),Body = b"")
+    data,configs = analyze.list_inputs(b,p)
+    assert list(data) == [os.path.join(p,"inputs","datafile.json")]
+    data,configs = analyze.list_inputs(b,p,refresh = True)
+    assert list(data) == [os.path.join(p,"inputs","datafile.json"),os.path.join(p,"inputs","other_upload.json")]
+
+    ## listings that are stopped early or are too large are not cached. 
+    prefix = os.path.join(p,"inputs/")
+    analyze.listing_cache.invalidate(b)
+    assert len(list(itertools.islice(analyze.iter_objects_cached(b,prefix),1))) == 1
+    assert analyze.listing_cache.get(b,prefix) is None
+    monkeypatch.setattr(analyze.listing_cache,"max_records",1)
+    assert len(list(analyze.iter_objects_cached(b,prefix))) == 2
+    assert analyze.listing_cache.get(b,prefix) is None
+    monkeypatch.setattr(analyze.listing_cache,"max_records",2)
+    assert len(list(analyze.iter_objects_cached(b,prefix))) == 2
+    assert len(analyze.listing_cache.get(b,prefix)) == 2
+
+def test_listing_cache(tmp_path,monkeypatch):
+    """Tests expiry, write through (one object or a batch) and invalidation of cached listings. 
+
+    """
+    listings = cache.ListingCache(str(tmp_path),ttl = 60)
+    listings.put("bucket","user1/results/","/",[{"Prefix":"user1/results/job__1/"}])
+    listings.put("bucket","user1/inputs/",None,[])
+    listings.record("bucket",{"Key":"user1/results/job__2/logs/certificate.txt"})
+    listings.record("bucket",{"Key":"user1/inputs/data.json","Size":10})
+    assert listings.get("bucket","user1/results/","/") == [{"Prefix":"user1/results/job__1/"},{"Prefix":"user1/results/job__2/"}]
+    assert listings.get("bucket","user1/inputs/") == [{"Key":"user1/inputs/data.json","Size":10}]
+    listings.invalidate("bucket","user1/results/")
+    assert listings.get("bucket","user1/results/","/") is None
+    assert listings.get("bucket","user1/inputs/") is not None
+    listings.put("bucket","user1/configs/",None,[],listed = 0)
+    assert listings.get("bucket","user1/configs/") is None
+
+    ## a batch rewrites each matching listing once, does not read the others, and drops expired ones. 
+    listings.put("bucket","user1/configs/",None,[])
+    read = []
+    original = listings.read
+    monkeypatch.setattr(listings,"read",lambda entrypath: read.append(entrypath) or original(entrypath))
+    listings.put("bucket","user1/old/",None,[],listed = 0)
+    listings.record_many("bucket",[{"Key":"user1/inputs/{}.json".format(i),"Size":i} for i in range(3)]+[{"Key":"user1/inputs/data.json","Size":20}])
+    assert read == [listings.entrypath("bucket","user1/inputs/")]
+    assert listings.get("bucket","user1/inputs/") == [{"Key":"user1/inputs/0.json","Size":0},{"Key":"user1/inputs/1.json","Size":1},{"Key":"user1/inputs/2.json","Size":2},{"Key":"user1/inputs/data.json","Size":20}]
+    assert not os.path.exists(listings.entrypath("bucket","user1/old/"))
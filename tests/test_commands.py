@@ -0,0 +1,63 @@
+## test suite for commands.py 
+import os
+import sys
+import json
+import subprocess
+
+loc = os.path.abspath(os.path.dirname(__file__))
+
+def test_help_does_not_import_boto3():
+    """Tests that boto3 is only imported once a command needs it, so that the cli starts quickly. 
+
+    """
+    check = "import sys; from neurocaas_cli import commands; print('boto3' in sys.modules)"
+    output = subprocess.run([sys.executable,"-c",check],stdout = subprocess.PIPE,universal_newlines = True).stdout
+    assert output.strip() == "False"
+
+def run_cli(monkeypatch,tmp_path,args):
+    """Run the cli in this process with a config file in tmp_path, and no daemon. 
+
+    """
+    from click.testing import CliRunner
+    from neurocaas_cli import commands
+    configpath = tmp_path / "config.json"
+    configpath.write_text(json.dumps({"bucketname":"bucket","groupprefix":"group"}))
+    monkeypatch.setattr(commands,"configpath",str(configpath))
+    return CliRunner().invoke(commands.cli,["--no-daemon"]+args)
+
+def test_poll_many_requires_localpath(monkeypatch,tmp_path):
+    """Tests that poll-many asks for the local path instead of failing on it. 
+
+    """
+    result = run_cli(monkeypatch,tmp_path,["analyze","poll-many","-rp","job"])
+    assert result.exit_code == 2
+    assert "--localpath" in result.output
+
+def test_sync_results_requires_localpath(monkeypatch,tmp_path):
+    """Tests that sync-results asks for the local path instead of failing on it. 
+
+    """
+    result = run_cli(monkeypatch,tmp_path,["analyze","sync-results","-a"])
+    assert result.exit_code == 2
+    assert "--localpath" in result.output
+
+def test_upload_data_zstd_requires_zstandard(monkeypatch,tmp_path):
+    """Tests that zstd compression without the zstandard package is reported before anything is uploaded. 
+
+    """
+    monkeypatch.setitem(sys.modules,"zstandard",None)
+    datapath = tmp_path / "data.txt"
+    datapath.write_text("data")
+    result = run_cli(monkeypatch,tmp_path,["analyze","upload-data","-d",str(datapath),"--compress","zstd"])
+    assert result.exit_code == 1
+    assert "pip install zstandard" in result.output
+
+def test_submit_batch_bad_manifest(monkeypatch,tmp_path):
+    """Tests that a manifest that is not a list of jobs is reported with its name, without a traceback. 
+
+    """
+    manifestpath = tmp_path / "jobs.json"
+    manifestpath.write_text(json.dumps({"dataname":"inputs/a.json","configname":"configs/config.yaml"}))
+    result = run_cli(monkeypatch,tmp_path,["analyze","submit-batch","-m",str(manifestpath)])
+    assert result.exit_code == 1
+    assert "jobs.json" in result.output
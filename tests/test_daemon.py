@@ -0,0 +1,42 @@
+## test suite for daemon.py 
+import sys
+import time
+import threading
+import pytest
+from neurocaas_cli import analyze,daemon
+
+def test_daemon(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that commands sent to the daemon run there with their output streamed back, that failures are reported to the caller, and that the daemon lists running commands and stops on request. 
+
+    """
+    from neurocaas_cli import commands
+    monkeypatch.setattr(daemon,"daemonpath",str(tmp_path))
+    monkeypatch.setattr(daemon,"socketpath",str(tmp_path / "d.sock"))
+    monkeypatch.setattr(daemon,"serving",False)
+    monkeypatch.setattr(commands,"configpath",str(tmp_path / "missing_config.json"))
+    monkeypatch.setattr(sys,"stdout",sys.stdout)
+    monkeypatch.setattr(sys,"stderr",sys.stderr)
+    b,p = setup_analysis_bucket
+    config = {"bucketname":b,"groupprefix":p}
+    assert not daemon.running()
+    assert daemon.run("list-results",{"limit":None,"refresh":True},config,None) is False
+
+    server = threading.Thread(target = daemon.serve)
+    server.start()
+    try:
+        for i in range(100):
+            if daemon.running():
+                break
+            time.sleep(0.05)
+        output = []
+        assert daemon.run("list-results",{"limit":None,"refresh":True},config,lambda text,err: output.append(text))
+        assert "".join(output).split() == list(analyze.list_results(b,p,refresh = True))
+        with pytest.raises(daemon.DaemonError):
+            daemon.run("submit-batch",{"manifest":str(tmp_path / "missing.csv"),"workers":1},config,lambda text,err: None)
+        status = daemon.request({"op":"status"})
+        assert status["active"] == []
+        assert daemon.request({"op":"stop"})["stopping"]
+    finally:
+        server.join(10)
+    assert not server.is_alive()
+    assert not daemon.running()
@@ -0,0 +1,34 @@
+## test suite for jobindex.py 
+from neurocaas_cli import analyze,telemetry
+
+def test_job_status(monkeypatch,setup_analysis_bucket):
+    """Tests that the job index learns about submitted and listed jobs, only checks unfinished jobs, and answers queries without requests to s3. 
+
+    """
+    monkeypatch.setattr(telemetry,"recorder",telemetry.Recorder())
+    b,p = setup_analysis_bucket
+    client = analyze.get_client("s3")
+    tag = analyze.batch_tags(1)[0]
+    group = "status_{}".format(tag)
+    analyze.submit_job(b,group,["inputs/a.json"],"configs/config.yaml",tag)
+    client.put_object(Bucket = b,Key = "{}/results/job__{}_old/process_results/end.txt".format(group,b),Body = b"")
+
+    jobs = {job["tag"]:job for job in analyze.job_status(b,group)}
+    assert jobs[tag]["state"] == "submitted"
+    assert jobs[tag]["dataname"] == ["inputs/a.json"]
+    assert jobs["old"]["state"] == "finished"
+    assert jobs["old"]["ended"] is not None
+
+    client.put_object(Bucket = b,Key = "{}/results/job__{}_{}/logs/certificate.txt".format(group,b,tag),Body = b"")
+    assert analyze.job_status(b,group,state = "running")[0]["tag"] == tag
+    client.put_object(Bucket = b,Key = "{}/results/job__{}_{}/process_results/end.txt".format(group,b,tag),Body = b"")
+    telemetry.recorder.enable()
+    assert analyze.refresh_job_index(b,group) == {"listed":2,"checked":1,"finished":1}
+    assert telemetry.recorder.summary()["operations"]["s3.HeadObject"]["requests"] == 1
+    assert analyze.refresh_job_index(b,group)["checked"] == 0
+
+    telemetry.recorder.enable()
+    jobs = analyze.job_status(b,group,sort = "ended",descending = True,refresh = False)
+    assert [job["tag"] for job in jobs] == [tag,"old"]
+    assert telemetry.recorder.summary()["operations"] == {}
+    assert analyze.job_status(b,p,refresh = False) == []
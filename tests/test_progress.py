@@ -0,0 +1,43 @@
+## test suite for progress.py 
+import io
+import threading
+from neurocaas_cli import analyze,Interface_S3,progress
+
+def test_progress(setup_analysis_bucket,tmp_path):
+    """Tests that progress aggregates bytes across threads, that log mode only prints milestones, and that transfers report to a single aggregated progress. 
+
+    """
+    stream = io.StringIO()
+    log = progress.Progress(total = 8*10000,mode = "log",stream = stream)
+    threads = [threading.Thread(target = lambda : [log(1) for i in range(10000)]) for t in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    log.finish()
+    assert log.seen == 8*10000
+    lines = stream.getvalue().splitlines()
+    assert 1 <= len(lines) <= 11
+    assert "(100.00%)" in lines[-1]
+
+    stream = io.StringIO()
+    bar = progress.Progress(total = 100,mode = "bar",interval = 3600,stream = stream)
+    for i in range(100):
+        bar(1)
+    bar.finish()
+    assert stream.getvalue().count("\r") == 2
+
+    quiet = progress.Progress(mode = "quiet",stream = stream)
+    quiet(10)
+    quiet.finish()
+    assert quiet.seen == 10
+
+    b,p = setup_analysis_bucket
+    stream = io.StringIO()
+    aggregate = progress.Progress(total = 0,files = 2,mode = "log",stream = stream)
+    client = analyze.get_client("s3")
+    client.put_object(Bucket = b,Key = "progress/a.bin",Body = b"a"*1000)
+    client.put_object(Bucket = b,Key = "progress/b.bin",Body = b"b"*3000)
+    aggregate.add_total(4000)
+    summary = Interface_S3.download_many(client,b,[("progress/a.bin",str(tmp_path / "a.bin")),("progress/b.bin",str(tmp_path / "b.bin"))],progress = aggregate)
+    assert len(summary["downloaded"]) == 2
+    assert aggregate.seen == 4000
+    assert "2/2 files" in stream.getvalue().splitlines()[-1]
@@ -0,0 +1,60 @@
+## test suite for telemetry.py 
+import json
+import pytest
+from botocore.exceptions import ClientError
+from neurocaas_cli import analyze,telemetry
+
+def test_telemetry(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that requests made through shared clients are recorded with their bytes, and written as JSON lines and OpenMetrics text. 
+
+    """
+    monkeypatch.setattr(telemetry,"recorder",telemetry.Recorder())
+    b,p = setup_analysis_bucket
+    client = analyze.get_client("s3")
+    client.put_object(Bucket = b,Key = "telemetry/a.bin",Body = b"a"*1000)
+    telemetry.recorder.enable()
+    client.put_object(Bucket = b,Key = "telemetry/b.bin",Body = b"b"*2000)
+    client.get_object(Bucket = b,Key = "telemetry/b.bin")["Body"].read()
+    list(analyze.iter_objects(b,"telemetry/"))
+    with pytest.raises(ClientError):
+        client.head_object(Bucket = b,Key = "telemetry/missing.bin")
+
+    operations = telemetry.recorder.summary()["operations"]
+    assert operations["s3.PutObject"]["requests"] == 1
+    assert operations["s3.PutObject"]["bytes_sent"] == 2000
+    assert operations["s3.GetObject"]["bytes_received"] == 2000
+    assert operations["s3.ListObjectsV2"]["requests"] == 1
+    assert operations["s3.HeadObject"]["errors"] == 1
+    assert "s3.PutObject" in telemetry.recorder.format_summary()
+
+    telemetry.recorder.write_jsonl(str(tmp_path / "metrics.jsonl"))
+    with open(tmp_path / "metrics.jsonl") as f:
+        records = [json.loads(line) for line in f]
+    assert [r["operation"] for r in records] == ["PutObject","GetObject","ListObjectsV2","HeadObject"]
+    telemetry.recorder.write_openmetrics(str(tmp_path / "metrics.prom"))
+    text = (tmp_path / "metrics.prom").read_text()
+    assert 'neurocaas_aws_bytes_sent_total{service="s3",operation="PutObject"} 2000' in text
+    assert text.endswith("# EOF\n")
+
+def test_telemetry_connection_error(monkeypatch):
+    """Tests that a request failing before any response (nothing listening on the endpoint) raises its own error while instrumented, and is recorded as an error. 
+
+    """
+    import socket
+    import botocore.session
+    import botocore.config
+    import botocore.exceptions
+    monkeypatch.setattr(telemetry,"recorder",telemetry.Recorder())
+    listener = socket.socket()
+    listener.bind(("127.0.0.1",0))
+    port = listener.getsockname()[1]
+    listener.close() ## nothing listens on this port any more. 
+    client = botocore.session.get_session().create_client("s3",region_name = "us-east-1",endpoint_url = "http://127.0.0.1:{}".format(port),
+            aws_access_key_id = "test",aws_secret_access_key = "test",config = botocore.config.Config(connect_timeout = 1,retries = {"total_max_attempts":1}))
+    telemetry.instrument(client)
+    telemetry.recorder.enable()
+    with pytest.raises(botocore.exceptions.EndpointConnectionError):
+        client.head_bucket(Bucket = "telemetry-bucket")
+    operations = telemetry.recorder.summary()["operations"]
+    assert operations["s3.HeadBucket"]["requests"] == 1
+    assert operations["s3.HeadBucket"]["errors"] == 1
@@ -0,0 +1,47 @@
+## test suite for throttle.py 
+import os
+import time
+import threading
+import pytest
+from neurocaas_cli import analyze,Interface_S3,throttle
+
+def test_throttle(monkeypatch,setup_analysis_bucket,tmp_path):
+    """Tests that the token bucket holds transfers to the rate, that a large transfer with many threads does not hold back a small one, and that limits apply to uploads and downloads. 
+
+    """
+    bucket = throttle.TokenBucket(4e6)
+    start = time.monotonic()
+    ends = {}
+    def transfer(key,amount):
+        bucket.consume(amount,key)
+        ends[key] = time.monotonic()-start
+    big = [threading.Thread(target = transfer,args = ("big",400000)) for i in range(8)]
+    [t.start() for t in big]
+    time.sleep(0.05)
+    small = threading.Thread(target = transfer,args = ("small",64*1024))
+    small.start()
+    [t.join() for t in big+[small]]
+    assert ends["big"] >= (8*400000-bucket.burst)/4e6*0.9
+    assert ends["small"] < 0.3
+
+    monkeypatch.setattr(throttle,"buckets",{"upload":None,"download":None})
+    b,p = setup_analysis_bucket
+    localpath = tmp_path / "throttled.bin"
+    localpath.write_bytes(os.urandom(1000000))
+    throttle.set_limit("upload",2)
+    throttle.set_limit("download",2)
+    start = time.monotonic()
+    Interface_S3.upload(str(localpath),"s3://{}/throttle_test/throttled.bin".format(b))
+    assert time.monotonic()-start >= 0.2
+    start = time.monotonic()
+    summary = Interface_S3.download_many(analyze.get_client("s3"),b,[("throttle_test/throttled.bin",str(tmp_path / "copy.bin"))])
+    assert time.monotonic()-start >= 0.2
+    assert summary["downloaded"] == ["throttle_test/throttled.bin"]
+    assert (tmp_path / "copy.bin").read_bytes() == localpath.read_bytes()
+    with pytest.raises(ValueError):
+        throttle.set_limit("upload",0)
+
+    consumed = []
+    monkeypatch.setattr(throttle,"consume",lambda direction,amount,key = None: consumed.append((direction,key)))
+    analyze.get_logfiles(b,"user1/results/completed_job",str(tmp_path))
+    assert ("download","user1/results/completed_job/logs/certificate.txt") in consumed